@@ -3,7 +3,8 @@
 #SBATCH --output=/well/ludwig/users/cnr137/methylation_model/logs/samples/%A.out
 #SBATCH --error=/well/ludwig/users/cnr137/methylation_model/logs/samples/%A.err
 #SBATCH --time=96:00:00
-#SBATCH --mem=600G
+#SBATCH --mem=64G
+#SBATCH --cpus-per-task=16
 
 
 ###------------------------------------------------- module loading 
@@ -19,12 +20,15 @@ source /apps/eb/el8/2023a/skylake/software/Miniforge3/24.1.2-0/etc/profile.d/con
 conda activate /users/ludwig/cnr137/.conda/envs/epigenetics_env
 ###------------------------------------------------- flag definition and default definition
 
-while getopts "w:c:t:o:" flag; do
+DESIGNS=()
+while getopts "w:c:t:o:s:d:" flag; do
     case "${flag}" in
         w) WORKDIR="${OPTARG}" ;;       # workdir
         c) CFDNA_DIR="${OPTARG}" ;;     # cfDNA directory
         t) TISSUE_DIR="${OPTARG}" ;;    # tissue directory
         o) OUTDIR="${OPTARG}" ;;        # output directory
+        s) SEED="${OPTARG}" ;;          # base seed (optional, makes the cohort reproducible)
+        d) DESIGNS+=("${OPTARG}") ;;    # mixture design file, repeatable (default: designs/standard.toml)
     esac
 done
 
@@ -46,27 +50,28 @@ mkdir -p "$OUTDIR"
 
 ###------------------------------------------------------ processing pipeline
 
-# Filter cfDNA files to only R1
-# NR=1: ignore the header, col 9 contains flags
-for f in "$CFDNA_DIR"/*.bed.gz; do
-    echo "Filtering R1 reads in $f"
-    zcat "$f" | awk 'NR==1 || and($9,64)' | gzip > "${f}.tmp" && mv "${f}.tmp" "$f"
-done
-
-# Filter tissue files to only R1
-# NR=1: ignore the header, col 9 contains flags
-for f in "$TISSUE_DIR"/*.bed.gz; do
-    echo "Filtering R1 reads in $f"
-    zcat "$f" | awk 'NR==1 || and($9,64)' | gzip > "${f}.tmp" && mv "${f}.tmp" "$f"
-done
+# R1 filtering happens inside Generate_samples.py while the read pools are built (one pass per file,
+# files in parallel); the input files are no longer rewritten in place.
 
 cd "$WORKDIR" || { echo "Error: Cannot change to working directory $WORKDIR"; exit 1; }
 
+# One sample per worker, each with its own seeded random stream
+# Several designs (-d a.toml -d b.toml) are generated in one run, each into $OUTDIR/<design name>
 python Generate_samples.py \
     --cfDNA_dir "$CFDNA_DIR" \
     --tissue_dir "$TISSUE_DIR" \
-    --output_dir "$OUTDIR"
+    --output_dir "$OUTDIR" \
+    ${DESIGNS[@]:+--design "${DESIGNS[@]}"} \
+    --n_workers "${SLURM_CPUS_PER_TASK:-1}" \
+    ${SEED:+--seed "$SEED"}
 
 
 # Example usage:
 # sbatch -p long 01-create_samples.sh -w /users/ludwig/cnr137 -c /well/ludwig/users/cnr137/methylation_model/healthy_cfdna_samples -t /well/ludwig/users/cnr137/methylation_model/tissue_samples -o /well/ludwig/users/cnr137/methylation_model/generated_samples
+
+# Feature-space mode (no synthetic BED files; writes FeatureMatrix.csv/Target.csv straight into the output dir):
+# python Generate_samples.py --cfDNA_dir <cfDNA dir> --tissue_dir <tissue dir> --output_dir <outdir> --mode features --windows /well/ludwig/users/cnr137/references/windows.bed
+# Coordinate-sorted, tabix-indexed synthetic samples: add --sorted to the Generate_samples.py call above
+# Several cohort designs in one pool-loading session (outputs in <outdir>/standard and <outdir>/purity_corrected):
+# sbatch -p long 01-create_samples.sh ... -d designs/standard.toml -d designs/purity_corrected.toml
+# Reruns only build new or changed samples (see <outdir>/manifest.jsonl); raise n in the design to grow a cohort, add --force to rebuild all
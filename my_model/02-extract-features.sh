@@ -3,6 +3,7 @@
 #SBATCH --output=/well/ludwig/users/cnr137/methylation_model/logs/binning/%A.out
 #SBATCH --error=/well/ludwig/users/cnr137/methylation_model/logs/binning/%A.err
 #SBATCH --time=96:00:00
+#SBATCH --cpus-per-task=16
 #SBATCH --mem=200G
 
 ###------------------------------------------------- module loading 
@@ -17,13 +18,17 @@ conda activate /users/ludwig/cnr137/.conda/envs/epigenetics_env
 
 ###------------------------------------------------- flag definition and default definition
 
-while getopts "w:s:r:f:g:" flag; do
+while getopts "w:s:r:f:g:mx:b:c:" flag; do
     case "${flag}" in
         w) WORKDIR="${OPTARG}" ;;       
         s) SAMPLEDIR="${OPTARG}" ;;
         r) REFDIR="${OPTARG}" ;; 
         f) FEATUREDIR="${OPTARG}" ;;
-        g) GC_CORRECTION="${OPTARG}" ;;      
+        g) GC_CORRECTION="${OPTARG}" ;;
+        m) MERGE="true" ;;              # merge step after all array tasks
+        x) RESOLUTIONS="${OPTARG}" ;;   # window sizes in bp, e.g. "5000000 1000000 100000" (default: windows.bed only)
+        b) REGION_BEDS="${OPTARG}" ;;   # region-set BEDs, e.g. "$REFDIR/liver_dmrs.bed $REFDIR/cpg_islands.bed" (features in <featuredir>/regions/<name>)
+        c) GC_MODEL="${OPTARG}" ;;      # GC trend for -g true: ols (default), loess or panel ($REFDIR/gc_panel.tsv, see below)
     esac
 done
 
@@ -54,102 +59,98 @@ cd "$WORKDIR"
 ###------------------------------------------------------ processing pipeline
 
 #----- Step 1: Create references (if needed) -------
-# Step 1a: Create genome windows
-WINDOWS_BED="$REFDIR"/"windows.bed"
-
-if [[ ! -f $WINDOWS_BED ]]; then
-    echo "Creating genome windows..."
-    fetchChromSizes hg38 | grep -v '_' | \
-      awk -v FS="\t" -v OFS="\t" '{ print $1, "0", $2 }' | \
-      sort-bed - | bedops --chop 5000000 - > "$WINDOWS_BED"
+# Array tasks run concurrently, so the references have to exist before an array is submitted
+if [[ -n "$SLURM_ARRAY_TASK_ID" && ( ! -f "$REFDIR/windows.bed" || ! -f "$REFDIR/gc_content_windows.bed" ) ]]; then
+    echo "Error: create the references in $REFDIR with a single (non-array) run first"; exit 1
 fi
 
-# Step 2b: Make sure GC content per window is available if GC correction is needed
+# Step 1a/1b: genome windows and their GC content (plus CpG density and N fraction in composition_windows.tsv),
+# built offline from hg38.fa and its .fai with a memory-mapped FASTA (Build_reference.py); no-op when up to date
+WINDOWS_BED="$REFDIR"/"windows.bed"
 GC_BED="$REFDIR/gc_content_windows.bed"
 
-if [[ ! -f $GC_BED ]]; then
-    echo "Calculating GC content..."
-    bedtools nuc -fi "$REFDIR/hg38.fa" -bed "$WINDOWS_BED" | \
-      awk 'NR > 1 {print $1, $2, $3, $5}' OFS="\t" > "$GC_BED"
+# (existing references without hg38.fa next to them are used as they are)
+if [[ -z "$SLURM_ARRAY_TASK_ID" && ( -f "$REFDIR/hg38.fa" || ! -f "$WINDOWS_BED" || ! -f "$GC_BED" ) ]]; then
+    echo "Checking references..."
+    python "$WORKDIR/Build_reference.py" --fasta "$REFDIR/hg38.fa" --out_dir "$REFDIR" --window_size 5000000
 fi
 
-#------- Step 2: Convert BED files into desired format ----------
-# org: chr	start	end	read_id	mapq	orientation	insert_size	read_length	flag	num_cpg	num_mod	mod_cps	unmod_cpgs	snp_cpgs
-# goal: chr    start    end    num_CpGs    methylation_level
-mkdir -p "$SAMPLEDIR/tmp/"
-for file in "$SAMPLEDIR"/*.bed.gz; do
-  base=$(basename "$file" .bed.gz)
-  echo "Converting $base..."
-  mkdir -p "$SAMPLEDIR/tmp/${base}/"
-  cd "$SAMPLEDIR/tmp/${base}/" 
-  CONVERTED="${base}_converted.bed"
-
-  zcat "$file" | awk -v FS="\t" -v OFS="\t" '
-  BEGIN { OFS="\t" }
-  !/^#/ {
-    mapq = $5;
-    num_CpGs = $10;
-    if (mapq > 10 && num_CpGs ~ /^[0-9]+$/ && num_CpGs > 0) {
-      methyl_level = $11/num_CpGs;
-      print $1, $2, $3, num_CpGs, methyl_level
-    }
-  }' > "$CONVERTED"
-done
-
-#------- Step 3: Process BED files and calculate counts of reads and hypomethylated reads per window -------
-for file in "$SAMPLEDIR"/*.bed.gz; do
-  base=$(basename "$file" .bed.gz)
-  mkdir -p "$SAMPLEDIR/tmp/${base}/"
-  CONVERTED="${base}_converted.bed"
-  cd "$SAMPLEDIR/tmp/${base}/" 
-
-  # Step 3a: Filter reads with >=2 CpGs (col 4 = num_CpGs)
-  FILTERED="${base}_filtered.bed"
-  awk -v FS="\t" -v OFS="\t" '$4 >= 2 { print $1, $2, $3, ".", $4, $5 }' "$CONVERTED" | sort-bed - > "$FILTERED"
-
-  # Step 3b: Select hypomethylated reads from BED (hypomethylated = methylation level =< 0.35)
-  HYPO="${base}_hypo.bed"
-  awk -v FS="\t" -v OFS="\t" '$4 >= 3 && $5 <= 0.35 { print $1, $2, $3, ".", $4, $5 }' "$CONVERTED" | sort-bed - > "$HYPO"
-
-  # Step 3c: Count total reads in each window
-  TOTAL_COUNT="${base}_total.count"
-  bedmap --count "$WINDOWS_BED" "$FILTERED" > "$TOTAL_COUNT"
-
-  # Step 3d: Count hypomethylated reads in each window
-  HYPO_COUNT="${base}_hypo.count"
-  bedmap --count "$WINDOWS_BED" "$HYPO" > "$HYPO_COUNT"
+#------- Merge step: after all array tasks, check every sample is done and assemble FeatureMatrix.csv -------
+if [[ "$MERGE" == "true" ]]; then
+  python "$WORKDIR/Extract_features.py" --input "$SAMPLEDIR"/*.bed.gz --windows "$WINDOWS_BED" --out_dir "$FEATUREDIR" ${RESOLUTIONS:+--resolutions $RESOLUTIONS} ${REGION_BEDS:+--regions $REGION_BEDS} --level_bins 10 --fragments --merge
+  exit $?
+fi
 
-  # Step 3e: Calculate hypomethylation fraction per window 
-  FRACTION="${base}_hypo_fraction.bed"
-  paste "$WINDOWS_BED" "$HYPO_COUNT" "$TOTAL_COUNT" | \
-    awk -v OFS="\t" '{ if ($5 == 0) frac = "NA"; else frac = $4 / $5; print $1, $2, $3, frac }' > "$FRACTION"
+#------- Step 2+3: Count reads and hypomethylated reads per window and calculate the hypomethylation fraction -------
+# org: chr	start	end	read_id	mapq	orientation	insert_size	read_length	flag	num_cpg	num_mod	mod_cps	unmod_cpgs	snp_cpgs (layout detected per file)
+# One streaming pass per sample (Extract_features.py), no filtered/sorted intermediate files:
+#   total = mapq > 10 and >= 2 CpGs; hypo = mapq > 10, >= 3 CpGs and methylation level <= 0.35
+#   reads are counted in every window they overlap, as bedmap --count did
+#   the per-read layout is detected per file (header / column count); Parquet or Arrow copies of the calls
+#   (python per_read.py --input <bed.gz> --out_dir <dir>, needs pyarrow) are read with column projection
+# Samples are counted in parallel on the job's CPUs within its memory; as a SLURM array (sbatch --array=0-N)
+# every task counts its own shard of the samples (balanced by file size) and its own GC correction.
+COUNTS_DIR="$SAMPLEDIR/tmp/counts"
+SHARD_LIST="$COUNTS_DIR/shard_${SLURM_ARRAY_TASK_ID:-0}.txt"
+# --level_bins: per-window methylation-level histogram (10 bins), mean, variance and entropy from the same pass,
+#   stacked by the merge step into $FEATUREDIR/LevelFeatures.npy (Select_model.py --LevelFeatures)
+# --fragments: per-window fragment counts by size class (DELFI short/long etc.), hypo/total per class and a size
+#   histogram, stacked into $FEATUREDIR/FragmentCounts.npy and FragmentFeatures.npy (Select_model.py --FragmentFeatures)
+# per-window (num_cpg x methylation) histograms: features for other thresholds without rereading the reads (count_cache.py)
+HIST_DIR="$SAMPLEDIR/tmp/hist"
+# one-time conversion of every sample into a memory-mapped columnar store (read_store.py), done by the worker that
+# counts it: recounts (cache misses for new flags, regions or windows) read the stores instead of parsing the text.
+# The stores are only for extraction; sampling and R1 filtering in 01 use the generator's spools (read_pools.py)
+STORE_DIR="$SAMPLEDIR/tmp/reads"
+# content-addressed cache (input sha256 + windows + parameters): a rerun only counts / corrects what changed
+CACHE_DIR="$SAMPLEDIR/tmp/cache"
+GC_ARGS=()
+RESOLUTION_ARGS=()
+if [[ -n "$RESOLUTIONS" ]]; then
+  # all sizes counted in the same pass; outputs in $FEATUREDIR/<size> (e.g. 5Mb, 100kb), GC correction at the windows.bed size
+  # (a multiple of the smallest size; the GC counts are summed up from it)
+  RESOLUTION_ARGS=(--resolutions $RESOLUTIONS)
+fi
+if [[ -n "$REGION_BEDS" ]]; then
+  # hypo/total per region (DMRs, CpG islands, promoters, ...) from the same pass, no bedmap
+  RESOLUTION_ARGS+=(--regions $REGION_BEDS)
+fi
+if [[ "$GC_CORRECTION" == "true" ]]; then
+  GC_ARGS=(--gc_bed "$GC_BED")
+fi
+python "$WORKDIR/Extract_features.py" \
+    --input "$SAMPLEDIR"/*.bed.gz \
+    --windows "$WINDOWS_BED" \
+    --out_dir "$FEATUREDIR" \
+    --counts_dir "$COUNTS_DIR" \
+    --shard_list "$SHARD_LIST" \
+    --hist_dir "$HIST_DIR" \
+    --store_dir "$STORE_DIR" \
+    --cache_dir "$CACHE_DIR" \
+    --level_bins 10 \
+    --fragments \
+    "${RESOLUTION_ARGS[@]}" \
+    "${GC_ARGS[@]}"
 
-  mv "$FRACTION" "$FEATUREDIR"
-  echo "Done: $FRACTION"
-done
- 
 #--------- Step 4: peform GC correction if needed -----------
 if [[ "$GC_CORRECTION" == "true" ]]; then
   echo "Performing GC correction..."
-
-  for file in "$SAMPLEDIR"/*.bed.gz; do
-    base=$(basename "$file" .bed.gz)
-    cd "$SAMPLEDIR/tmp/${base}/" 
-  
-    #Step 4a: Join GC content with counts
-    TOTAL_COUNT="${base}_total.count"
-    HYPO_COUNT="${base}_hypo.count"
-    paste "$GC_BED" "$HYPO_COUNT" "$TOTAL_COUNT" | \
-      awk -v OFS="\t" '{chrom = $1; start = $2; end = $3; gc = $4; hypo = $5; total = $6; print chrom, start, end, gc, hypo, total}' > "${base}_gc_counts.tsv"
-  
-    #Step 4b: run Python script with GC correction based on linear reg
-    python "$WORKDIR/GC_correction.py" "${base}_gc_counts.tsv" "${base}_corrected_hypo_fraction.bed"
-    mv "${base}_corrected_hypo_fraction.bed" "$FEATUREDIR/corr/"
-
-    # Check
-    echo "GC-corrected output saved to $FEATUREDIR/corr/${base}_corrected_hypo_fraction.bed"
-  
-  done
+  mkdir -p "$FEATUREDIR/corr/"
+  cd "$COUNTS_DIR"
+
+  # only the samples of this shard; GC content joined with the counts (chr start end gc hypo total) is written by
+  # Extract_features.py, all samples are corrected in one process (by default the linear regression of GC_correction.py)
+  GC_COUNTS=()
+  while read -r file; do
+    GC_COUNTS+=("$(basename "$file" .bed.gz)_gc_counts.tsv")
+  done < "$(basename "$SHARD_LIST")"
+  # no plots here: per-sample diagnostics go to $FEATUREDIR/corr/diagnostics (QC page: GC_report.py, see below)
+  GC_MODEL_ARGS=(--model "${GC_MODEL:-ols}")
+  if [[ "$GC_MODEL" == "panel" ]]; then
+    GC_MODEL_ARGS+=(--panel "$REFDIR/gc_panel.tsv")
+  fi
+  python "$WORKDIR/GC_correction_batch.py" --input "${GC_COUNTS[@]}" --out_dir "$FEATUREDIR/corr" \
+      --cache_dir "$CACHE_DIR" "${GC_MODEL_ARGS[@]}"
 fi
 
 
@@ -157,3 +158,15 @@ fi
 # sbatch -p long 02-extract-features.sh -w /users/ludwig/cnr137 -s /well/ludwig/users/cnr137/methylation_model/generated_samples/synthetic_samples -r /well/ludwig/users/cnr137/references -f /well/ludwig/users/cnr137/methylation_model/generated_samples/features -g false
 # sbatch -p long 02-extract-features.sh -w /users/ludwig/cnr137 -s /well/ludwig/users/cnr137/methylation_model/generated_samples/synthetic_samples -r /well/ludwig/users/cnr137/references -f /well/ludwig/users/cnr137/methylation_model/generated_samples/features_corr -g true
 # sbatch -p long 02-extract-features.sh -w /users/ludwig/cnr137 -s /well/ludwig/users/cnr137/methylation_model/generated_samples/synthetic_samples -r /well/ludwig/users/cnr137/references -f /well/ludwig/users/cnr137/methylation_model/generated_samples/features_corr_2 -g true
+
+# Sharded over a SLURM array (references must exist), then the merge step once all shards are done:
+# jid=$(sbatch --parsable -p long --array=0-9 02-extract-features.sh -w <workdir> -s <sampledir> -r <refdir> -f <featuredir> -g false)
+# sbatch -p long --dependency=afterok:$jid 02-extract-features.sh -w <workdir> -s <sampledir> -r <refdir> -f <featuredir> -m
+# Several window sizes from one pass over the samples (features in <featuredir>/5Mb, /1Mb, /100kb):
+# sbatch -p long 02-extract-features.sh -w <workdir> -s <sampledir> -r <refdir> -f <featuredir> -g false -x "5000000 1000000 100000"
+# Other hypomethylation thresholds from the cached histograms (milliseconds per sample, no reads reread):
+# python count_cache.py --hist <sampledir>/tmp/hist/*.hist.npz --windows <refdir>/windows.bed --out_dir <featuredir>_cpg4_lvl02 --min_cpg_hypo 4 --max_level 0.2
+# GC QC page (binned fraction vs GC before/after correction, slope and R² per sample) from the diagnostics, on demand:
+# python GC_report.py --diagnostics <featuredir>/corr/diagnostics --out <featuredir>/corr/gc_report.png [--samples <name> ...]
+# GC panel from healthy samples (once), then -g true -c panel corrects every sample by table lookup instead of a fit:
+# python GC_correction_batch.py --input <countsdir>/<healthy>*_gc_counts.tsv --fit_panel <refdir>/gc_panel.tsv
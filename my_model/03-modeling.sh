@@ -4,6 +4,7 @@
 #SBATCH --error=/well/ludwig/users/cnr137/methylation_model/logs/modeling/%A.err
 #SBATCH --time=96:00:00
 #SBATCH --mem=600G
+#SBATCH --cpus-per-task=16
 
 ###------------------------------------------------- module loading 
 #modules
@@ -14,11 +15,12 @@ conda activate /users/ludwig/cnr137/.conda/envs/epigenetics_env
 
 ###------------------------------------------------- flag definition and default definition
 
-while getopts "w:f:o:" flag; do
+while getopts "w:f:o:l" flag; do
     case "${flag}" in
         w) WORKDIR="${OPTARG}" ;;       
         f) FEATUREDIR="${OPTARG}" ;;
         o) OUTDIR="${OPTARG}" ;;      
+        l) OUT_OF_CORE="true" ;;        # chunked training off the memory-mapped store, for matrices too wide for memory (e.g. 100 kb)
     esac
 done
 
@@ -46,56 +48,41 @@ if [[ -z "$OUTDIR" ]]; then
 fi
 mkdir -p "$OUTDIR"
 
-# Clean up any existing outputs from previous runs
+# Clean up outputs of the former CSV assembly
 rm -f "$OUTDIR/FeatureMatrix.csv" "$OUTDIR/tmp_values.csv" "$OUTDIR/features.txt" "$OUTDIR/Target.csv"
 
 ###------------------------------------------------------ processing pipeline
 
-#----Step 1: Create feature matrix --------
-echo "Preparing feature matrix..."
+#----Step 1: Create feature store --------
+echo "Preparing feature store..."
 
-# Step 1a: Use first bed file to generate feature (column) names
-first_file=$(ls "$FEATUREDIR"/*.bed* | head -n 1)
-awk '{print $1":"$2":"$3}' "$first_file" | paste -sd',' - > "$OUTDIR/features.txt"
-echo "sample_id,$(cat "$OUTDIR/features.txt")" > "$OUTDIR/FeatureMatrix.csv"
+# float32 samples x windows matrix with the labels (tumour: 1, healthy / cirrhosis: 0) in a samples table, see
+# feature_store.py. Samples already in the store are overwritten in place and new ones appended, so adding samples
+# to a feature dir needs no rebuild; remove $OUTDIR/FeatureStore to start over. Labels or other metadata can also
+# come from a table: --metadata <tsv with sample_id, tumour, ...>
+python feature_store.py --store "$OUTDIR/FeatureStore" --add "$FEATUREDIR"/*.bed* \
+    --positive tumour --negative healthy cirrhosis
 
-# Step 1b: For each file, extract sample name and feature values (fractions in 4th column)
-for file in "$FEATUREDIR"/*.bed*; do
-    sample_name=$(basename "$file")
-    values=$(awk '{print $4}' "$file" | paste -sd',' -)
-    echo "$sample_name,$values" >> "$OUTDIR/tmp_values.csv"
-done
-
-# Step 1c: Combine all into final matrix
-cat "$OUTDIR/tmp_values.csv" >> "$OUTDIR/FeatureMatrix.csv"
-
-# Step 1d: Create target matrix
-echo "sample_id,tumour" > "$OUTDIR/Target.csv"
-for file in "$FEATUREDIR"/*.bed*; do
-    sample_name=$(basename "$file")
-    
-    if [[ "$sample_name" == *tumour* ]]; then
-        label=1
-    elif [[ "$sample_name" == *healthy* || "$sample_name" == *cirrhosis* ]]; then
-        label=0
-    fi
-    echo "$sample_name,$label" >> "$OUTDIR/Target.csv"
-done
-
-# Step 1e: Cleanup
-rm "$OUTDIR/tmp_values.csv" "$OUTDIR/features.txt"
-
-echo "Feature matrix written to $OUTDIR/FeatureMatrix.csv"
+echo "Feature store written to $OUTDIR/FeatureStore"
 
 
 #----- Step 2: Evaluate models and feature selection methods ------
+# the whole selector x model x PCA x fold x grid point set runs as one task graph on the job's cores
+# (SLURM_CPUS_PER_TASK; --n_cores / --threads per task to change), see model_grid.py
+# the fitted imputer / scaler / selector / PCA steps are cached per fold and shared by all grid points
+# (--pipeline_cache <dir> to keep them across runs; default a temporary dir)
 python Select_model.py \
-    --Featurematrix "$OUTDIR/FeatureMatrix.csv" \
-    --Target "$OUTDIR/Target.csv" \
-    --output_dir "$OUTDIR"
+    --Featurematrix "$OUTDIR/FeatureStore" \
+    --output_dir "$OUTDIR" \
+    ${OUT_OF_CORE:+--out_of_core}
 
 # sbatch -p long 03-modeling.sh -w /users/ludwig/cnr137 -f /well/ludwig/users/cnr137/methylation_model/generated_samples/features -o /well/ludwig/users/cnr137/methylation_model/generated_samples/model_eval
 # sbatch -p long 03-modeling.sh -w /users/ludwig/cnr137 -f /well/ludwig/users/cnr137/methylation_model/generated_samples/features_corr/corr/ -o /well/ludwig/users/cnr137/methylation_model/generated_samples/model_eval/corr
 # sbatch -p long 03-modeling.sh -w /users/ludwig/cnr137 -f /well/ludwig/users/cnr137/methylation_model/generated_samples/features_corr_2/corr -o /well/ludwig/users/cnr137/methylation_model/generated_samples/model_eval/corr_2
 # sbatch -p long 03-modeling.sh -w /users/ludwig/cnr137 -f /well/ludwig/users/cnr137/methylation_model/generated_samples/features_newsamples -o /well/ludwig/users/cnr137/methylation_model/generated_samples/new_model_eval
 # sbatch -p long 03-modeling.sh -w /users/ludwig/cnr137 -f /well/ludwig/users/cnr137/methylation_model/generated_samples/features_newsamples/corr -o /well/ludwig/users/cnr137/methylation_model/generated_samples/new_model_eval_corr
+
+# Comparing window sizes: extract once with 02-extract-features.sh -x "5000000 1000000 100000", then per resolution:
+# for res in 5Mb 1Mb 100kb; do sbatch -p long 03-modeling.sh -w /users/ludwig/cnr137 -f <featuredir>/$res -o <model_eval>/$res; done
+# 100 kb windows with thousands of samples, out of core (SGD linear models, ANOVA F filter, IncrementalPCA):
+# sbatch -p long --mem=32G 03-modeling.sh -w /users/ludwig/cnr137 -f <featuredir>/100kb -o <model_eval>/100kb -l
@@ -58,80 +58,32 @@ mkdir -p "$OUTDIR"
 
 ###------------------------------------------------------ processing pipeline
 
-#----Step 1: Create feature matrix for non corrected features --------
-echo "Preparing feature matrix Non Corrected..."
-
-# Step 1a: Use first bed file to generate feature (column) names
-first_file=$(ls "$FEATUREDIRNC"/*.bed* | head -n 1)
-awk '{print $1":"$2":"$3}' "$first_file" | paste -sd',' - > "$OUTDIR/featuresNC.txt"
-echo "sample_id,$(cat "$OUTDIR/featuresNC.txt")" > "$OUTDIR/FeatureMatrixNC.csv"
-
-# Step 1b: For each file, extract sample name and feature values (fractions in 4th column)
-for file in "$FEATUREDIRNC"/*.bed*; do
-    sample_name=$(basename "$file")
-    values=$(awk '{print $4}' "$file" | paste -sd',' -)
-    echo "$sample_name,$values" >> "$OUTDIR/tmp_valuesNC.csv"
-done
-
-# Step 1c: Combine all into final matrix
-cat "$OUTDIR/tmp_valuesNC.csv" >> "$OUTDIR/FeatureMatrixNC.csv"
-
-echo "Feature matrix written to $OUTDIR/FeatureMatrixNC.csv"
+#----Step 1: Create feature stores for non corrected and corrected features --------
+# see 03-modeling.sh: float32 feature stores with the labels (HCC: 1, control: 0) in their samples table; samples
+# already in a store are overwritten in place, new ones appended
+echo "Preparing feature store Non Corrected..."
+python feature_store.py --store "$OUTDIR/FeatureStoreNC" --add "$FEATUREDIRNC"/*.bed* --positive HCC --negative control
+echo "Feature store written to $OUTDIR/FeatureStoreNC"
 
-#----Step 2: Create feature matrix for corrected features --------
-echo "Preparing feature matrix Corrected..."
+echo "Preparing feature store Corrected..."
+python feature_store.py --store "$OUTDIR/FeatureStoreC" --add "$FEATUREDIRC"/*.bed* --positive HCC --negative control
+echo "Feature store written to $OUTDIR/FeatureStoreC"
 
-# Step 2a: Use first bed file to generate feature (column) names
-first_file=$(ls "$FEATUREDIRC"/*.bed* | head -n 1)
-awk '{print $1":"$2":"$3}' "$first_file" | paste -sd',' - > "$OUTDIR/featuresC.txt"
-echo "sample_id,$(cat "$OUTDIR/featuresC.txt")" > "$OUTDIR/FeatureMatrixC.csv"
 
-# Step 2b: For each file, extract sample name and feature values (fractions in 4th column)
-for file in "$FEATUREDIRC"/*.bed*; do
-    sample_name=$(basename "$file")
-    values=$(awk '{print $4}' "$file" | paste -sd',' -)
-    echo "$sample_name,$values" >> "$OUTDIR/tmp_valuesC.csv"
-done
-
-# Step 2c: Combine all into final matrix
-cat "$OUTDIR/tmp_valuesC.csv" >> "$OUTDIR/FeatureMatrixC.csv"
-
-echo "Feature matrix written to $OUTDIR/FeatureMatrixC.csv"
-
-#----Step 3: Create target matrix --------
-echo "sample_id,tumour" > "$OUTDIR/Target.csv"
-for file in "$FEATUREDIRNC"/*.bed*; do
-    sample_name=$(basename "$file")
-    
-    if [[ "$sample_name" == *HCC* ]]; then
-        label=1
-    elif [[ "$sample_name" == *control* ]]; then
-        label=0
-    fi
-    echo "$sample_name,$label" >> "$OUTDIR/Target.csv"
-done
-
-# Step 1e: Cleanup
-rm "$OUTDIR/tmp_valuesNC.csv" "$OUTDIR/featuresNC.txt"
-rm "$OUTDIR/tmp_valuesC.csv" "$OUTDIR/featuresC.txt"
-
-
-#----- Step 4: Validate the models for non corrected features ------
+#----- Step 2: Validate the models for non corrected features ------
 python Validation_model_noncorr.py \
     --Featurematrix "$TRAININGNC" \
-    --Target "$TRAININGTARG" \
-    --ValidationFeatures "$OUTDIR/FeatureMatrixNC.csv" \
-    --ValidationTarget "$OUTDIR/Target.csv" \
+    ${TRAININGTARG:+--Target "$TRAININGTARG"} \
+    --ValidationFeatures "$OUTDIR/FeatureStoreNC" \
     --output_dir "$OUTDIR"
 
-#----- Step 5: Validate the models for corrected features ------
+#----- Step 3: Validate the models for corrected features ------
 python Validation_model_corr.py \
     --Featurematrix "$TRAININGC" \
-    --Target "$TRAININGTARG" \
-    --ValidationFeatures "$OUTDIR/FeatureMatrixC.csv" \
-    --ValidationTarget "$OUTDIR/Target.csv" \
+    ${TRAININGTARG:+--Target "$TRAININGTARG"} \
+    --ValidationFeatures "$OUTDIR/FeatureStoreC" \
     --output_dir "$OUTDIR"
 
 # sbatch -p long 05-validation-models.sh -w /users/ludwig/cnr137 -n /well/ludwig/users/cnr137/methylation_model/validation_samples/not_corr/features -c /well/ludwig/users/cnr137/methylation_model/validation_samples/corr/features_corr -o /well/ludwig/users/cnr137/methylation_model/validation_samples_feat -a /well/ludwig/users/cnr137/methylation_model/generated_samples/model_eval/FeatureMatrix.csv -b /well/ludwig/users/cnr137/methylation_model/generated_samples/model_eval/corr/FeatureMatrix.csv -t /well/ludwig/users/cnr137/methylation_model/generated_samples/model_eval/Target.csv
-
-
+# with the feature stores 03-modeling.sh writes (labels included, no -t needed):
+# sbatch -p long 05-validation-models.sh -w <workdir> -n <validation features> -c <validation features_corr> -o <outdir> -a <model_eval>/FeatureStore -b <model_eval>/corr/FeatureStore
@@ -0,0 +1,163 @@
+print("Script started", flush=True)
+import os
+import json
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+from windows import Windows
+from manifest import file_sha256
+
+# === PARSE INPUT ===
+# Offline replacement of step 1 of the extraction scripts (fetchChromSizes | bedops --chop, bedtools nuc):
+# chromosome sizes come from the FASTA index and the sequence is read from a memory-mapped FASTA, so only
+# the reference files are needed. Besides GC it gives the CpG count and N fraction of every window.
+parser = argparse.ArgumentParser()
+parser.add_argument('--fasta', required=True, help='Uncompressed reference FASTA (e.g. hg38.fa); <fasta>.fai is used, or written when missing')
+parser.add_argument('--out_dir', required=True, help='Reference dir for windows.bed, gc_content_windows.bed and composition_windows.tsv')
+parser.add_argument('--window_size', type=int, default=5_000_000, help='Window size in bp (default 5 Mb, as bedops --chop 5000000)')
+parser.add_argument('--chroms', nargs='+', default=None, help='Chromosomes to use (default: every sequence without "_" in its name, as grep -v "_")')
+parser.add_argument('--force', action='store_true', help='Rebuild even when reference.json matches the FASTA and window size')
+args = parser.parse_args()
+
+WINDOWS_BED = os.path.join(args.out_dir, "windows.bed")
+GC_BED = os.path.join(args.out_dir, "gc_content_windows.bed")
+COMPOSITION = os.path.join(args.out_dir, "composition_windows.tsv")
+REFERENCE_JSON = os.path.join(args.out_dir, "reference.json")
+BLOCK_BASES = 64 * 1024 * 1024  # sequence decoded at once per chromosome
+
+
+# ----- FASTA index -----
+def write_fai(fasta, fai):
+    """Write a samtools faidx index (name, length, offset, line bases, line width) in one streaming pass"""
+    rows = []
+    with open(fasta, 'rb') as fh:
+        offset = 0
+        entry = None
+        for line in fh:
+            if line.startswith(b">"):
+                if entry:
+                    rows.append(entry)
+                entry = [line[1:].split()[0].decode(), 0, offset + len(line), 0, 0]
+            elif entry is not None:
+                bases = len(line.rstrip(b"\r\n"))
+                if entry[3] == 0:
+                    entry[3], entry[4] = bases, len(line)
+                entry[1] += bases
+            offset += len(line)
+        if entry:
+            rows.append(entry)
+    with open(fai + ".tmp", 'w') as out:
+        out.writelines("\t".join(map(str, row)) + "\n" for row in rows)
+    os.replace(fai + ".tmp", fai)
+
+
+def read_fai(fasta):
+    fai = fasta + ".fai"
+    if not os.path.exists(fai):
+        print(f"Indexing {fasta}...", flush=True)
+        write_fai(fasta, fai)
+    return pd.read_csv(fai, sep="\t", header=None, usecols=[0, 1, 2, 3, 4],
+                       names=['chr', 'length', 'offset', 'line_bases', 'line_width'], dtype={'chr': str})
+
+
+# ----- Composition -----
+def sequence(fasta_map, entry, start, end):
+    """Bases [start, end) of one chromosome as uint8, line breaks removed"""
+    byte = lambda pos: entry.offset + (pos // entry.line_bases) * entry.line_width + pos % entry.line_bases
+    raw = np.asarray(fasta_map[byte(start):byte(end)])
+    return raw[(raw != ord("\n")) & (raw != ord("\r"))]
+
+
+def composition(fasta_map, entry, starts, ends):
+    """(G+C count, CpG count, N count) per window of one chromosome; a CpG belongs to the window of its C"""
+    gc = np.zeros(len(starts), dtype=np.int64)
+    cpg = np.zeros(len(starts), dtype=np.int64)
+    n = np.zeros(len(starts), dtype=np.int64)
+    first = 0
+    while first < len(starts):
+        last = max(first + 1, int(np.searchsorted(ends, starts[first] + BLOCK_BASES, side='right')))
+        block_start, block_end = int(starts[first]), int(ends[last - 1])
+        seq = sequence(fasta_map, entry, block_start, min(block_end + 1, entry.length)) & 0xDF  # upper case
+        is_c = seq == ord("C")
+        is_g = seq == ord("G")
+        bounds = starts[first:last] - block_start
+        length = block_end - block_start
+        gc[first:last] = np.add.reduceat((is_c | is_g)[:length], bounds)
+        n[first:last] = np.add.reduceat((seq == ord("N"))[:length], bounds)
+        cpg[first:last] = np.add.reduceat(np.r_[is_c[:-1] & is_g[1:], False][:length], bounds)
+        first = last
+    return gc, cpg, n
+
+
+# ----- Checksums -----
+def reference_spec(fai):
+    """What the outputs depend on: the FASTA (sha256 memoized by size and mtime), window size and chromosomes"""
+    stat = os.stat(args.fasta)
+    previous = {}
+    if os.path.exists(REFERENCE_JSON):
+        with open(REFERENCE_JSON) as fh:
+            previous = json.load(fh)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    fasta_sha256 = previous['fasta_sha256'] if previous.get('fasta_stamp') == stamp else file_sha256(args.fasta)
+    return {'fasta': os.path.basename(args.fasta), 'fasta_sha256': fasta_sha256, 'fasta_stamp': stamp,
+            'window_size': args.window_size, 'chroms': fai['chr'].tolist()}, previous
+
+
+def outputs_intact(previous):
+    """The outputs exist and still have the checksums reference.json recorded for them"""
+    if not all(os.path.exists(f) for f in (WINDOWS_BED, GC_BED, COMPOSITION)):
+        return False
+    with open(WINDOWS_BED, 'rb') as fh:
+        windows_checksum = hashlib.sha1(fh.read()).hexdigest()  # as Windows.checksum
+    return (windows_checksum == previous.get('windows_checksum') and file_sha256(GC_BED) == previous.get('gc_sha256')
+            and file_sha256(COMPOSITION) == previous.get('composition_sha256'))
+
+
+# === BUILD ===
+os.makedirs(args.out_dir, exist_ok=True)
+fai = read_fai(args.fasta)
+fai = fai[fai['chr'].isin(args.chroms)] if args.chroms else fai[~fai['chr'].str.contains("_")]
+fai = fai.sort_values('chr', kind='stable').reset_index(drop=True)  # chromosome order of sort-bed
+
+spec, previous = reference_spec(fai)
+if not args.force and all(previous.get(k) == v for k, v in spec.items() if k != 'fasta_stamp'):
+    if outputs_intact(previous):
+        print(f"References in {args.out_dir} are up to date ({previous['windows_checksum'][:12]})", flush=True)
+        raise SystemExit(0)
+    print(f"References in {args.out_dir} are missing or were changed since {REFERENCE_JSON}, rebuilding", flush=True)
+
+# windows exactly as bedops --chop makes them: from 0 in steps of window_size, the last one up to the chromosome end
+chrom_bed = pd.DataFrame({'chr': fai['chr'], 'start': 0, 'end': fai['length']})
+windows = Windows(chrom_bed).chop(args.window_size)
+bed = windows.bed
+
+fasta_map = np.memmap(args.fasta, dtype=np.uint8, mode='r')
+gc, cpg, n = [], [], []
+for entry in fai.itertuples():
+    rows = bed.index[bed['chr'] == entry.chr]
+    print(f"Composition of {entry.chr} ({len(rows)} windows)...", flush=True)
+    counts = composition(fasta_map, entry, bed['start'].values[rows], bed['end'].values[rows])
+    for out, values in zip((gc, cpg, n), counts):
+        out.append(values)
+length = (bed['end'] - bed['start']).values
+gc, cpg, n = np.concatenate(gc), np.concatenate(cpg), np.concatenate(n)
+
+# ----- Write -----
+# windows.bed first; gc_content_windows.bed with the GC fraction as bedtools nuc reports pct_gc ((G+C) / length, %f)
+bed[['chr', 'start', 'end']].to_csv(WINDOWS_BED + ".tmp", sep="\t", header=False, index=False)
+os.replace(WINDOWS_BED + ".tmp", WINDOWS_BED)
+with open(GC_BED + ".tmp", 'w') as out:
+    for chrom, start, end, fraction in zip(bed['chr'], bed['start'], bed['end'], (gc / length).tolist()):
+        out.write(f"{chrom}\t{start}\t{end}\t{fraction:f}\n")
+os.replace(GC_BED + ".tmp", GC_BED)
+pd.DataFrame({'chr': bed['chr'], 'start': bed['start'], 'end': bed['end'], 'gc': gc / length, 'cpg': cpg,
+              'cpg_per_kb': 1000 * cpg / length, 'n_fraction': n / length}).to_csv(
+    COMPOSITION + ".tmp", sep="\t", index=False, float_format="%.6g")
+os.replace(COMPOSITION + ".tmp", COMPOSITION)
+
+spec.update(windows_checksum=Windows(WINDOWS_BED).checksum, gc_sha256=file_sha256(GC_BED),
+            composition_sha256=file_sha256(COMPOSITION))
+with open(REFERENCE_JSON, 'w') as fh:
+    json.dump(spec, fh, indent=1)
+print(f"Written {len(bed)} windows to {WINDOWS_BED}, {GC_BED} and {COMPOSITION}", flush=True)
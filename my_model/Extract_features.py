@@ -0,0 +1,348 @@
+print("Script started", flush=True)
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+from windows import Windows
+from per_read import CHUNK_READS, MIN_MAPQ, MIN_CPG_TOTAL, MIN_CPG_HYPO, MAX_HYPO_LEVEL
+from window_counts import sample_name, resolution_label, count_file
+from read_store import converted
+from count_cache import N_BINS, EXACT_CPG, LEVEL_BINS, HIST_SUFFIX, save_histogram, level_features, level_feature_names
+from fragment_counts import SIZE_CLASSES, SIZE_BIN, N_FRAGMENT_ROWS, fragment_row_names, fragment_features, fragment_feature_names
+from result_cache import ResultCache, input_hash
+from regions import Regions
+from read_pools import run_tasks
+from feature_matrix import write_feature_matrix, write_targets
+from feature_store import add_samples
+
+# === PARSE INPUT ===
+# Replaces the zcat/awk/sort-bed/bedmap chain of the extraction scripts: one streaming pass per sample,
+# the read rules (mapq > 10; total: >= 2 CpGs; hypo: >= 3 CpGs and methylation level <= 0.35) applied
+# vectorized and reads counted per window as bedmap --count does, without sorting or temporary files.
+parser = argparse.ArgumentParser()
+parser.add_argument('--input', nargs='+', required=True, help='Per-read .bed.gz files and/or .reads stores')
+parser.add_argument('--windows', required=True, help='windows.bed (fixed-size windows from bedops --chop)')
+parser.add_argument('--out_dir', required=True, help='Feature dir for the <sample>_hypo_fraction.bed files')
+parser.add_argument('--resolutions', nargs='+', type=int, default=None, help='Window sizes (bp) to emit, each a multiple of the smallest; one pass counts at the smallest and sums up (default: the windows.bed size only)')
+parser.add_argument('--regions', nargs='+', default=None, help='Region-set BEDs (DMRs, CpG islands, promoters, ...): hypo/total overlap counts per region from the same pass, features in <out_dir>/regions/<bed name>')
+parser.add_argument('--store_dir', default=None, help='Convert each per-read BED input once into a memory-mapped .reads store here (read_store.py) and count from the store: later recounts (other flags, regions, windows) read columns instead of parsing text')
+parser.add_argument('--counts_dir', default=None, help='Also write <sample>_counts.tsv (chr start end hypo total) here')
+parser.add_argument('--hist_dir', default=None, help='Also cache per-window (num_cpg x methylation) histograms as <sample>.hist.npz here, to re-derive features for other thresholds (count_cache.py)')
+parser.add_argument('--level_bins', type=int, default=0, help='Also write per-window methylation-level histogram (this many bins), mean, variance and entropy; the merge step stacks them into LevelFeatures.npy')
+parser.add_argument('--fragments', action='store_true', help='Also count fragments per window by size class (ultrashort <100, short 100-150, long 151-250, multinucleosomal >250), hypomethylated / total per class and a 10 bp size histogram; the merge step stacks them into FragmentCounts.npy and FragmentFeatures.npy')
+parser.add_argument('--gc_bed', default=None, help='gc_content_windows.bed; with --counts_dir also writes the <sample>_gc_counts.tsv GC_correction.py reads (at the windows.bed size whatever the resolutions, directly in counts_dir)')
+parser.add_argument('--cache_dir', default=None, help='Content-addressed cache of the per-sample window counts, keyed by input sha256, windows checksum and counting rules: unchanged samples are never recounted, whatever else (resolutions, GC, outputs) changed')
+parser.add_argument('--n_workers', type=int, default=int(os.environ.get('SLURM_CPUS_PER_TASK', 1)), help='Samples counted in parallel (default: SLURM_CPUS_PER_TASK)')
+parser.add_argument('--memory_gb', type=float, default=None, help='Memory budget for all workers together (default: the SLURM allocation, else 8)')
+parser.add_argument('--shard', type=int, default=None, help='Only count this shard of the samples (default: SLURM_ARRAY_TASK_ID)')
+parser.add_argument('--n_shards', type=int, default=None, help='Number of shards (default: SLURM_ARRAY_TASK_COUNT)')
+parser.add_argument('--shard_list', default=None, help='Write the input files of this shard to this file (one per line)')
+parser.add_argument('--merge', action='store_true', help='Merge step after all shards: check every sample is done and write FeatureMatrix.csv/Target.csv and the FeatureStore dir')
+parser.add_argument('--force', action='store_true', help='Recount samples whose outputs are already newer than their input')
+args = parser.parse_args()
+
+WINDOWS = Windows(args.windows)
+
+# ----- Resolutions -----
+# One feature set per window size: with only the windows.bed size the outputs go straight into out_dir
+# (and counts_dir), otherwise into <out_dir>/<label> (e.g. features/5Mb, features/100kb).
+sizes = sorted(set(args.resolutions or [WINDOWS.window_size]), reverse=True)
+# every size is summed up from the smallest, and so are the GC counts at the windows.bed size: check it up front,
+# before any sample is counted
+if sizes[-1] <= 0 or any(size % sizes[-1] for size in sizes):
+    parser.error(f"every --resolutions size must be a positive multiple of the smallest ({sizes[-1]} bp)")
+if args.gc_bed and args.counts_dir and WINDOWS.window_size % sizes[-1]:
+    parser.error(f"the GC counts are summed up from the smallest resolution ({sizes[-1]} bp): the windows.bed size "
+                 f"({WINDOWS.window_size} bp) must be a multiple of it")
+RESOLUTIONS = []
+for size in sizes:
+    sub = "" if sizes == [WINDOWS.window_size] else resolution_label(size)
+    RESOLUTIONS.append({
+        'label': resolution_label(size),
+        'windows': WINDOWS if size == WINDOWS.window_size else WINDOWS.chop(size),
+        'out_dir': os.path.join(args.out_dir, sub),
+        'counts_dir': os.path.join(args.counts_dir, sub) if args.counts_dir else None,
+    })
+FINEST = min((res['windows'] for res in RESOLUTIONS), key=lambda w: w.window_size)
+
+# ----- Region sets -----
+# Features over any BED of regions (one column per region, in BED order), in <out_dir>/regions/<bed name>
+REGION_SETS = []
+for bed in args.regions or []:
+    regions = Regions(bed)
+    REGION_SETS.append({
+        'label': regions.name,
+        'regions': regions,
+        'out_dir': os.path.join(args.out_dir, "regions", regions.name),
+        'counts_dir': os.path.join(args.counts_dir, "regions", regions.name) if args.counts_dir else None,
+    })
+if len({res['label'] for res in REGION_SETS}) < len(REGION_SETS):
+    raise SystemExit("Region-set BEDs need distinct file names")
+
+if args.hist_dir:
+    os.makedirs(args.hist_dir, exist_ok=True)
+for res in RESOLUTIONS + REGION_SETS:
+    os.makedirs(res['out_dir'], exist_ok=True)
+    if res['counts_dir']:
+        os.makedirs(res['counts_dir'], exist_ok=True)
+
+GC = None
+if args.gc_bed:
+    gc_bed = pd.read_csv(args.gc_bed, sep="\t", header=None, usecols=[0, 1, 2, 3], names=['chr', 'start', 'end', 'gc'],
+                         dtype=str, keep_default_na=False)
+    gc_bed[['start', 'end']] = gc_bed[['start', 'end']].astype(np.int64)
+    assert gc_bed[['chr', 'start', 'end']].equals(WINDOWS.bed[['chr', 'start', 'end']]), \
+        f"{args.gc_bed} does not list the same windows as {args.windows}"
+    GC = gc_bed['gc'].tolist()  # written back exactly as bedtools nuc reported it (windows.bed resolution only)
+
+
+# ----- Count cache -----
+# Counts are cached at the finest resolution as start / crossing counts, so every coarser resolution and every
+# output file is re-derived from a cache entry without reading the reads again (see Windows.coarsen).
+CACHE = ResultCache(args.cache_dir) if args.cache_dir else None
+COUNT_SPEC = {
+    'stage': 'window_counts',
+    'rules': [MIN_MAPQ, MIN_CPG_TOTAL, MIN_CPG_HYPO, MAX_HYPO_LEVEL],
+    'histogram_layout': [EXACT_CPG, LEVEL_BINS],
+    'fragment_layout': [SIZE_CLASSES, SIZE_BIN],
+}
+
+
+# ----- Output helpers -----
+def format_fraction(hypo, total):
+    """hypo / total as awk prints it (%.6g), NA for empty windows"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = hypo / total
+    return ["NA" if t == 0 else "%.6g" % f for f, t in zip(fraction.tolist(), total.tolist())]
+
+
+def write_columns(path, windows, *columns):
+    """Write tab-separated rows of the windows' chr/start/end followed by the given columns"""
+    bed = windows.bed
+    with open(path, 'w') as out:
+        for row in zip(bed['chr'], bed['start'], bed['end'], *columns):
+            out.write("\t".join(map(str, row)) + "\n")
+
+
+# ----- Work distribution -----
+BYTES_PER_READ = 200  # parsed chunk plus masks and window indices, per read
+ACCUMULATOR_COPIES = 4  # start and crossing counts, a full-size np.bincount temporary and a coarsened copy
+
+
+def memory_budget_gb():
+    """--memory_gb, else the memory SLURM gave the job (SLURM_MEM_PER_NODE / _PER_CPU in MB), else 8"""
+    if args.memory_gb:
+        return args.memory_gb
+    if 'SLURM_MEM_PER_NODE' in os.environ:
+        return int(os.environ['SLURM_MEM_PER_NODE']) / 1024
+    if 'SLURM_MEM_PER_CPU' in os.environ:
+        return int(os.environ['SLURM_MEM_PER_CPU']) * int(os.environ.get('SLURM_CPUS_PER_TASK', 1)) / 1024
+    return 8
+
+
+def accumulator_bytes():
+    """Per-worker int64 window counts at the finest resolution: hypo/total or the (num_cpg x methylation)
+    histogram, the fragment rows and the region counts, with their temporaries"""
+    rows = N_BINS if args.hist_dir or args.level_bins else 2
+    rows += N_FRAGMENT_ROWS if args.fragments else 0
+    cells = rows * len(FINEST) + sum(2 * len(res['regions']) for res in REGION_SETS)
+    return cells * 8 * ACCUMULATOR_COPIES
+
+
+def plan_workers(n_workers, budget_gb, fixed_bytes=0):
+    """(workers, reads per chunk) so that all workers' chunks and counts (fixed_bytes each) fit in the budget,
+    keeping ~20% headroom"""
+    budget = 0.8 * budget_gb * 1024 ** 3
+    chunk = CHUNK_READS
+    workers = max(1, min(n_workers, int(budget // (chunk * BYTES_PER_READ + fixed_bytes))))
+    if workers * (chunk * BYTES_PER_READ + fixed_bytes) > budget:
+        chunk = max(100_000, int((budget / workers - fixed_bytes) // BYTES_PER_READ))
+    if workers * (chunk * BYTES_PER_READ + fixed_bytes) > budget:
+        print(f"Warning: one worker needs about {(chunk * BYTES_PER_READ + fixed_bytes) / 1024 ** 3:.1f} GB, "
+              f"more than the {budget_gb:g} GB budget", flush=True)
+    return workers, chunk
+
+
+def shard_inputs(paths, shard, n_shards):
+    """Inputs of one shard: largest files first, each to the shard with the least data so far (same on every shard)"""
+    size = lambda p: sum(os.path.getsize(os.path.join(p, f)) for f in os.listdir(p)) if os.path.isdir(p) else os.path.getsize(p)
+    loads = [0] * n_shards
+    assigned = [[] for _ in range(n_shards)]
+    for path in sorted(paths, key=lambda p: (-size(p), p)):
+        target = loads.index(min(loads))
+        assigned[target].append(path)
+        loads[target] += size(path)
+    return sorted(assigned[shard])
+
+
+def fraction_path(path, res):
+    return os.path.join(res['out_dir'], f"{sample_name(path)}_hypo_fraction.bed")
+
+
+def hist_path(path):
+    return os.path.join(args.hist_dir, sample_name(path) + HIST_SUFFIX)
+
+
+def level_path(path, res):
+    return os.path.join(res['out_dir'], f"{sample_name(path)}_level_features.npy")
+
+
+def gc_counts_path(path):
+    return os.path.join(args.counts_dir, f"{sample_name(path)}_gc_counts.tsv")
+
+
+def fragment_path(path, res):
+    return os.path.join(res['out_dir'], f"{sample_name(path)}_fragment_counts.npy")
+
+
+def save_npy(path, values):
+    """np.save via a temporary file, so an existing file is always complete"""
+    np.save(path[:-len(".npy")] + ".tmp.npy", values)
+    os.replace(path[:-len(".npy")] + ".tmp.npy", path)
+
+
+def outputs(path, res):
+    """Files written for a sample at one resolution (or region set), the fraction file last"""
+    files = []
+    if 'windows' in res and args.level_bins:
+        files.append(level_path(path, res))
+    if 'windows' in res and args.fragments:
+        files.append(fragment_path(path, res))
+    if res['counts_dir']:
+        files.append(os.path.join(res['counts_dir'], f"{sample_name(path)}_counts.tsv"))
+    return files + [fraction_path(path, res)]
+
+
+def is_done(path):
+    """Outputs of a sample exist at every resolution and are newer than its input"""
+    files = [out for res in RESOLUTIONS + REGION_SETS for out in outputs(path, res)]
+    if GC is not None and args.counts_dir:
+        files.append(gc_counts_path(path))
+    if args.hist_dir:
+        files.append(hist_path(path))
+    return all(os.path.exists(out) and os.path.getmtime(out) >= os.path.getmtime(path) for out in files)
+
+
+# === MERGE STEP ===
+if args.merge:
+    for res in RESOLUTIONS + REGION_SETS:
+        missing = [p for p in args.input if not os.path.exists(fraction_path(p, res))]
+        if missing:
+            raise SystemExit(f"{len(missing)} sample(s) have no {res['label']} features yet, e.g. {missing[:5]}")
+        # same matrix layout as 03-modeling.sh builds: file name as sample_id, one column per window
+        names = [os.path.basename(fraction_path(p, res)) for p in sorted(args.input)]
+        values = [pd.read_csv(fraction_path(p, res), sep="\t", header=None, usecols=[3], na_values="NA")[3].values
+                  for p in sorted(args.input)]
+        features = res['windows'] if 'windows' in res else res['regions']
+        write_feature_matrix(os.path.join(res['out_dir'], "FeatureMatrix.csv"), names, features.names(), values)
+        try:
+            write_targets(os.path.join(res['out_dir'], "Target.csv"), names)
+        except ValueError as err:
+            print(f"No Target.csv written: {err}", flush=True)  # e.g. validation samples without label in the name
+        print(f"Merged {len(names)} samples into {os.path.join(res['out_dir'], 'FeatureMatrix.csv')}", flush=True)
+        # the same matrix as an appendable float32 store (feature_store.py), labels NA where the name has none
+        add_samples(os.path.join(res['out_dir'], "FeatureStore"), features.names(), names, np.vstack(values))
+        if 'windows' in res and args.level_bins:
+            # dense float32 tensor samples x windows x (level bins, mean, var, entropy), rows as in FeatureMatrix.csv
+            LEVELS = os.path.join(res['out_dir'], "LevelFeatures.npy")
+            np.save(LEVELS, np.stack([np.load(level_path(p, res)) for p in sorted(args.input)]))
+            with open(os.path.join(res['out_dir'], "LevelFeatures.json"), 'w') as fh:
+                json.dump({'samples': names, 'windows': res['windows'].names(), 'features': level_feature_names(args.level_bins)}, fh)
+            print(f"Level features stacked into {LEVELS}", flush=True)
+        if 'windows' in res and args.fragments:
+            # int32 samples x windows x count rows, and the derived float32 features (shares, short/long, hypo per class)
+            FRAGMENTS = os.path.join(res['out_dir'], "FragmentCounts.npy")
+            fragment_counts = np.stack([np.load(fragment_path(p, res)) for p in sorted(args.input)])
+            np.save(FRAGMENTS, fragment_counts)
+            np.save(os.path.join(res['out_dir'], "FragmentFeatures.npy"), fragment_features(fragment_counts))
+            for name, features in (("FragmentCounts.json", fragment_row_names()), ("FragmentFeatures.json", fragment_feature_names())):
+                with open(os.path.join(res['out_dir'], name), 'w') as fh:
+                    json.dump({'samples': names, 'windows': res['windows'].names(), 'features': features}, fh)
+            print(f"Fragment counts stacked into {FRAGMENTS}", flush=True)
+    raise SystemExit(0)
+
+
+# === COUNT PER SAMPLE ===
+def region_key(res):
+    return "regions_" + res['regions'].checksum[:16]
+
+
+def counted_arrays(path):
+    """Start / crossing counts of a sample at the finest resolution (and region counts), from the cache when it has them"""
+    key = CACHE.key(input=input_hash(path, args.cache_dir), windows=FINEST.checksum, **COUNT_SPEC) if CACHE else None
+    arrays = (CACHE.load_arrays(key) if CACHE else None) or {}
+    # count only what the cache entry lacks; what it already has is kept in the rewritten entry
+    histogram = bool(args.hist_dir or args.level_bins) and 'hist_start' not in arrays
+    fragments = args.fragments and 'fragment_start' not in arrays
+    regions = [res for res in REGION_SETS if region_key(res) not in arrays]
+    if 'start' in arrays and not (histogram or fragments or regions):
+        print(f"Cached: {sample_name(path)}", flush=True)
+        return arrays
+    print(f"Counting {sample_name(path)}...", flush=True)
+    source = path
+    if args.store_dir and not os.path.isdir(path):
+        source = converted(path, args.store_dir, CHUNK)  # once per sample; again only when the BED is newer
+    counter = count_file(source, FINEST, CHUNK, histogram, fragments, [res['regions'] for res in regions])
+    start, cross = counter.hypo_total()
+    arrays.update(start=start, cross=cross)
+    if histogram:
+        arrays.update(hist_start=counter.start, hist_cross=counter.cross)
+    if fragments:
+        arrays.update(fragment_start=counter.fragment_start, fragment_cross=counter.fragment_cross)
+    for res, counts in zip(regions, counter.region_counts):
+        arrays[region_key(res)] = counts
+    if CACHE:
+        CACHE.save_arrays(key, {name: values.astype(np.uint32) for name, values in arrays.items()})
+    return arrays
+
+
+def extract_sample(path):
+    """Count one sample (once, at the finest resolution) and write its fraction (and counts) files per resolution"""
+    base = sample_name(path)
+    arrays = {name: values.astype(np.int64, copy=False) for name, values in counted_arrays(path).items()}
+    if args.hist_dir:
+        save_histogram(hist_path(path), FINEST, arrays['hist_start'], arrays['hist_cross'])  # at the finest resolution
+    if GC is not None and args.counts_dir:
+        # at the windows.bed size (gc_content_windows.bed), whether or not it is one of the resolutions
+        hypo, total = FINEST.coarsen(WINDOWS, arrays['start'], arrays['cross'])
+        write_columns(gc_counts_path(path), WINDOWS, GC, hypo, total)
+
+    for res in RESOLUTIONS:
+        FRACTION = fraction_path(path, res)
+        hypo, total = FINEST.coarsen(res['windows'], arrays['start'], arrays['cross'])
+        if args.level_bins:
+            hist = FINEST.coarsen(res['windows'], arrays['hist_start'], arrays['hist_cross'])
+            save_npy(level_path(path, res), level_features(hist, args.level_bins))
+        if args.fragments:
+            fragments = FINEST.coarsen(res['windows'], arrays['fragment_start'], arrays['fragment_cross'])
+            save_npy(fragment_path(path, res), fragments.T.astype(np.int32))  # windows x count rows
+        write_columns(FRACTION + ".tmp", res['windows'], format_fraction(hypo, total))
+        if res['counts_dir']:
+            write_columns(os.path.join(res['counts_dir'], f"{base}_counts.tsv"), res['windows'], hypo, total)
+        os.replace(FRACTION + ".tmp", FRACTION)  # last, so a finished fraction file means a finished sample
+        print(f"Done: {FRACTION}", flush=True)
+
+    for res in REGION_SETS:
+        FRACTION = fraction_path(path, res)
+        hypo, total = arrays[region_key(res)]
+        write_columns(FRACTION + ".tmp", res['regions'], format_fraction(hypo, total))
+        if res['counts_dir']:
+            write_columns(os.path.join(res['counts_dir'], f"{base}_counts.tsv"), res['regions'], hypo, total)
+        os.replace(FRACTION + ".tmp", FRACTION)
+        print(f"Done: {FRACTION}", flush=True)
+    return base
+
+
+shard = args.shard if args.shard is not None else int(os.environ.get('SLURM_ARRAY_TASK_ID', 0)) - int(os.environ.get('SLURM_ARRAY_TASK_MIN', 0))
+n_shards = args.n_shards or int(os.environ.get('SLURM_ARRAY_TASK_COUNT', 1))
+inputs = shard_inputs(args.input, shard, n_shards) if n_shards > 1 else sorted(args.input)
+if args.shard_list:
+    with open(args.shard_list, 'w') as fh:
+        fh.write("".join(p + "\n" for p in inputs))
+todo = inputs if args.force else [p for p in inputs if not is_done(p)]
+
+n_workers, CHUNK = plan_workers(args.n_workers, memory_budget_gb(), accumulator_bytes())
+print(f"Shard {shard + 1}/{n_shards}: {len(todo)} of {len(inputs)} samples to count on {n_workers} worker(s), "
+      f"{CHUNK:,} reads per chunk", flush=True)
+run_tasks(extract_sample, todo, n_workers)
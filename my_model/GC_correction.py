@@ -3,11 +3,28 @@ import pandas as pd
 import statsmodels.api as sm
 import numpy as np
 import os
-import matplotlib.pyplot as plt
-import seaborn as sns
+from manifest import file_sha256
+from result_cache import ResultCache
+from gc_models import DIAGNOSTICS_SUFFIX, gc_diagnostics, save_diagnostics
 
 input_file = sys.argv[1]
 output_file = sys.argv[2]
+cache_dir = sys.argv[3] if len(sys.argv) > 3 else None  # optional content-addressed cache (Extract_features.py --cache_dir)
+
+# Compact diagnostics instead of plots, in diagnostics/ next to the output (GC_report.py renders them)
+base_name = os.path.splitext(os.path.basename(output_file))[0].removesuffix("_corrected_hypo_fraction")
+diagnostics_dir = os.path.join(os.path.dirname(output_file), "diagnostics")
+os.makedirs(diagnostics_dir, exist_ok=True)
+diagnostics_file = os.path.join(diagnostics_dir, base_name + DIAGNOSTICS_SUFFIX)
+
+# A sample whose gc_counts are unchanged gets its earlier correction and diagnostics back
+if cache_dir:
+    CACHE = ResultCache(cache_dir)
+    KEY = CACHE.key(stage='gc_correction', gc_counts=file_sha256(input_file), model='ols_gc_linear')
+    if (CACHE.fetch_file(KEY, "_corrected_hypo_fraction.bed", output_file)
+            and CACHE.fetch_file(KEY, DIAGNOSTICS_SUFFIX, diagnostics_file)):
+        print(f"Cached: {output_file}", flush=True)
+        sys.exit(0)
 
 df = pd.read_csv(input_file, sep="\t", header=None,
                  names=["chr", "start", "end", "gc", "hypo", "total"],
@@ -38,41 +55,10 @@ df[["chr", "start", "end","resid_fraction"]].to_csv(
     output_file, sep="\t", index=False, header=False, na_rep="NA"
 )
 
-# ----------------- PLOTTING -------------------
-
-# Original fraction (hypo / total)
-df["original_fraction"] = df["hypo"] / df["total"]
-
-# Filter valid data for plotting (avoid divide by zero or NaNs)
-plot_valid = df.dropna(subset=["gc", "original_fraction", "resid_fraction"])
-
-plt.figure(figsize=(12, 6))
-
-# Plot original fraction vs GC content
-plt.subplot(1, 2, 1)
-sns.scatterplot(x="gc", y="original_fraction", data=plot_valid, alpha=0.4, s=20)
-sns.regplot(x="gc", y="original_fraction", data=plot_valid, scatter=False, lowess=True, color='r')
-plt.title("Original Fraction vs GC Content")
-plt.xlabel("GC Content")
-plt.ylabel("Hypo / Total Fraction")
-
-# Plot corrected fraction vs GC content
-plt.subplot(1, 2, 2)
-sns.scatterplot(x="gc", y="resid_fraction", data=plot_valid, alpha=0.4, s=20)
-sns.regplot(x="gc", y="resid_fraction", data=plot_valid, scatter=False, lowess=True, color='r')
-plt.title("Corrected Fraction vs GC Content")
-plt.xlabel("GC Content")
-plt.ylabel("Corrected Fraction (Residual)")
-
-# saving
-# Get base filename (without extension)
-base_name = os.path.splitext(os.path.basename(output_file))[0]
-
-# Make plots subdirectory under the output directory
-plot_dir = os.path.join(os.path.dirname(output_file), "plots")
-os.makedirs(plot_dir, exist_ok=True)
-
-# Save plot
-plot_file = os.path.join(plot_dir, f"{base_name}_gc_plot.png")
-plt.tight_layout()
-plt.savefig(plot_file, dpi=300)
\ No newline at end of file
+# ----------------- DIAGNOSTICS -------------------
+diagnostics = gc_diagnostics(df["gc"].values, df["hypo"].values[None, :], df["total"].values[None, :],
+                             df["resid_fraction"].values[None, :])[0]
+save_diagnostics(diagnostics_file, base_name, diagnostics)
+if cache_dir:
+    CACHE.store_file(KEY, DIAGNOSTICS_SUFFIX, diagnostics_file)
+    CACHE.store_file(KEY, "_corrected_hypo_fraction.bed", output_file)
@@ -0,0 +1,74 @@
+print("Script started", flush=True)
+import os
+import argparse
+from manifest import file_sha256
+from result_cache import ResultCache
+from gc_models import (DIAGNOSTICS_SUFFIX, GC_MODELS, LOESS_SPAN, load_gc_counts, corrected_fractions, gc_diagnostics,
+                       save_diagnostics, fit_panel, save_panel, load_panel)
+
+# === PARSE INPUT ===
+# GC_correction.py for many samples in one process: all <sample>_gc_counts.tsv are loaded as samples x windows
+# and the per-sample regressions of hypo and total on GC are solved together in closed form, so imports and
+# startup are paid once. Same model and output as GC_correction.py (and the same cache entries). No plots: compact
+# diagnostics per sample go to <out_dir>/diagnostics, GC_report.py renders them on demand.
+# --model loess replaces the straight line by a binned LOESS trend on GC (as DELFI's gcCorrectLoess);
+# --model panel uses a trend fitted once on healthy samples (--fit_panel), so a new sample needs no fit at all.
+parser = argparse.ArgumentParser()
+parser.add_argument('--input', nargs='+', required=True, help='<sample>_gc_counts.tsv files (chr start end gc hypo total) from Extract_features.py --gc_bed')
+parser.add_argument('--out_dir', default=None, help='Dir for the <sample>_corrected_hypo_fraction.bed files (not needed with only --fit_panel)')
+parser.add_argument('--cache_dir', default=None, help='Content-addressed cache shared with GC_correction.py: samples with unchanged counts are not refitted')
+parser.add_argument('--diagnostics_dir', default=None, help='Dir for the <sample>_gc_diagnostics.json files (default: <out_dir>/diagnostics)')
+parser.add_argument('--model', choices=GC_MODELS, default='ols', help='GC trend: ols (straight line, as GC_correction.py), loess (binned LOESS per sample) or panel (reference panel table)')
+parser.add_argument('--span', type=float, default=LOESS_SPAN, help=f'LOESS span, share of windows in each local fit (default {LOESS_SPAN})')
+parser.add_argument('--panel', default=None, help='GC panel table for --model panel (from --fit_panel)')
+parser.add_argument('--fit_panel', default=None, help='Fit a GC panel table on the --input samples (healthy references) and write it here; with --model panel they are then corrected with it')
+args = parser.parse_args()
+if not args.out_dir and not (args.fit_panel and args.model != 'panel'):
+    parser.error("--out_dir is required")
+
+SUFFIX = "_gc_counts.tsv"
+base = lambda path: os.path.basename(path)[:-len(SUFFIX)] if path.endswith(SUFFIX) else os.path.splitext(os.path.basename(path))[0]
+out_path = lambda path: os.path.join(args.out_dir, f"{base(path)}_corrected_hypo_fraction.bed")
+diagnostics_path = lambda path: os.path.join(DIAGNOSTICS_DIR, base(path) + DIAGNOSTICS_SUFFIX)
+
+# ----- Reference panel -----
+if args.fit_panel:
+    _, gc, hypo, total = load_gc_counts(args.input)
+    save_panel(args.fit_panel, fit_panel(gc, hypo, total, span=args.span))
+    print(f"GC panel of {len(args.input)} sample(s) saved to {args.fit_panel}", flush=True)
+    if args.model != 'panel':
+        raise SystemExit(0)
+    args.panel = args.panel or args.fit_panel
+if args.model == 'panel' and not args.panel:
+    parser.error("--model panel needs --panel (or --fit_panel)")
+PANEL = load_panel(args.panel) if args.model == 'panel' else None
+DIAGNOSTICS_DIR = args.diagnostics_dir or os.path.join(args.out_dir, "diagnostics")
+os.makedirs(args.out_dir, exist_ok=True)
+os.makedirs(DIAGNOSTICS_DIR, exist_ok=True)
+
+# ----- Cached samples -----
+CACHE = ResultCache(args.cache_dir) if args.cache_dir else None
+MODEL_SPEC = {'ols': {'model': 'ols_gc_linear'},
+              'loess': {'model': 'binned_loess', 'span': args.span},
+              'panel': {'model': 'gc_panel', 'panel': file_sha256(args.panel) if args.panel else None}}[args.model]
+keys = {path: CACHE.key(stage='gc_correction', gc_counts=file_sha256(path), **MODEL_SPEC) for path in args.input} if CACHE else {}
+cached = lambda path: (CACHE.fetch_file(keys[path], "_corrected_hypo_fraction.bed", out_path(path))
+                       and CACHE.fetch_file(keys[path], DIAGNOSTICS_SUFFIX, diagnostics_path(path)))
+todo = [path for path in args.input if not (CACHE and cached(path))]
+print(f"{len(args.input) - len(todo)} sample(s) from the cache, {len(todo)} to correct", flush=True)
+
+
+# === CORRECT ===
+if todo:
+    windows, gc, hypo, total = load_gc_counts(todo)
+    corrected = corrected_fractions(gc, hypo, total, model=args.model, span=args.span, panel=PANEL)
+    diagnostics = gc_diagnostics(gc, hypo, total, corrected)
+    for i, path in enumerate(todo):
+        OUT = out_path(path)
+        windows.assign(resid_fraction=corrected[i]).to_csv(OUT + ".tmp", sep="\t", index=False, header=False, na_rep="NA")
+        os.replace(OUT + ".tmp", OUT)
+        save_diagnostics(diagnostics_path(path), base(path), diagnostics[i])
+        if CACHE:
+            CACHE.store_file(keys[path], DIAGNOSTICS_SUFFIX, diagnostics_path(path))
+            CACHE.store_file(keys[path], "_corrected_hypo_fraction.bed", OUT)
+        print(f"GC-corrected output saved to {OUT}", flush=True)
@@ -0,0 +1,70 @@
+print("Script started", flush=True)
+import os
+import glob
+import warnings
+import argparse
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from gc_models import DIAGNOSTICS_SUFFIX, load_diagnostics
+
+# === PARSE INPUT ===
+# On-demand QC page from the compact diagnostics GC correction writes (<featuredir>/corr/diagnostics):
+# fraction against GC before and after correction for every (or the selected) sample, and slope / R² per sample.
+parser = argparse.ArgumentParser()
+parser.add_argument('--diagnostics', nargs='+', required=True, help='<sample>_gc_diagnostics.json files or dirs holding them')
+parser.add_argument('--samples', nargs='+', default=None, help='Only these samples (default: all)')
+parser.add_argument('--out', required=True, help='Report image (.png / .pdf); a .tsv with slope and R² per sample is written next to it')
+args = parser.parse_args()
+
+paths = []
+for path in args.diagnostics:
+    paths += sorted(glob.glob(os.path.join(path, "*" + DIAGNOSTICS_SUFFIX))) if os.path.isdir(path) else [path]
+entries = load_diagnostics(paths)
+if args.samples:
+    entries = [entry for entry in entries if entry['sample'] in set(args.samples)]
+if not entries:
+    raise SystemExit("No diagnostics to report")
+print(f"Reporting {len(entries)} sample(s)", flush=True)
+
+# ----- Summary table -----
+FITS = ['hypo', 'total', 'original', 'corrected']
+summary = pd.DataFrame([{'sample': e['sample'], **{f"{f}_{m}": e[f"{f}_{m}"] for f in FITS for m in ('slope', 'r2')}}
+                        for e in entries]).sort_values('sample')
+summary.to_csv(os.path.splitext(args.out)[0] + ".tsv", sep="\t", index=False, na_rep="NA")
+
+# === PLOT ===
+curve = lambda values: np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+fig, axes = plt.subplots(2, 2, figsize=(12, 9))
+for ax, column, title in ((axes[0, 0], 'original', "Original Fraction vs GC Content"),
+                          (axes[0, 1], 'corrected', "Corrected Fraction vs GC Content")):
+    curves = np.array([curve(e[column]) for e in entries])
+    for e, values in zip(entries, curves):
+        ax.plot(e['gc_bins'], values, color='grey', alpha=max(0.05, 1 / len(entries)) if len(entries) > 10 else 0.6,
+                lw=0.8, label=e['sample'] if len(entries) <= 10 else None)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # GC bins without windows in any sample
+        ax.plot(entries[0]['gc_bins'], np.nanmedian(curves, axis=0), color='r', lw=2, label="median")
+    ax.set_title(title)
+    ax.set_xlabel("GC Content (bin middle)")
+    ax.set_ylabel("Mean fraction per GC bin")
+    ax.legend(fontsize=6)
+
+x = np.arange(len(summary))
+axes[1, 0].scatter(x, summary['original_slope'], s=10, label="original")
+axes[1, 0].scatter(x, summary['corrected_slope'], s=10, label="corrected")
+axes[1, 0].axhline(0, color='k', lw=0.5)
+axes[1, 0].set_title("Slope of fraction on GC per sample")
+axes[1, 0].set_xlabel("Sample")
+axes[1, 0].legend(fontsize=6)
+
+axes[1, 1].scatter(summary['hypo_r2'], summary['total_r2'], s=10)
+axes[1, 1].set_title("GC fit R² per sample")
+axes[1, 1].set_xlabel("R² hypo ~ GC")
+axes[1, 1].set_ylabel("R² total ~ GC")
+
+plt.tight_layout()
+plt.savefig(args.out, dpi=150)
+print(f"Report written to {args.out}", flush=True)
@@ -1,10 +1,13 @@
 print("Script started", flush=True)
 import os
-import gzip
-import random
+import hashlib
 import numpy as np
-from glob import glob
 import argparse
+from read_pools import DEFAULT_READ_FILTER, ReadPool, CountPool, prepare_files, mix_counts, write_sample, sample_rng, run_tasks
+from windows import Windows
+from feature_matrix import hypo_fractions, write_feature_matrix, write_targets
+from mixture_design import DESIGN_DIR, load_design, select_files, per_file_pools, cohort_spec, plan_sample
+from manifest import MANIFEST_NAME, spec_hash, file_sha256, load_manifest, append_entry, is_current
 
 # === PARSE INPUT ===
 print("Start parsing arguments etc", flush=True)
@@ -12,138 +15,192 @@ parser = argparse.ArgumentParser()
 parser.add_argument('--cfDNA_dir', required=True, help='Path to healthy cfDNA background samples')
 parser.add_argument('--tissue_dir', required=True, help='Path to tissue samples (cirrhosis + tumour)')
 parser.add_argument('--output_dir', required=True, help='Path to preferred output directory')
+parser.add_argument('--design', nargs='+', default=[os.path.join(DESIGN_DIR, "standard.toml")], help='Mixture design file(s) (TOML); several designs share one pool-loading session')
+parser.add_argument('--pool_cache_dir', default=None, help='Where the uncompressed, indexed read pools are kept (default: <output_dir>/pool_cache)')
+parser.add_argument('--seed', type=int, default=None, help='Base seed; every sample gets its own child stream of it (default: the design seed, else the seed in the manifest, else fresh entropy)')
+parser.add_argument('--n_workers', type=int, default=1, help='Number of samples generated in parallel')
+parser.add_argument('--samples', nargs='+', default=None, help='Only (re)generate these sample names, e.g. synthetic_tumour_007')
+parser.add_argument('--force', action='store_true', help='Regenerate samples even when the manifest says they are up to date')
+parser.add_argument('--mode', choices=['reads', 'features'], default='reads', help="'reads' writes synthetic BED files, 'features' draws the samples directly as window counts into a feature matrix")
+parser.add_argument('--windows', default=None, help='windows.bed of the feature extraction (required for --mode features)')
+parser.add_argument('--sorted', action='store_true', help='Write reads in coordinate order with a tabix index instead of shuffled')
+parser.add_argument('--require_flags', type=int, default=DEFAULT_READ_FILTER['require_flags'], help='Keep only reads with all these SAM flag bits set (default 64: R1 only)')
+parser.add_argument('--exclude_flags', type=int, default=DEFAULT_READ_FILTER['exclude_flags'], help='Drop reads with any of these SAM flag bits set')
+parser.add_argument('--min_mapq', type=int, default=DEFAULT_READ_FILTER['min_mapq'], help='Keep only reads with at least this mapq')
+parser.add_argument('--write_threads', type=int, default=4, help='Threads compressing BGZF blocks per sample')
 args = parser.parse_args()
 
-cfDNA_dir = args.cfDNA_dir
-tissue_dir = args.tissue_dir
+input_dirs = {'cfDNA': args.cfDNA_dir, 'tissue': args.tissue_dir}
 output_dir = args.output_dir
-
-# Define subdirectories and metadata path
-OUTPUT_DIR = os.path.join(output_dir, "synthetic_samples")
-META_FILE = os.path.join(output_dir, "synthetic_sample_metadata.tsv")
-
-# Create output directory if it doesn't exist
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-# === CONFIG ===
-READS_PER_SAMPLE = 70_000_000
-N_HEALTHY = 10
-N_LIVER_CONTROL = 5
-N_CIRRHOSIS = 100
-N_TUMOUR = 100
-
-HEALTHY_LIVER_DIST = lambda: np.random.uniform(0.001, 0.01) # uniform 0.1%-1%
-CIRRHOSIS_DIST = lambda: np.random.uniform(0.01, 0.1)  # uniform 1%–10%
-TUMOUR_DIST = lambda: np.random.beta(0.3, 6) * 0.15     # skewed < 15%
-
-# === COLLECT FILES ===
-print("Start collecting files", flush=True)
-cfdna_background_files = glob(os.path.join(cfDNA_dir, "*.bed.gz"))
-tissue_files = glob(os.path.join(tissue_dir, "*.bed.gz"))
-healthy_liver_files = [f for f in tissue_files if "Cirrhosis" not in f and "Tumour" not in f]
-cirrhosis_files = [f for f in tissue_files if "Cirrhosis" in f]
-tumour_files = [f for f in tissue_files if "Tumour" in f]
-
-assert cfdna_background_files, "No cfdna background files found"
-assert healthy_liver_files, "No healthyliver files found"
-assert cirrhosis_files, "No cirrhosis files found"
-assert tumour_files, "No tumour files found"
-
-# === DEFINE FUNCTIONS ===
-def load_all_reads(file_list):
-    """Load all reads from all files in the list, return a list of lines"""
-    all_reads = []
-    for f in file_list:
-        with gzip.open(f, 'rt') as infile:
-            all_reads.extend(infile.readlines())
-    return all_reads
-
-def sample_reads_from_pool(pool, n):
-    """Randomly sample n reads from a pre-loaded pool of reads"""
-    return random.sample(pool, n)
-
-def write_sample(reads, out_path):
-    with gzip.open(out_path, 'wt') as out:
-        for line in reads:
-            out.write(line)
+pool_cache_dir = args.pool_cache_dir or os.path.join(output_dir, "pool_cache")
+read_filter = {'require_flags': args.require_flags, 'exclude_flags': args.exclude_flags, 'min_mapq': args.min_mapq}
+
+# === LOAD DESIGNS ===
+# With one design the outputs go straight into output_dir, with several into output_dir/<design name>
+DESIGNS = [load_design(path) for path in args.design]
+for design in DESIGNS:
+    design['output_dir'] = output_dir if len(DESIGNS) == 1 else os.path.join(output_dir, design['name'])
+    design['manifest'] = os.path.join(design['output_dir'], MANIFEST_NAME)
+    design['entries'] = load_manifest(design['manifest'])
+    # seed: --seed, else the design's seed, else the one an earlier run recorded, else fresh entropy
+    recorded_seeds = [entry['seed'] for entry in design['entries'].values()]
+    design['seed'] = next(s for s in (args.seed, design.get('seed'), recorded_seeds[-1] if recorded_seeds else None,
+                                      np.random.SeedSequence().entropy) if s is not None)
+    os.makedirs(os.path.join(design['output_dir'], "synthetic_samples") if args.mode == 'reads' else design['output_dir'], exist_ok=True)
 
 # === CREATE SAMPLE POOLS ===
-print("Loading all reads for each category", flush=True)
-cfdna_background_pool = load_all_reads(cfdna_background_files)
-healthy_liver_pool = load_all_reads(healthy_liver_files)
-cirrhosis_pool = load_all_reads(cirrhosis_files)
-tumour_pool = load_all_reads(tumour_files)
-print("Finished loading all reads into memory", flush=True)
+# Every input file is read once, in parallel: the reads passing the read filter (R1 by default) go into an
+# uncompressed spool in the pool cache, the inputs themselves are left untouched.
+# reads mode: each pool is indexed once (int64 record offsets); samples are drawn as index arrays
+# features mode: each pool is summarised once as per-window read counts; samples are drawn as counts
+# Pools with the same files are shared between designs, so every input is loaded only once.
+print("Indexing reads for each category", flush=True)
+WINDOWS = None
+if args.mode == 'features':
+    assert args.windows, "--windows is required for --mode features"
+    WINDOWS = Windows(args.windows)
+    make_pool = lambda files: CountPool(files, pool_cache_dir, WINDOWS, read_filter)
+else:
+    make_pool = lambda files: ReadPool(files, pool_cache_dir, coordinates=args.sorted, read_filter=read_filter)
+
+for design in DESIGNS:
+    design['pool_files'] = {}
+    for name, spec in design['pools'].items():
+        design['pool_files'][name] = select_files(spec, input_dirs)
+        assert design['pool_files'][name], f"No {name} files found for design {design['name']}"
+all_files = [f for design in DESIGNS for files in design['pool_files'].values() for f in files]
+prepare_files(all_files, pool_cache_dir, args.n_workers, read_filter, coordinates=args.sorted, windows=WINDOWS)
+
+POOLS = []
+pool_by_files = {}
+def pool_number(files):
+    """Number of the pool holding exactly these files, loading it on first use"""
+    key = tuple(sorted(files))
+    if key not in pool_by_files:
+        POOLS.append(make_pool(list(key)))
+        pool_by_files[key] = len(POOLS) - 1
+        print(f"Indexed pool of {len(key)} file(s) with {len(POOLS[-1]):,} reads", flush=True)
+    return pool_by_files[key]
+
+for design in DESIGNS:
+    split = per_file_pools(design)
+    design['pool_numbers'] = {}
+    for name, files in design['pool_files'].items():
+        if name in split:
+            design['pool_numbers'][name] = {os.path.basename(f): pool_number([f]) for f in files}
+        else:
+            design['pool_numbers'][name] = pool_number(files)
+print("Finished indexing all pools", flush=True)
+
+# === PLAN AGAINST THE MANIFEST ===
+# A sample is rebuilt only when it is new, its cohort spec / seed changed, or its output is missing;
+# every finished sample is appended to <output_dir>/manifest.jsonl straight away.
+def sample_name(task):
+    d, c, i = task
+    return f"{DESIGNS[d]['cohorts'][c]['prefix']}_{i+1:03d}"
+
+def output_path(task):
+    """Synthetic BED of a sample (None in features mode, where the sample is a feature matrix row)"""
+    if args.mode == 'features':
+        return None
+    return os.path.join(DESIGNS[task[0]]['output_dir'], "synthetic_samples", f"{sample_name(task)}.bed.gz")
+
+def existing_rows(path):
+    """Sample names already in a feature matrix"""
+    if not os.path.exists(path):
+        return set()
+    with open(path) as fh:
+        fh.readline()
+        return {line.split(",", 1)[0] for line in fh}
+
+for design in DESIGNS:
+    design['spec_hashes'] = [spec_hash(dict(cohort_spec(design, cohort, design['pool_files']), mode=args.mode, sorted=args.sorted, read_filter=read_filter,
+                                            windows=WINDOWS.checksum if args.mode == 'features' else None))
+                             for cohort in design['cohorts']]
+    design['matrix_rows'] = existing_rows(os.path.join(design['output_dir'], "FeatureMatrix.csv")) if args.mode == 'features' else None
+
+def up_to_date(task):
+    d, c, i = task
+    design = DESIGNS[d]
+    name = sample_name(task)
+    if design['matrix_rows'] is not None and name not in design['matrix_rows']:
+        return False
+    return is_current(design['entries'].get(name), design['spec_hashes'][c], design['seed'], output_path(task))
+
+all_tasks = [(d, c, i) for d, design in enumerate(DESIGNS) for c, cohort in enumerate(design['cohorts']) for i in range(cohort['n'])]
+if args.samples:
+    tasks = [t for t in all_tasks if sample_name(t) in args.samples]
+elif args.force:
+    tasks = all_tasks
+else:
+    tasks = [t for t in all_tasks if not up_to_date(t)]
 
 # === GENERATE SAMPLES ===
-metadata = []
-
-# Healthy-only samples
-for i in range(N_HEALTHY):
-    reads = sample_reads_from_pool(cfdna_background_pool, READS_PER_SAMPLE)
-
-    out_path = os.path.join(OUTPUT_DIR, f"synthetic_healthy_{i+1:03d}.bed.gz")
-    write_sample(reads, out_path)
-    metadata.append((os.path.basename(out_path), 'healthy', 1.0, 0.0, 0.0))
-
-# Technical control against overfitting: healthy cfDNA + low fractions of healthy liver tissue
-for i in range(N_LIVER_CONTROL):
-    frac_liver_tissue = HEALTHY_LIVER_DIST()
-    n_liver_tissue = int(READS_PER_SAMPLE * frac_liver_tissue)
-    n_healthy = READS_PER_SAMPLE - n_liver_tissue
-
-    reads = sample_reads_from_pool(healthy_liver_pool, n_liver_tissue) + sample_reads_from_pool(cfdna_background_pool, n_healthy)
-    random.shuffle(reads)
-
-    out_path = os.path.join(OUTPUT_DIR, f"healthy_liver_control_{i+1:03d}.bed.gz")
-    write_sample(reads, out_path)
-    metadata.append((os.path.basename(out_path), 'liver_control', 1 - frac_liver_tissue, 0.0, 0.0))
-
-
-# Cirrhosis-mixed samples
-for i in range(N_CIRRHOSIS):
-    frac_cirrhosis = CIRRHOSIS_DIST() # sample from the uniform distribution
-    n_cirr = int(READS_PER_SAMPLE * frac_cirrhosis)
-    n_healthy = READS_PER_SAMPLE - n_cirr
-
-    reads = sample_reads_from_pool(cirrhosis_pool, n_cirr) + sample_reads_from_pool(cfdna_background_pool, n_healthy)
-    random.shuffle(reads)
-
-    out_path = os.path.join(OUTPUT_DIR, f"synthetic_cirrhosis_{i+1:03d}.bed.gz")
-    write_sample(reads, out_path)
-    metadata.append((os.path.basename(out_path), 'cirrhosis', 1 - frac_cirrhosis, frac_cirrhosis, 0.0))
-
-# Tumour-mixed samples
-for i in range(N_TUMOUR):
-    frac_tumour = TUMOUR_DIST() #sample from beta distribution (more probability to sample lower tumour fractions)
-    n_tumour = int(READS_PER_SAMPLE * frac_tumour)
-    n_bg = READS_PER_SAMPLE - n_tumour
-
-    include_cirrhosis = random.choice([0, 1])  # 50% chance to include cirrhosis
-    if include_cirrhosis:
-        frac_cirrhosis = np.random.uniform(0.01, 0.05)  # small fraction (1%–5%)
-        n_cirrhosis = int(n_bg * frac_cirrhosis)
-        n_healthy = n_bg - n_cirrhosis
-    else:
-        frac_cirrhosis = 0.0
-        n_cirrhosis = 0
-        n_healthy = n_bg
-    frac_healthy = 1.0 - frac_tumour - frac_cirrhosis
-    
-    healthy_reads = sample_reads_from_pool(cfdna_background_pool, n_healthy)
-    cirrhosis_reads = sample_reads_from_pool(cirrhosis_pool, n_cirrhosis)
-    tumour_reads = sample_reads_from_pool(tumour_pool, n_tumour)
-    reads = healthy_reads + cirrhosis_reads + tumour_reads
-    random.shuffle(reads)
-
-    out_path = os.path.join(OUTPUT_DIR, f"synthetic_tumour_{i+1:03d}.bed.gz")
-    write_sample(reads, out_path)
-    metadata.append((os.path.basename(out_path), 'tumour', frac_healthy, frac_cirrhosis, frac_tumour)) 
-
-# Write metadata
-with open(META_FILE, 'w') as meta:
-    meta.write("sample\ttype\thealthy_fraction\tcirrhosis_fraction\ttumour_fraction\n")
-    for m in metadata:
-        meta.write("\t".join(map(str, m)) + "\n")
-
-print(f"Generated {N_HEALTHY + N_LIVER_CONTROL + N_CIRRHOSIS + N_TUMOUR} synthetic samples in {OUTPUT_DIR}", flush=True)
+# Each sample draws everything it needs from the rng of its own sample only,
+# so a sample is the same whether it is built serially, in a worker or on its own.
+def generate_sample(task):
+    """Build one sample from its own seeded stream and return its manifest entry (and features)"""
+    d, c, i = task
+    design = DESIGNS[d]
+    cohort = design['cohorts'][c]
+    name = sample_name(task)
+    rng = sample_rng(design['seed'], f"{design['name']}/{cohort['prefix']}", i)
+    parts, fractions, components = plan_sample(design, cohort, design['pool_numbers'], POOLS, rng)
+    entry = {
+        'sample': name,
+        'design': design['name'],
+        'cohort': cohort['prefix'],
+        'index': i,
+        'seed': design['seed'],
+        'spec_hash': design['spec_hashes'][c],
+        'sources': {comp['pool']: [os.path.basename(f) for f in design['pool_files'][comp['pool']]] for comp in components},
+        'components': components,
+        'metadata': list(fractions),
+    }
+
+    if args.mode == 'features':
+        hypo, total = mix_counts(parts, len(WINDOWS))
+        features = hypo_fractions(hypo, total)
+        entry.update(output=None, sha256=hashlib.sha256(features.tobytes()).hexdigest())
+        print(f"Drawn {name}", flush=True)
+        return entry, features
+
+    out_path = output_path(task)
+    write_sample(POOLS, parts, out_path, rng, sort=args.sorted, threads=args.write_threads) # shuffles the reads of all parts together unless sorted
+    entry.update(output=os.path.basename(out_path), size=os.path.getsize(out_path), sha256=file_sha256(out_path))
+    print(f"Written {os.path.basename(out_path)}", flush=True)
+    return entry, None
+
+def record(task, result):
+    """Append a finished sample to its design's manifest"""
+    design = DESIGNS[task[0]]
+    append_entry(design['manifest'], result[0])
+    design['entries'][result[0]['sample']] = result[0]
+
+for design in DESIGNS:
+    print(f"Design {design['name']}: seed {design['seed']}, output in {design['output_dir']}", flush=True)
+print(f"Generating {len(tasks)} of {len(all_tasks)} samples on {args.n_workers} worker(s), the others are up to date", flush=True)
+results = run_tasks(generate_sample, tasks, args.n_workers, on_result=record)
+
+# === WRITE OUTPUTS PER DESIGN ===
+for d, design in enumerate(DESIGNS):
+    design_results = [r for t, r in zip(tasks, results) if t[0] == d]
+
+    # Features mode: write the matrix and labels 03-modeling.sh would otherwise assemble (rows of skipped samples are kept)
+    if args.mode == 'features' and design_results:
+        FEATURE_MATRIX = os.path.join(design['output_dir'], "FeatureMatrix.csv")
+        names = [entry['sample'] for entry, _ in design_results]
+        write_feature_matrix(FEATURE_MATRIX, names, WINDOWS.names(), [f for _, f in design_results], keep_existing=True)
+        write_targets(os.path.join(design['output_dir'], "Target.csv"), names, keep_existing=True)
+        print(f"Feature matrix written to {FEATURE_MATRIX}", flush=True)
+
+    # Metadata of all samples of the design, rebuilt from the manifest
+    META_FILE = os.path.join(design['output_dir'], "synthetic_sample_metadata.tsv")
+    with open(META_FILE, 'w') as meta:
+        meta.write("sample\ttype\thealthy_fraction\tcirrhosis_fraction\ttumour_fraction\n")
+        for t in all_tasks:
+            entry = design['entries'].get(sample_name(t)) if t[0] == d else None
+            if entry:
+                meta.write("\t".join(map(str, [entry['output'] or entry['sample']] + entry['metadata'])) + "\n")
+
+    print(f"Generated {len(design_results)} synthetic samples for design {design['name']} in {design['output_dir']}", flush=True)
@@ -1,7 +1,11 @@
+import os
+import atexit
+import shutil
+import tempfile
 import numpy as np
+from joblib import Memory
 import pandas as pd
 import argparse
-from sklearn.model_selection import StratifiedKFold, GridSearchCV
 from sklearn.feature_selection import SelectKBest, mutual_info_classif, RFE
 from sklearn.linear_model import LogisticRegression, LassoCV
 from sklearn.decomposition import PCA
@@ -12,27 +16,50 @@ from sklearn.svm import SVC
 from sklearn.preprocessing import StandardScaler
 from sklearn.inspection import permutation_importance
 from sklearn.base import BaseEstimator, TransformerMixin, clone
-from sklearn.metrics import make_scorer, f1_score, roc_auc_score
 from sklearn.impute import SimpleImputer
+from feature_matrix import load_window_features
+from feature_store import FeatureStore, read_features, read_targets
+from out_of_core import CHUNK_ROWS, run_nested_cv_chunked
+from model_grid import core_budget, run_grid
 
 # ----- Setup: parse arguments from bash script -------
 parser = argparse.ArgumentParser()
-parser.add_argument('--Featurematrix', required=True, help='Path to feature matrix')
-parser.add_argument('--Target', required=True, help='Path to target matrix')
+parser.add_argument('--Featurematrix', required=True, help='Path to feature matrix (FeatureMatrix.csv or feature store dir from feature_store.py)')
+parser.add_argument('--Target', default=None, help='Path to target matrix (default: the labels of the feature store)')
 parser.add_argument('--output_dir', required=True, help='Path to preferred output directory')
+parser.add_argument('--LevelFeatures', default=None, help='Optional LevelFeatures.npy (methylation-level distribution per window) added to the features')
+parser.add_argument('--FragmentFeatures', default=None, help='Optional FragmentFeatures.npy (fragment size classes per window, Extract_features.py --fragments) added to the features')
+parser.add_argument('--n_cores', type=int, default=core_budget(), help='Core budget of the model grid (default: SLURM_CPUS_PER_TASK, else the CPUs available)')
+parser.add_argument('--threads', type=int, default=1, help='Threads per grid task (n_jobs, BLAS, OpenMP); n_cores // threads tasks run at once')
+parser.add_argument('--pipeline_cache', default=None, help='Dir caching the fitted imputer / scaler / selector / PCA steps, shared by all grid points of a fold (default: a temporary dir, removed at exit)')
+parser.add_argument('--out_of_core', action='store_true', help='Chunked training straight off the memory-mapped feature store (--Featurematrix a store dir): streamed imputation / scaling, ANOVA F filter, IncrementalPCA and SGD linear models')
+parser.add_argument('--chunk_rows', type=int, default=CHUNK_ROWS, help=f'Samples read at a time with --out_of_core (default {CHUNK_ROWS})')
 args = parser.parse_args()
+if args.chunk_rows < 1:
+    parser.error("--chunk_rows must be at least 1")
+if args.out_of_core and (args.LevelFeatures or args.FragmentFeatures or not os.path.isdir(args.Featurematrix)):
+    parser.error("--out_of_core needs --Featurematrix to be a feature store dir, without --LevelFeatures / --FragmentFeatures")
 
 Featurematrix = args.Featurematrix
-Target = args.Target
+Target = args.Target or args.Featurematrix
 output_dir = args.output_dir
-
-X_df = pd.read_csv(Featurematrix, na_values=['NA'])
-X_df = X_df.loc[:, ~X_df.columns.str.startswith(('chrX','chrY','chrM'))]
-X_df = X_df.dropna(axis=1, how='all') # Drop columns that are entirely NA
-X_df = X_df.iloc[:, 1:]  # skip first column with sample names
-X = X_df.values
-
-y_df = pd.read_csv(Target)
+pipeline_cache = args.pipeline_cache
+if pipeline_cache is None:
+    pipeline_cache = tempfile.mkdtemp(prefix="pipeline_cache_")
+    atexit.register(shutil.rmtree, pipeline_cache, ignore_errors=True)
+
+if not args.out_of_core:  # out of core the matrix is only read in chunks of samples, see main_out_of_core
+    X_df = read_features(Featurematrix)  # a store is memory-mapped and read with only the autosomal columns
+    if args.LevelFeatures:
+        X_df = pd.concat([X_df, load_window_features(args.LevelFeatures, X_df.iloc[:, 0])], axis=1)
+    if args.FragmentFeatures:
+        X_df = pd.concat([X_df, load_window_features(args.FragmentFeatures, X_df.iloc[:, 0])], axis=1)
+    X_df = X_df.loc[:, ~X_df.columns.str.startswith(('chrX','chrY','chrM'))]
+    X_df = X_df.dropna(axis=1, how='all') # Drop columns that are entirely NA
+    X_df = X_df.iloc[:, 1:]  # skip first column with sample names
+    X = X_df.values
+
+y_df = read_targets(Target)
 y = y_df.iloc[:, 1].astype(int).values #2nd column is label column
 
 # ----- Setup : define needed classes and functions ------
@@ -74,51 +101,21 @@ class PermutationImportanceSelector(BaseEstimator, TransformerMixin):
         return X[:, self.top_indices_]
 
 
-def run_nested_cv(X, y, feature_selector, model, param_grid, use_pca=False, n_components=10):
-    outer_cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=42) #to preserve class distribution
-    inner_cv = StratifiedKFold(n_splits=3, shuffle=True, random_state=42) #to preserve class distribution
-
-    f1_binary = make_scorer(f1_score, average='binary')
-
-    scores_f1 = []
-    scores_auc = []
-
-    for train_idx, test_idx in outer_cv.split(X, y):
-        X_train, X_test = X[train_idx], X[test_idx]
-        y_train, y_test = y[train_idx], y[test_idx]
-
-        steps = [
-            ('imputer', SimpleImputer(strategy='mean')),  # Impute missing values per feature using mean
-            ('scaler', StandardScaler())
-        ]
-        if feature_selector:
-            steps.append(('feature_selection', feature_selector))
-        if use_pca:
-            steps.append(('pca', PCA(n_components=n_components)))
-
-        # Add model as a placeholder for now
-        steps.append(('model', model))
-        pipe = Pipeline(steps)
-
-        # Define parameter grid using model prefix in the pipeline
-        search = GridSearchCV(pipe, param_grid=param_grid, cv=inner_cv, scoring=f1_binary, n_jobs=-1)
-        search.fit(X_train, y_train)
-
-        y_pred = search.predict(X_test)
-        score_f1 = f1_score(y_test, y_pred, average='binary')
-        scores_f1.append(score_f1)
-
-        y_proba = search.predict_proba(X_test)[:, 1]
-        score_auc = roc_auc_score(y_test, y_proba)
-        scores_auc.append(score_auc)
-
-    return np.mean(scores_f1), np.std(scores_f1), np.mean(scores_auc), np.std(scores_auc)
+def make_pipeline(feature_selector, model, use_pca=False, n_components=10, memory=None):
+    steps = [
+        ('imputer', SimpleImputer(strategy='mean')),  # Impute missing values per feature using mean
+        ('scaler', StandardScaler())
+    ]
+    if feature_selector:
+        steps.append(('feature_selection', feature_selector))
+    if use_pca:
+        steps.append(('pca', PCA(n_components=n_components)))
+    steps.append(('model', model))
+    return Pipeline(steps, memory=memory)
 
 # ----- Main: test all combinations of feature selection methods and ML models -------
 
 def main(X, y):
-    results = []
-
     # Filter Method: Mutual Information
     filter_selector = SelectKBest(mutual_info_classif, k=30)
 
@@ -167,6 +164,11 @@ def main(X, y):
         'Embedded_Lasso': embedded_selector
     }
 
+    # every combination with and without PCA, each nested CV (5 outer x 3 inner folds x grid points) as tasks of
+    # one process pool with the core budget of the job (model_grid.py). Only model__ parameters vary over the grid,
+    # so the fitted steps before the model are cached per fold and fitted once for all grid points
+    memory = Memory(pipeline_cache, verbose=0)
+    combinations = []
     for sel_name, selector in selectors.items():
         for model_name, (model, param_grid) in models_and_params.items():
             # Skip incompatible model-selector pairs
@@ -180,21 +182,35 @@ def main(X, y):
                 continue
             if sel_name == 'Wrapper_XGB' and model_name != 'XGBoost':
                 continue
-            
-            print(f"Running feature selector: {sel_name}, model: {model_name}, PCA: No PCA", flush=True)
-            f1_mean, f1_std, auc_mean, auc_std = run_nested_cv(X, y, selector, model, param_grid, use_pca=False)
-            results.append((sel_name, model_name, 'No PCA', f1_mean, f1_std, auc_mean, auc_std))
-            print(f"Completed feature selector: {sel_name}, model: {model_name}, PCA: No PCA", flush=True)
 
-            print(f"Running feature selector: {sel_name}, model: {model_name}, PCA: With PCA", flush=True)
-            f1_mean, f1_std, auc_mean, auc_std = run_nested_cv(X, y, selector, model, param_grid, use_pca=True, n_components=10)
-            results.append((sel_name, model_name, 'With PCA', f1_mean, f1_std, auc_mean, auc_std))
-            print(f"Completed feature selector: {sel_name}, model: {model_name}, PCA: With PCA", flush=True)
+            for pca_name, use_pca in (('No PCA', False), ('With PCA', True)):
+                combinations.append({'name': f"feature selector: {sel_name}, model: {model_name}, PCA: {pca_name}",
+                                     'row': (sel_name, model_name, pca_name), 'param_grid': param_grid,
+                                     'pipeline': make_pipeline(selector, model, use_pca=use_pca, n_components=10, memory=memory)})
 
+    scores = run_grid(combinations, X, y, n_cores=args.n_cores, threads=args.threads)
+    results = [combination['row'] + score for combination, score in zip(combinations, scores)]
     results_df = pd.DataFrame(results, columns=['Selector', 'Model', 'PCA', 'Mean F1', 'Std F1', "Mean AUC", "Std AUC"])
     return results_df
 
+def main_out_of_core(store, y):
+    # Same nested CV, with the chunked pipeline of out_of_core.py: only linear models trained by SGD (log loss as
+    # logistic regression, modified Huber as a linear SVM with probabilities) and a univariate filter (ANOVA F; mutual
+    # information needs all samples of a feature at once), the SGD alpha chosen in the inner folds
+    results = []
+    models = {'SGD_Logistic': 'log_loss', 'SGD_LinearSVM': 'modified_huber'}
+    selectors = {'Filter_F': 30, 'None': 0}
+    alphas = [1e-5, 1e-4, 1e-3, 1e-2]
+    for sel_name, k in selectors.items():
+        for model_name, loss in models.items():
+            for pca_name, n_components in (('No PCA', None), ('With PCA', 10)):
+                print(f"Running feature selector: {sel_name}, model: {model_name}, PCA: {pca_name} (out of core)", flush=True)
+                f1_mean, f1_std, auc_mean, auc_std = run_nested_cv_chunked(store, y, k, n_components, loss, alphas, chunk_rows=args.chunk_rows)
+                results.append((sel_name, model_name, pca_name, f1_mean, f1_std, auc_mean, auc_std))
+                print(f"Completed feature selector: {sel_name}, model: {model_name}, PCA: {pca_name}", flush=True)
+    return pd.DataFrame(results, columns=['Selector', 'Model', 'PCA', 'Mean F1', 'Std F1', "Mean AUC", "Std AUC"])
+
 # ----- Run -----
-results_df = main(X, y)
+results_df = main_out_of_core(FeatureStore(Featurematrix), y) if args.out_of_core else main(X, y)
 results_df.to_csv(f"{output_dir}/model_selection_results.csv", index=False)
 print(f"Results saved to {output_dir}/model_selection_results.csv")
\ No newline at end of file
@@ -1,6 +1,10 @@
+import atexit
+import shutil
+import tempfile
 import numpy as np
 import pandas as pd
 import argparse
+from joblib import Memory
 from sklearn.model_selection import StratifiedKFold, RandomizedSearchCV
 from sklearn.feature_selection import SelectKBest, mutual_info_classif, RFE
 from sklearn.linear_model import LogisticRegression
@@ -17,41 +21,60 @@ from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report
 import numpy as np
 from sklearn.metrics import f1_score
+from feature_matrix import load_window_features
+from feature_store import read_features, read_targets
 
 # ----- Setup: parse arguments from bash script -------
 parser = argparse.ArgumentParser()
-parser.add_argument('--Featurematrix', required=True, help='Path to feature matrix')
-parser.add_argument('--Target', required=True, help='Path to target matrix')
-parser.add_argument('--ValidationFeatures', required=True, help='Path to validation feature matrix')
-parser.add_argument('--ValidationTarget', required=True, help='Path to validation target matrix')
+parser.add_argument('--Featurematrix', required=True, help='Path to feature matrix (FeatureMatrix.csv or feature store dir from feature_store.py)')
+parser.add_argument('--Target', default=None, help='Path to target matrix (default: the labels of the feature store)')
+parser.add_argument('--ValidationFeatures', required=True, help='Path to validation feature matrix (CSV or feature store dir)')
+parser.add_argument('--ValidationTarget', default=None, help='Path to validation target matrix (default: the labels of the validation feature store)')
 parser.add_argument('--output_dir', required=True, help='Path to preferred output directory')
+parser.add_argument('--LevelFeatures', default=None, help='Optional LevelFeatures.npy of the training samples added to the features')
+parser.add_argument('--ValidationLevelFeatures', default=None, help='LevelFeatures.npy of the validation samples (with --LevelFeatures)')
+parser.add_argument('--FragmentFeatures', default=None, help='Optional FragmentFeatures.npy of the training samples added to the features')
+parser.add_argument('--ValidationFragmentFeatures', default=None, help='FragmentFeatures.npy of the validation samples (with --FragmentFeatures)')
+parser.add_argument('--pipeline_cache', default=None, help='Dir caching the fitted imputer / scaler / selector / PCA steps across the tuning candidates (default: a temporary dir, removed at exit)')
 args = parser.parse_args()
 
 Featurematrix = args.Featurematrix
-Target = args.Target
+Target = args.Target or args.Featurematrix
 ValidationFeatures = args.ValidationFeatures
-ValidationTarget = args.ValidationTarget
+ValidationTarget = args.ValidationTarget or args.ValidationFeatures
 output_dir = args.output_dir
+pipeline_cache = args.pipeline_cache
+if pipeline_cache is None:
+    pipeline_cache = tempfile.mkdtemp(prefix="pipeline_cache_")
+    atexit.register(shutil.rmtree, pipeline_cache, ignore_errors=True)
 
 # Load data
-X_df = pd.read_csv(Featurematrix, na_values=['NA'])
+X_df = read_features(Featurematrix)  # a store is memory-mapped and read with only the autosomal columns
+if args.LevelFeatures:
+    X_df = pd.concat([X_df, load_window_features(args.LevelFeatures, X_df.iloc[:, 0])], axis=1)
+if args.FragmentFeatures:
+    X_df = pd.concat([X_df, load_window_features(args.FragmentFeatures, X_df.iloc[:, 0])], axis=1)
 X_df = X_df.loc[:, ~X_df.columns.str.startswith(('chrX','chrY','chrM'))]
 X_df = X_df.dropna(axis=1, how='all') # Drop columns entirely NA
 X_df = X_df.iloc[:, 1:]  # skip first col with sample names
 X = X_df.values
 
-y_df = pd.read_csv(Target)
+y_df = read_targets(Target)
 y = y_df.iloc[:, 1].astype(int).values
 
 common_columns = X_df.columns
-X_val_df = pd.read_csv(ValidationFeatures, na_values=['NA'])
+X_val_df = read_features(ValidationFeatures)
+if args.LevelFeatures:
+    X_val_df = pd.concat([X_val_df, load_window_features(args.ValidationLevelFeatures, X_val_df.iloc[:, 0])], axis=1)
+if args.FragmentFeatures:
+    X_val_df = pd.concat([X_val_df, load_window_features(args.ValidationFragmentFeatures, X_val_df.iloc[:, 0])], axis=1)
 X_val_df = X_val_df.loc[:, ~X_val_df.columns.str.startswith(('chrX','chrY','chrM'))]
 X_val_df = X_val_df.dropna(axis=1, how='all')
 X_val_df = X_val_df.iloc[:, 1:]  # skip first col
 X_val_df = X_val_df.reindex(columns=common_columns)  # enforce same feature order
 X_val = X_val_df.values
 
-y_val_df = pd.read_csv(ValidationTarget)
+y_val_df = read_targets(ValidationTarget)
 y_val = y_val_df.iloc[:, 1].astype(int).values
 
 # Feature selectors
@@ -130,7 +153,9 @@ def train_and_validate(X_train, y_train, X_val, y_val, selector, model, param_di
     if use_pca:
         steps.append(('pca', PCA(n_components=0.95)))
     steps.append(('model', model))
-    pipe = Pipeline(steps)
+    # the steps before the model are cached (per training rows and step parameters): only model__ parameters are
+    # tuned, so the search fits them once per inner fold instead of once per candidate and fold
+    pipe = Pipeline(steps, memory=Memory(pipeline_cache, verbose=0))
 
     # Fit on training split
     pipe.fit(X_train_split, y_train_split)
@@ -146,6 +171,10 @@ def train_and_validate(X_train, y_train, X_val, y_val, selector, model, param_di
     cv_inner = StratifiedKFold(n_splits=3, shuffle=True, random_state=42)
     scorer = make_scorer(weighted_score, needs_proba=True)
 
+    # fit the cached steps of each inner fold once up front, so the parallel candidates all load them from the cache
+    for fit_idx, _ in cv_inner.split(X_train, y_train):
+        clone(pipe).set_params(model='passthrough').fit(X_train[fit_idx], y_train[fit_idx])
+
     search = RandomizedSearchCV(
         pipe,
         param_distributions=param_dist,
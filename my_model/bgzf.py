@@ -0,0 +1,150 @@
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# === BGZF ===
+# Blocked gzip as used by htslib: every block is a complete gzip member holding at most 64 kB,
+# so files stay readable by zcat/gzip while blocks can be compressed independently (zlib releases the GIL).
+BLOCK_SIZE = 0xff00  # uncompressed bytes per block, as htslib
+EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def compress_block(data, level=6):
+    """One BGZF block (gzip member with the BC extra field) for up to BLOCK_SIZE bytes"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<BBBBIBBHBBHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(cdata) + 25)
+    return header + cdata + struct.pack('<II', zlib.crc32(data), len(data))
+
+
+class BgzfWriter:
+    """Write a BGZF file, compressing blocks on a thread pool while keeping them in order.
+
+    The compressed offset and uncompressed start of every block are recorded so that virtual
+    offsets (for an index) can be computed afterwards with virtual_offsets().
+    """
+
+    def __init__(self, path, threads=4, level=6):
+        self.fh = open(path, 'wb')
+        self.level = level
+        self.executor = ThreadPoolExecutor(max_workers=max(1, threads))
+        self.max_pending = 4 * max(1, threads)
+        self.pending = []
+        self.buffer = bytearray()
+        self.block_ustarts = []
+        self.block_coffsets = []
+        self.upos = 0
+        self.cpos = 0
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= BLOCK_SIZE:
+            self._submit(bytes(self.buffer[:BLOCK_SIZE]))
+            del self.buffer[:BLOCK_SIZE]
+
+    def _submit(self, data):
+        self.block_ustarts.append(self.upos)
+        self.upos += len(data)
+        self.pending.append(self.executor.submit(compress_block, data, self.level))
+        if len(self.pending) >= self.max_pending:
+            self._drain(len(self.pending) // 2)
+
+    def _drain(self, n=None):
+        n = len(self.pending) if n is None else n
+        for future in self.pending[:n]:
+            block = future.result()
+            self.block_coffsets.append(self.cpos)
+            self.fh.write(block)
+            self.cpos += len(block)
+        del self.pending[:n]
+
+    def close(self):
+        if self.buffer:
+            self._submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        self._drain()
+        self.fh.write(EOF_BLOCK)
+        self.fh.close()
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def virtual_offsets(self, upositions):
+        """BGZF virtual offsets (block offset << 16 | offset in block) of uncompressed positions"""
+        ustarts = np.asarray(self.block_ustarts, dtype=np.int64)
+        coffsets = np.asarray(self.block_coffsets, dtype=np.int64)
+        upositions = np.asarray(upositions, dtype=np.int64)
+        block = np.searchsorted(ustarts, upositions, side='right') - 1
+        within = upositions - ustarts[block]
+        # a position at the very end of the file points past the last block
+        at_end = upositions >= self.upos
+        voff = (coffsets[block] << 16) | within
+        voff[at_end] = self.cpos << 16
+        return voff.astype(np.uint64)
+
+
+# === TABIX INDEX ===
+def reg2bin(beg, end):
+    """UCSC/SAM binning scheme bin of 0-based, end-exclusive intervals (vectorized)"""
+    beg = np.asarray(beg, dtype=np.int64)
+    end = np.asarray(end, dtype=np.int64) - 1
+    result = np.zeros(len(beg), dtype=np.int64)
+    done = np.zeros(len(beg), dtype=bool)
+    for shift, first in ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)):
+        same = ~done & ((beg >> shift) == (end >> shift))
+        result[same] = first + (beg[same] >> shift)
+        done |= same
+    return result
+
+
+def write_tabix_index(path, chrom_names, chrom_ids, begs, ends, voff_starts, voff_ends):
+    """Write a .tbi for a coordinate-sorted BED (records given in file order)"""
+    out = bytearray()
+    names = b"".join(name.encode() + b"\0" for name in chrom_names)
+    # format 0x10000: generic, 0-based (UCSC) coordinates; columns seq=1, beg=2, end=3; '#' comments
+    out += b"TBI\1" + struct.pack('<8i', len(chrom_names), 0x10000, 1, 2, 3, ord('#'), 0, len(names)) + names
+
+    bins = reg2bin(begs, ends)
+    for ref in range(len(chrom_names)):
+        sel = np.flatnonzero(chrom_ids == ref)
+        chunks = {}
+        if len(sel):
+            ref_bins = bins[sel]
+            # runs of consecutive records in the same bin become one chunk
+            run_starts = np.flatnonzero(np.r_[True, ref_bins[1:] != ref_bins[:-1]])
+            run_ends = np.r_[run_starts[1:], len(sel)] - 1
+            for b, first, last in zip(ref_bins[run_starts].tolist(), sel[run_starts], sel[run_ends]):
+                chunks.setdefault(b, []).append((int(voff_starts[first]), int(voff_ends[last])))
+        out += struct.pack('<i', len(chunks))
+        for b, chunk_list in chunks.items():
+            out += struct.pack('<Ii', b, len(chunk_list))
+            for c_beg, c_end in chunk_list:
+                out += struct.pack('<QQ', c_beg, c_end)
+
+        # linear index: smallest virtual offset of a record overlapping each 16 kB window
+        if len(sel):
+            first_window = begs[sel] >> 14
+            last_window = (ends[sel] - 1) >> 14
+            span = last_window - first_window + 1
+            windows = np.repeat(first_window, span) + (np.arange(span.sum()) - np.repeat(np.cumsum(span) - span, span))
+            ioff = np.zeros(int(last_window.max()) + 1, dtype=np.uint64)
+            seen = np.zeros(len(ioff), dtype=bool)
+            offsets = np.repeat(voff_starts[sel], span)
+            order = np.argsort(windows, kind='stable')
+            uniq, first = np.unique(windows[order], return_index=True)
+            ioff[uniq] = offsets[order][first]
+            seen[uniq] = True
+            for w in range(1, len(ioff)):
+                if not seen[w]:
+                    ioff[w] = ioff[w - 1]
+        else:
+            ioff = np.zeros(0, dtype=np.uint64)
+        out += struct.pack('<i', len(ioff)) + ioff.astype('<u8').tobytes()
+
+    with BgzfWriter(path, threads=1) as writer:
+        writer.write(bytes(out))
@@ -0,0 +1,166 @@
+import os
+import numpy as np
+from per_read import MIN_MAPQ, MIN_CPG_TOTAL, MIN_CPG_HYPO, MAX_HYPO_LEVEL
+
+# === HISTOGRAM LAYOUT ===
+# Reads passing mapq > MIN_MAPQ are binned per window by (num_cpg, num_mod):
+#   bins [0, EXACT_CPG**2)      exact pair, num_cpg * EXACT_CPG + num_mod, for num_cpg < EXACT_CPG
+#   bins [EXACT_CPG**2, N_BINS)  reads with num_cpg >= EXACT_CPG by methylation level,
+#                                bin ceil(LEVEL_BINS * level), i.e. level in ((b-1)/100, b/100]
+# So any CpG threshold up to EXACT_CPG and any level threshold is exact for the exact pairs;
+# for the (rare) reads with many CpGs the level is exact at multiples of 1 / LEVEL_BINS.
+EXACT_CPG = 32
+LEVEL_BINS = 100
+N_BINS = EXACT_CPG * EXACT_CPG + LEVEL_BINS + 1
+HIST_SUFFIX = ".hist.npz"
+
+
+def read_bins(mapq, num_cpg, num_mod):
+    """Histogram bin of every read, -1 for reads that never count (mapq <= MIN_MAPQ or no CpGs)"""
+    num_cpg = np.nan_to_num(np.asarray(num_cpg, dtype=np.float64), nan=0).astype(np.int64)
+    num_mod = np.nan_to_num(np.asarray(num_mod, dtype=np.float64), nan=0).astype(np.int64)
+    usable = (np.asarray(mapq) > MIN_MAPQ) & (num_cpg > 0)
+    exact = num_cpg < EXACT_CPG
+    safe_cpg = np.maximum(num_cpg, 1)
+    level_bin = (LEVEL_BINS * num_mod + safe_cpg - 1) // safe_cpg  # integer ceil, no float rounding
+    bins = np.where(exact, num_cpg * EXACT_CPG + np.minimum(num_mod, EXACT_CPG - 1),
+                    EXACT_CPG * EXACT_CPG + np.clip(level_bin, 0, LEVEL_BINS))
+    return np.where(usable, bins, -1)
+
+
+def threshold_bins(min_cpg_hypo=MIN_CPG_HYPO, max_level=MAX_HYPO_LEVEL, min_cpg_total=MIN_CPG_TOTAL):
+    """(hypo, total) boolean masks over the histogram bins for a threshold set"""
+    if max(min_cpg_hypo, min_cpg_total) > EXACT_CPG:
+        raise ValueError(f"CpG thresholds above {EXACT_CPG} are not resolved by the histogram")
+    cpg, mod = np.divmod(np.arange(EXACT_CPG * EXACT_CPG), EXACT_CPG)
+    valid = cpg > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        level = mod / cpg
+    # many-CpG bins: every read there has num_cpg >= EXACT_CPG >= any CpG threshold
+    level_bin = np.arange(LEVEL_BINS + 1)
+    hypo = np.r_[valid & (cpg >= min_cpg_hypo) & (level <= max_level), level_bin <= np.floor(LEVEL_BINS * max_level + 1e-9)]
+    total = np.r_[valid & (cpg >= min_cpg_total), np.ones(LEVEL_BINS + 1, dtype=bool)]
+    return hypo, total
+
+
+def accumulate(start_hist, cross_hist, bins, first, second, n_windows):
+    """Add reads to (bin, window) start / boundary-crossing histograms (see Windows.coarsen)"""
+    counted = bins >= 0
+    sel = counted & (first >= 0)
+    start_hist += np.bincount(bins[sel] * n_windows + first[sel], minlength=N_BINS * n_windows).reshape(N_BINS, n_windows)
+    sel = counted & (second >= 0)
+    cross_hist += np.bincount(bins[sel] * n_windows + first[sel], minlength=N_BINS * n_windows).reshape(N_BINS, n_windows)
+
+
+# === METHYLATION-LEVEL DISTRIBUTION ===
+def level_feature_names(n_bins):
+    """Names of the per-window values level_features() returns"""
+    edges = np.linspace(0, 1, n_bins + 1)
+    return [f"level_{lo:.2f}_{hi:.2f}" for lo, hi in zip(edges[:-1], edges[1:])] + ['level_mean', 'level_var', 'level_entropy']
+
+
+def level_features(hist, n_bins=10, min_cpg=MIN_CPG_TOTAL):
+    """Per-window methylation-level distribution of the reads counted in the total (>= min_cpg CpGs).
+
+    hist is a (N_BINS, windows) overlap histogram. Returns float32 (windows, n_bins + 3): the share of reads
+    per level bin ([0, 1/n], then right-closed), mean, variance and entropy (bits) of the level; NaN for
+    windows without reads. Levels of the many-CpG bins are taken at their bin middle.
+    """
+    if LEVEL_BINS % n_bins:
+        raise ValueError(f"n_bins must divide {LEVEL_BINS}")
+    cpg, mod = np.divmod(np.arange(EXACT_CPG * EXACT_CPG), EXACT_CPG)
+    safe_cpg = np.maximum(cpg, 1)
+    b = np.arange(LEVEL_BINS + 1)
+    level = np.clip(np.r_[mod / safe_cpg, np.maximum(b - 0.5, 0) / LEVEL_BINS], 0, 1)
+    included = np.r_[(cpg > 0) & (cpg >= min_cpg), np.ones(LEVEL_BINS + 1, dtype=bool)]
+    # level bin per histogram bin with integer ceilings, so e.g. 3/10 lands in (0.2, 0.3] and not above
+    ceil = np.r_[(mod * n_bins + safe_cpg - 1) // safe_cpg, (b * n_bins + LEVEL_BINS - 1) // LEVEL_BINS]
+    level_bin = np.clip(ceil - 1, 0, n_bins - 1)
+
+    assign = np.zeros((n_bins, N_BINS))
+    assign[level_bin[included], np.flatnonzero(included)] = 1
+    hist = np.asarray(hist, dtype=np.float64)
+    counts = assign @ hist
+    total = counts.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = counts / total
+        mean = (level * included) @ hist / total
+        var = np.maximum((level ** 2 * included) @ hist / total - mean ** 2, 0)
+        entropy = -np.sum(np.where(shares > 0, shares * np.log2(np.where(shares > 0, shares, 1)), 0), axis=0)
+    features = np.vstack([shares, mean, var, entropy]).T
+    features[total == 0] = np.nan
+    return features.astype(np.float32)
+
+
+# === CACHE FILES ===
+def save_histogram(path, windows, start_hist, cross_hist):
+    """Write a sample's histograms (compressed; mostly empty bins)"""
+    with open(path + ".tmp", 'wb') as fh:
+        np.savez_compressed(fh, start=start_hist.astype(np.uint32), cross=cross_hist.astype(np.uint32),
+                            window_size=windows.window_size, windows_checksum=windows.checksum,
+                            exact_cpg=EXACT_CPG, level_bins=LEVEL_BINS, min_mapq=MIN_MAPQ)
+    os.replace(path + ".tmp", path)
+
+
+class HistogramCache:
+    """Per-window (num_cpg x methylation) histograms of one sample, queried for any threshold set.
+
+    windows must be the Windows the cache was built at; counts() can also return any coarser resolution.
+    """
+
+    def __init__(self, path, windows):
+        with np.load(path) as data:
+            if str(data['windows_checksum']) != windows.checksum:
+                raise ValueError(f"{path} was built for other windows than {windows.checksum[:12]}")
+            if int(data['exact_cpg']) != EXACT_CPG or int(data['level_bins']) != LEVEL_BINS:
+                raise ValueError(f"{path} has an older histogram layout")
+            self.start = data['start'].astype(np.int64)
+            self.cross = data['cross'].astype(np.int64)
+        self.windows = windows
+
+    def counts(self, min_cpg_hypo=MIN_CPG_HYPO, max_level=MAX_HYPO_LEVEL, min_cpg_total=MIN_CPG_TOTAL, windows=None):
+        """(hypo, total) overlap counts per window (of windows, default the cache's own)"""
+        selection = np.vstack(threshold_bins(min_cpg_hypo, max_level, min_cpg_total)).astype(np.int64)
+        hypo_total = self.windows.coarsen(windows if windows is not None else self.windows, selection @ self.start, selection @ self.cross)
+        return hypo_total[0], hypo_total[1]
+
+    def histogram(self, windows=None):
+        """(N_BINS, windows) overlap histogram (of windows, default the cache's own)"""
+        return self.windows.coarsen(windows if windows is not None else self.windows, self.start, self.cross)
+
+    def level_features(self, n_bins=10, min_cpg=MIN_CPG_TOTAL, windows=None):
+        """Methylation-level histogram, mean, variance and entropy per window (see level_features())"""
+        return level_features(self.histogram(windows), n_bins, min_cpg)
+
+    def fractions(self, min_cpg_hypo=MIN_CPG_HYPO, max_level=MAX_HYPO_LEVEL, min_cpg_total=MIN_CPG_TOTAL, windows=None):
+        """hypo / total per window, NaN where no reads count"""
+        hypo, total = self.counts(min_cpg_hypo, max_level, min_cpg_total, windows)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(total > 0, hypo / total, np.nan)
+
+
+# === RE-DERIVE FEATURES FROM THE COMMAND LINE ===
+if __name__ == "__main__":
+    import argparse
+    from windows import Windows
+    parser = argparse.ArgumentParser(description="Write <sample>_hypo_fraction.bed files for other thresholds from cached histograms")
+    parser.add_argument('--hist', nargs='+', required=True, help='<sample>.hist.npz files (Extract_features.py --hist_dir)')
+    parser.add_argument('--windows', required=True, help='windows.bed the histograms were built at (finest extracted resolution)')
+    parser.add_argument('--resolution', type=int, default=None, help='Write features at this (coarser) window size instead')
+    parser.add_argument('--out_dir', required=True, help='Feature dir for the fraction files')
+    parser.add_argument('--min_cpg_hypo', type=int, default=MIN_CPG_HYPO)
+    parser.add_argument('--max_level', type=float, default=MAX_HYPO_LEVEL)
+    parser.add_argument('--min_cpg_total', type=int, default=MIN_CPG_TOTAL)
+    args = parser.parse_args()
+
+    windows = Windows(args.windows)
+    target = windows.chop(args.resolution) if args.resolution else windows
+    os.makedirs(args.out_dir, exist_ok=True)
+    for path in args.hist:
+        cache = HistogramCache(path, windows)
+        fractions = cache.fractions(args.min_cpg_hypo, args.max_level, args.min_cpg_total, windows=target)
+        out_path = os.path.join(args.out_dir, os.path.basename(path)[:-len(HIST_SUFFIX)] + "_hypo_fraction.bed")
+        with open(out_path, 'w') as out:
+            for chrom, start, end, f in zip(target.bed['chr'], target.bed['start'], target.bed['end'], fractions.tolist()):
+                out.write(f"{chrom}\t{start}\t{end}\t{'NA' if np.isnan(f) else '%.6g' % f}\n")
+        print(f"Written {out_path}", flush=True)
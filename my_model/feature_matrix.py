@@ -0,0 +1,63 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+
+def hypo_fractions(hypo, total):
+    """hypo / total per window, NaN where a window has no reads"""
+    hypo = np.asarray(hypo, dtype=np.float64)
+    total = np.asarray(total, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total > 0, hypo / total, np.nan)
+
+
+def label_from_name(sample_name, positive=("tumour",), negative=("healthy", "cirrhosis")):
+    """Label rule of 03-modeling.sh: tumour samples are 1, healthy / cirrhosis samples 0
+    (05-validation-models.sh uses HCC / control)"""
+    if any(word in sample_name for word in positive):
+        return 1
+    if any(word in sample_name for word in negative):
+        return 0
+    raise ValueError(f"Cannot derive a label from sample name {sample_name}")
+
+
+def _merge_rows(path, header, rows, keep_existing):
+    """Write header + rows; with keep_existing, rows of other samples already in the file are kept"""
+    lines = {}
+    if keep_existing and os.path.exists(path):
+        with open(path) as fh:
+            fh.readline()
+            for line in fh:
+                lines[line.split(",", 1)[0]] = line
+    for line in rows:
+        lines[line.split(",", 1)[0]] = line
+    with open(path, 'w') as out:
+        out.write(header)
+        out.writelines(lines.values())
+
+
+def write_feature_matrix(path, sample_names, feature_names, values, keep_existing=False):
+    """Write a FeatureMatrix.csv in the layout 03-modeling.sh builds (sample_id + one column per window)"""
+    rows = [name + "," + ",".join("NA" if np.isnan(v) else repr(float(v)) for v in row) + "\n"
+            for name, row in zip(sample_names, values)]
+    _merge_rows(path, "sample_id," + ",".join(feature_names) + "\n", rows, keep_existing)
+
+
+def write_targets(path, sample_names, keep_existing=False):
+    """Write the matching Target.csv"""
+    rows = [f"{name},{label_from_name(name)}\n" for name in sample_names]
+    _merge_rows(path, "sample_id,tumour\n", rows, keep_existing)
+
+
+def load_window_features(path, sample_ids):
+    """Stacked per-window features (LevelFeatures.npy, FragmentFeatures.npy, ... + .json) as a DataFrame
+    with a row per sample id and <window>|<feature> columns"""
+    with open(os.path.splitext(path)[0] + ".json") as fh:
+        meta = json.load(fh)
+    rows = pd.Index(meta['samples']).get_indexer(list(sample_ids))
+    if (rows < 0).any():
+        raise ValueError(f"{path} has no rows for {list(np.asarray(sample_ids)[rows < 0][:5])}")
+    values = np.load(path, mmap_mode='r')[rows]
+    columns = [f"{window}|{feature}" for window in meta['windows'] for feature in meta['features']]
+    return pd.DataFrame(values.reshape(len(rows), -1), columns=columns)
@@ -0,0 +1,186 @@
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+from feature_matrix import label_from_name
+
+# === STORE LAYOUT ===
+# <store>/meta.json     number of features and samples; written last, so rows beyond n_samples are never read
+# <store>/windows.tsv   one row per feature column: name (chr:start:end, as in FeatureMatrix.csv), chr, start, end
+# <store>/samples.tsv   one row per sample in row order: sample_id, tumour label (NA when unknown) and metadata columns
+# <store>/values.f32    raw little-endian float32 samples x features, row-major: a new sample is one appended row
+# Samples already in the store are overwritten in place; nothing else is ever rewritten but the small tables.
+STORE_DTYPE = np.dtype('<f4')
+NON_AUTOSOMAL = ('chrX', 'chrY', 'chrM')
+FRACTION_SUFFIXES = ("_corrected_hypo_fraction.bed", "_hypo_fraction.bed", ".bed.gz", ".bed")
+
+
+def _write_atomic(path, write):
+    write(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def _write_json(path, data):
+    with open(path + ".tmp", 'w') as fh:
+        json.dump(data, fh)
+    os.replace(path + ".tmp", path)
+
+
+def sample_of(sample_id):
+    """Sample name of a feature file name (<sample>_hypo_fraction.bed -> <sample>)"""
+    for suffix in FRACTION_SUFFIXES:
+        if sample_id.endswith(suffix):
+            return sample_id[:-len(suffix)]
+    return sample_id
+
+
+class FeatureStore:
+    """Appendable samples x features float32 matrix with its sample (label, metadata) and feature tables"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as fh:
+            self.meta = json.load(fh)
+        self.features = pd.read_csv(os.path.join(path, "windows.tsv"), sep="\t", dtype={'chr': str})
+        samples = pd.read_csv(os.path.join(path, "samples.tsv"), sep="\t", dtype={'sample_id': str}, na_values="NA")
+        self.samples = samples.iloc[:self.meta['n_samples']].reset_index(drop=True)
+
+    def __len__(self):
+        return self.meta['n_samples']
+
+    @staticmethod
+    def create(path, feature_names):
+        """Empty store for the given feature names (chr:start:end)"""
+        os.makedirs(path, exist_ok=True)
+        parts = pd.Series(feature_names).str.split(":", expand=True)
+        features = pd.DataFrame({'name': feature_names, 'chr': parts[0], 'start': parts[1].astype(np.int64),
+                                 'end': parts[2].astype(np.int64)})
+        _write_atomic(os.path.join(path, "windows.tsv"), lambda tmp: features.to_csv(tmp, sep="\t", index=False))
+        _write_atomic(os.path.join(path, "samples.tsv"), lambda tmp: pd.DataFrame(
+            columns=['sample_id', 'tumour']).to_csv(tmp, sep="\t", index=False))
+        open(os.path.join(path, "values.f32"), 'wb').close()
+        _write_json(os.path.join(path, "meta.json"), {'n_features': len(features), 'n_samples': 0, 'dtype': STORE_DTYPE.str})
+        return FeatureStore(path)
+
+    def values(self):
+        """Memory-mapped samples x features matrix (read-only)"""
+        if not len(self):
+            return np.zeros((0, self.meta['n_features']), dtype=STORE_DTYPE)
+        return np.memmap(os.path.join(self.path, "values.f32"), dtype=STORE_DTYPE, mode='r',
+                         shape=(len(self), self.meta['n_features']))
+
+    def append(self, samples, values):
+        """Add samples (DataFrame with sample_id, tumour and any metadata) with their feature rows.
+
+        Rows of samples already in the store are overwritten in place, new samples are appended to values.f32.
+        """
+        values = np.asarray(values, dtype=STORE_DTYPE)
+        if values.shape[1:] != (self.meta['n_features'],):
+            raise ValueError(f"{self.path} holds {self.meta['n_features']} features, got {values.shape[1:]}")
+        samples = samples.reset_index(drop=True)
+        rows = pd.Index(self.samples['sample_id']).get_indexer(samples['sample_id'])
+        new = rows < 0
+        width = self.meta['n_features'] * STORE_DTYPE.itemsize
+        with open(os.path.join(self.path, "values.f32"), 'r+b') as fh:
+            for row, line in zip(rows[~new], values[~new]):
+                fh.seek(int(row) * width)
+                fh.write(line.tobytes())
+            fh.seek(len(self) * width)
+            fh.truncate()  # leftover of an interrupted append
+            fh.write(values[new].tobytes())
+        table = pd.concat([self.samples, samples[new]], ignore_index=True)
+        for column in samples.columns:
+            table.loc[rows[~new], column] = samples.loc[~new, column].values
+        table = table[['sample_id', 'tumour'] + [c for c in table.columns if c not in ('sample_id', 'tumour')]]
+        _write_atomic(os.path.join(self.path, "samples.tsv"), lambda tmp: table.to_csv(tmp, sep="\t", index=False, na_rep="NA"))
+        self.meta['n_samples'] = len(table)
+        _write_json(os.path.join(self.path, "meta.json"), self.meta)
+        self.samples = table
+        return int(new.sum())
+
+    def feature_mask(self, autosomal=True):
+        return ~self.features['chr'].isin(NON_AUTOSOMAL).values if autosomal else np.ones(len(self.features), dtype=bool)
+
+    def frame(self, autosomal=True, sample_ids=None):
+        """FeatureMatrix.csv as a DataFrame (sample_id + one float32 column per feature), read from the memory map
+        with only the autosomal columns (and only the given samples)"""
+        keep = np.flatnonzero(self.feature_mask(autosomal))
+        rows = np.arange(len(self)) if sample_ids is None else pd.Index(self.samples['sample_id']).get_indexer(list(sample_ids))
+        if (rows < 0).any():
+            raise ValueError(f"{self.path} has no rows for {list(np.asarray(sample_ids)[rows < 0][:5])}")
+        values = self.values()[np.ix_(rows, keep)]  # gathers only the projected cells
+        frame = pd.DataFrame(values, columns=self.features['name'].values[keep])
+        frame.insert(0, 'sample_id', self.samples['sample_id'].values[rows])
+        return frame
+
+
+def read_features(path, autosomal=True):
+    """FeatureMatrix.csv or a feature store dir as a DataFrame (sample_id + one column per feature)"""
+    if os.path.isdir(path):
+        return FeatureStore(path).frame(autosomal)
+    return pd.read_csv(path, na_values=['NA'])
+
+
+def read_targets(path):
+    """Target.csv, or the sample_id / tumour columns of a feature store dir"""
+    if os.path.isdir(path):
+        return FeatureStore(path).samples[['sample_id', 'tumour']]
+    return pd.read_csv(path)
+
+
+def sample_table(sample_ids, metadata=None, positive=("tumour",), negative=("healthy", "cirrhosis")):
+    """sample_id, tumour and metadata columns for feature file names: labels from the metadata table (sample_id
+    column holding file or sample names, optional tumour column), else from the name rule, else NA"""
+    table = pd.DataFrame({'sample_id': list(sample_ids)})
+
+    def label(name):
+        try:
+            return label_from_name(name, positive, negative)
+        except ValueError:
+            return np.nan
+    table['tumour'] = pd.array([label(name) for name in table['sample_id']], dtype="Int64")
+    if metadata is not None:
+        metadata = metadata.drop_duplicates('sample_id').set_index('sample_id')
+        names = pd.Series(table['sample_id'].values)
+        names = names.where(names.isin(metadata.index), names.map(sample_of))
+        joined = metadata.reindex(names.values).reset_index(drop=True)
+        if 'tumour' in joined:
+            table['tumour'] = joined.pop('tumour').astype("Int64").fillna(table['tumour'])
+        table = pd.concat([table, joined], axis=1)
+    return table
+
+
+def add_samples(store_path, feature_names, sample_ids, values, metadata=None, positive=("tumour",), negative=("healthy", "cirrhosis")):
+    """Add samples x features values to a store (created when missing); returns the number of new samples"""
+    store = FeatureStore(store_path) if os.path.exists(os.path.join(store_path, "meta.json")) else FeatureStore.create(store_path, feature_names)
+    if store.features['name'].tolist() != list(feature_names):
+        raise ValueError(f"{store_path} holds other features than the samples to add")
+    return store.append(sample_table(sample_ids, metadata, positive, negative), values)
+
+
+def add_feature_files(store_path, paths, metadata=None, positive=("tumour",), negative=("healthy", "cirrhosis")):
+    """Add <sample>_hypo_fraction.bed files (value in the 4th column) to a store"""
+    first = pd.read_csv(paths[0], sep="\t", header=None, usecols=[0, 1, 2], dtype={0: str})
+    names = (first[0] + ":" + first[1].astype(str) + ":" + first[2].astype(str)).tolist()
+    values = np.vstack([pd.read_csv(path, sep="\t", header=None, usecols=[3], na_values="NA")[3].values for path in paths])
+    return add_samples(store_path, names, [os.path.basename(path) for path in paths], values, metadata, positive, negative)
+
+
+# === BUILD FROM THE COMMAND LINE ===
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add per-sample feature files to an appendable feature store (replaces the FeatureMatrix.csv / Target.csv assembly)")
+    parser.add_argument('--store', required=True, help='Feature store dir (created when missing)')
+    parser.add_argument('--add', nargs='+', required=True, help='<sample>_hypo_fraction.bed files (chr start end value); samples already in the store are overwritten')
+    parser.add_argument('--metadata', default=None, help='TSV with a sample_id column (file or sample names), an optional tumour label column and any metadata')
+    parser.add_argument('--positive', nargs='+', default=["tumour"], help='Name substrings of label 1 samples (without a metadata label)')
+    parser.add_argument('--negative', nargs='+', default=["healthy", "cirrhosis"], help='Name substrings of label 0 samples')
+    parser.add_argument('--chunk', type=int, default=100, help='Samples read per append')
+    args = parser.parse_args()
+
+    metadata = pd.read_csv(args.metadata, sep="\t", dtype={'sample_id': str}) if args.metadata else None
+    added = 0
+    for first in range(0, len(args.add), args.chunk):
+        added += add_feature_files(args.store, args.add[first:first + args.chunk], metadata, args.positive, args.negative)
+    store = FeatureStore(args.store)
+    print(f"{added} sample(s) added, {len(args.add) - added} updated: {len(store)} samples x {store.meta['n_features']} features in {args.store}", flush=True)
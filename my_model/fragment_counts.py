@@ -0,0 +1,67 @@
+import numpy as np
+from per_read import MIN_MAPQ, hypo_total_masks
+
+# === FRAGMENT SIZE CLASSES (as binFrags in delfi_model_replication/02-create_bins.r) ===
+MAX_FRAGMENT = 999  # 01-bed_to_granges.r keeps fragments < 1000 bp
+SIZE_CLASSES = [('ultrashort', 1, 99), ('short', 100, 150), ('long', 151, 250), ('multinucleosomal', 251, MAX_FRAGMENT)]
+SIZE_BIN = 10       # fragment-size histogram bin width (bp), as the width histograms of 01-bed_to_granges.r
+N_SIZE_BINS = (MAX_FRAGMENT + 1) // SIZE_BIN
+FRAGMENT_COLUMNS = ['insert_size', 'flag']
+
+# Rows counted per window: fragments per size class, the hypomethylated and the methylation-total reads
+# (per_read.hypo_total_masks) among them per size class, then the size histogram.
+N_CLASSES = len(SIZE_CLASSES)
+N_FRAGMENT_ROWS = 3 * N_CLASSES + N_SIZE_BINS
+
+
+def fragment_row_names():
+    """Names of the per-window fragment count rows"""
+    classes = [name for name, _, _ in SIZE_CLASSES]
+    return (classes + [f"{c}_hypo" for c in classes] + [f"{c}_total" for c in classes]
+            + [f"size_{b * SIZE_BIN}_{(b + 1) * SIZE_BIN - 1}" for b in range(N_SIZE_BINS)])
+
+
+def fragment_sizes(mapq, insert_size, flag):
+    """(counted, size) per read; one read per fragment is counted: the first mate of a pair or an unpaired read,
+    with mapq > MIN_MAPQ and an |insert_size| of 1..MAX_FRAGMENT"""
+    size = np.abs(np.nan_to_num(np.asarray(insert_size, dtype=np.float64), nan=0)).astype(np.int64)
+    flag = np.nan_to_num(np.asarray(flag, dtype=np.float64), nan=0).astype(np.int64)
+    counted = (np.asarray(mapq) > MIN_MAPQ) & (size >= 1) & (size <= MAX_FRAGMENT) & ((flag & 128) == 0)
+    return counted, size
+
+
+def accumulate_fragments(start, cross, mapq, insert_size, flag, num_cpg, num_mod, first, second):
+    """Add reads to (N_FRAGMENT_ROWS, window) start / boundary-crossing counts (see Windows.coarsen)"""
+    counted, size = fragment_sizes(mapq, insert_size, flag)
+    size_class = np.searchsorted([hi for _, _, hi in SIZE_CLASSES], size)
+    size_bin = np.minimum(size // SIZE_BIN, N_SIZE_BINS - 1)
+    hypo, total = hypo_total_masks(mapq, num_cpg, num_mod)
+    n_windows = start.shape[1]
+    for rows, mask in ((size_class, counted), (N_CLASSES + size_class, counted & hypo),
+                       (2 * N_CLASSES + size_class, counted & total), (3 * N_CLASSES + size_bin, counted)):
+        for hist, index in ((start, first), (cross, second)):
+            sel = mask & (index >= 0)
+            hist += np.bincount(rows[sel] * n_windows + first[sel], minlength=hist.size).reshape(hist.shape)
+
+
+# === DERIVED FEATURES ===
+def fragment_feature_names():
+    """Names of the per-window values fragment_features() returns"""
+    classes = [name for name, _, _ in SIZE_CLASSES]
+    return [f"{c}_share" for c in classes] + ['short_long_ratio'] + [f"{c}_hypo_fraction" for c in classes]
+
+
+def fragment_features(counts):
+    """Per-window fragmentomic features from (..., windows, N_FRAGMENT_ROWS) counts, float32 (..., windows, 9):
+    share of the fragments per size class, the DELFI short / long ratio and the hypomethylated fraction per
+    size class; NaN where the denominator is 0."""
+    counts = np.asarray(counts, dtype=np.float64)
+    classes = counts[..., :N_CLASSES]
+    hypo = counts[..., N_CLASSES:2 * N_CLASSES]
+    total = counts[..., 2 * N_CLASSES:3 * N_CLASSES]
+    fragments = classes.sum(axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = np.where(fragments > 0, classes / fragments, np.nan)
+        ratio = np.where(classes[..., 2:3] > 0, classes[..., 1:2] / classes[..., 2:3], np.nan)
+        hypo_fraction = np.where(total > 0, hypo / total, np.nan)
+    return np.concatenate([shares, ratio, hypo_fraction], axis=-1).astype(np.float32)
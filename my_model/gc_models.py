@@ -0,0 +1,221 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+GC_COUNT_COLUMNS = ["chr", "start", "end", "gc", "hypo", "total"]
+
+
+def load_gc_counts(paths):
+    """<sample>_gc_counts.tsv files as (windows DataFrame, gc per window, hypo and total as samples x windows)"""
+    tables = [pd.read_csv(path, sep="\t", header=None, names=GC_COUNT_COLUMNS, na_values="NA") for path in paths]
+    windows = tables[0][["chr", "start", "end", "gc"]]
+    for path, table in zip(paths, tables):
+        if not table[["chr", "start", "end"]].equals(windows[["chr", "start", "end"]]):
+            raise ValueError(f"{path} lists other windows than {paths[0]}")
+    hypo = np.vstack([table["hypo"].values for table in tables]).astype(np.float64)
+    total = np.vstack([table["total"].values for table in tables]).astype(np.float64)
+    return windows[["chr", "start", "end"]], windows["gc"].values.astype(np.float64), hypo, total
+
+
+def ols_fit(gc, y, valid):
+    """(slope, R², residuals) of y ~ 1 + gc, fitted per row of y over its valid windows (closed form, all rows at once).
+
+    The same fit sm.OLS(y[valid], add_constant(gc[valid])) makes per sample; residuals are NaN outside valid.
+    """
+    weights = valid.astype(np.float64)
+    x = np.where(valid, gc, 0.0)
+    y = np.where(valid, y, 0.0)
+    n = weights.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_mean = x.sum(axis=1, keepdims=True) / n
+        y_mean = y.sum(axis=1, keepdims=True) / n
+        dx = (x - x_mean) * weights
+        dy = (y - y_mean) * weights
+        sxx = (dx ** 2).sum(axis=1, keepdims=True)
+        slope = np.where(sxx > 0, (dx * dy).sum(axis=1, keepdims=True) / sxx, 0.0)
+        residuals = dy - slope * dx
+        r2 = 1 - (residuals ** 2).sum(axis=1) / (dy ** 2).sum(axis=1)
+    return slope[:, 0], r2, np.where(valid, residuals, np.nan)
+
+
+def ols_residuals(gc, y, valid):
+    """Residuals of y ~ 1 + gc per row of y (see ols_fit)"""
+    return ols_fit(gc, y, valid)[2]
+
+
+def ols_corrected_fractions(gc, hypo, total):
+    """GC_correction.py for all samples at once: residual hypo / (residual total + 1e-6) per window.
+
+    gc is per window, hypo and total are samples x windows; windows with a missing value are NaN.
+    """
+    valid = ~(np.isnan(gc)[None, :] | np.isnan(hypo) | np.isnan(total))
+    return ols_residuals(gc, hypo, valid) / (ols_residuals(gc, total, valid) + 1e-6)
+
+
+# === BINNED LOESS ===
+# A LOESS trend of counts on GC like DELFI's gcCorrectLoess (03-get_Zscores.r: fit on windows with 0 < count < q99,
+# predicted on a 0.001 GC grid), at O(windows) per sample: windows are binned on the GC grid, the local linear
+# tricube fits are made on the grid once for all samples (a grid x grid matrix product) and interpolated back.
+LOESS_STEP = 0.001
+LOESS_SPAN = 0.75  # as R's loess default
+
+
+def gc_grid(gc, step=LOESS_STEP):
+    """GC grid covering all windows, and each window's (lower grid point, interpolation weight)"""
+    lo = np.floor(np.nanmin(gc) / step) * step
+    grid = lo + step * np.arange(int(np.ceil((np.nanmax(gc) - lo) / step)) + 2)
+    position = np.nan_to_num((gc - lo) / step)
+    lower = np.clip(np.floor(position).astype(np.int64), 0, len(grid) - 2)
+    return grid, lower, np.clip(position - lower, 0, 1)
+
+
+def loess_grid(gc, y, fit, span=LOESS_SPAN, step=LOESS_STEP):
+    """(grid, trend of every row of y on the grid): local linear fits with tricube weights over the windows in fit"""
+    grid, lower, weight = gc_grid(gc, step)
+    nearest = lower + (weight >= 0.5)
+    n_rows, n_grid = len(y), len(grid)
+    index = (np.arange(n_rows)[:, None] * n_grid + nearest[None, :])[fit]
+    s0 = np.bincount(index, minlength=n_rows * n_grid).reshape(n_rows, n_grid).astype(np.float64)
+    t0 = np.bincount(index, weights=y[fit], minlength=n_rows * n_grid).reshape(n_rows, n_grid)
+    # bandwidth per grid point: distance to the span-th share of the (pooled) fitted windows, as loess does
+    distance = np.abs(grid[:, None] - grid[None, :])
+    order = np.argsort(distance, axis=1, kind='stable')
+    pooled = np.cumsum(s0.sum(axis=0)[order], axis=1)
+    reach = np.argmax(pooled >= span * pooled[:, -1:], axis=1)
+    h = np.maximum(distance[np.arange(n_grid), order[np.arange(n_grid), reach]], step) * (1 + 1e-9)
+    kernel = (1 - np.clip(distance / h[:, None], 0, 1) ** 3) ** 3
+    dx = grid[None, :] - grid[:, None]
+    a0, a1, a2 = s0 @ kernel.T, s0 @ (kernel * dx).T, s0 @ (kernel * dx ** 2).T
+    c0, c1 = t0 @ kernel.T, t0 @ (kernel * dx).T
+    det = a0 * a2 - a1 ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        trend = np.where(det > 1e-12 * np.maximum(a0 * a2, 1e-300), (a2 * c0 - a1 * c1) / det, c0 / a0)
+    return grid, trend
+
+
+def loess_fit_mask(y, valid):
+    """Windows the trend is fitted on: valid and 0 < y < 99th percentile of the row (gcCorrectLoess)"""
+    with np.errstate(invalid='ignore'):
+        upper = np.nanquantile(np.where(valid, y, np.nan), 0.99, axis=1, keepdims=True)
+        return valid & (y > 0) & (y < upper)
+
+
+def loess_trend(gc, y, valid, span=LOESS_SPAN, step=LOESS_STEP):
+    """LOESS trend of y on gc per row of y, at every window"""
+    grid, trend = loess_grid(gc, y, loess_fit_mask(y, valid), span, step)
+    _, lower, weight = gc_grid(gc, step)
+    return trend[:, lower] * (1 - weight) + trend[:, lower + 1] * weight
+
+
+# === REFERENCE PANEL ===
+# The GC trend relative to a sample's mean count, fitted once on healthy samples (median over the panel). A new
+# sample is corrected with its own mean count times the panel trend at each window's GC: a table lookup, no fit.
+PANEL_COLUMNS = ["gc", "hypo", "total"]
+
+
+def fit_panel(gc, hypo, total, span=LOESS_SPAN, step=LOESS_STEP):
+    """Panel table (gc grid, relative hypo and total trend) from samples x windows counts"""
+    valid = ~(np.isnan(gc)[None, :] | np.isnan(hypo) | np.isnan(total))
+    panel = {}
+    for name, y in (("hypo", hypo), ("total", total)):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            relative = y / np.nanmean(np.where(valid, y, np.nan), axis=1, keepdims=True)
+        grid, trend = loess_grid(gc, relative, loess_fit_mask(relative, valid & np.isfinite(relative)), span, step)
+        panel[name] = np.nanmedian(trend, axis=0)
+    return pd.DataFrame({"gc": grid, **panel})[PANEL_COLUMNS]
+
+
+def save_panel(path, panel):
+    panel.to_csv(path + ".tmp", sep="\t", index=False, float_format="%.8g", na_rep="NA")
+    os.replace(path + ".tmp", path)
+
+
+def load_panel(path):
+    panel = pd.read_csv(path, sep="\t", na_values="NA")
+    if list(panel.columns) != PANEL_COLUMNS:
+        raise ValueError(f"{path} is not a GC panel table ({', '.join(PANEL_COLUMNS)})")
+    return panel.dropna()
+
+
+def panel_trend(panel, column, gc, y, valid):
+    """Trend of y per row from a panel table: the row's mean count times the panel trend at each window's GC"""
+    scale = np.nanmean(np.where(valid, y, np.nan), axis=1, keepdims=True)
+    return scale * np.interp(gc, panel["gc"].values, panel[column].values)[None, :]
+
+
+# === MODELS ===
+GC_MODELS = ["ols", "loess", "panel"]
+
+
+def corrected_fractions(gc, hypo, total, model="ols", span=LOESS_SPAN, panel=None):
+    """Residual hypo / (residual total + 1e-6) per window with the GC trend of the given model (see GC_MODELS)"""
+    if model == "ols":
+        return ols_corrected_fractions(gc, hypo, total)
+    valid = ~(np.isnan(gc)[None, :] | np.isnan(hypo) | np.isnan(total))
+    if model == "loess":
+        trends = loess_trend(gc, hypo, valid, span), loess_trend(gc, total, valid, span)
+    elif model == "panel":
+        if panel is None:
+            raise ValueError("The panel model needs a panel table (fit_panel)")
+        trends = panel_trend(panel, "hypo", gc, hypo, valid), panel_trend(panel, "total", gc, total, valid)
+    else:
+        raise ValueError(f"Unknown GC model {model}, one of {GC_MODELS}")
+    resid_hypo = np.where(valid, hypo - trends[0], np.nan)
+    resid_total = np.where(valid, total - trends[1], np.nan)
+    return resid_hypo / (resid_total + 1e-6)
+
+
+# === DIAGNOSTICS ===
+# Instead of a plot per sample, correction keeps a few numbers per sample: the fraction against GC in GC bins
+# (equal numbers of windows) before and after correction, and slope / R² of the fits. GC_report.py plots them.
+DIAGNOSTICS_SUFFIX = "_gc_diagnostics.json"
+
+
+def gc_diagnostics(gc, hypo, total, corrected, n_bins=20):
+    """Compact per-sample GC diagnostics (list of dicts) for samples x windows counts and corrected fractions"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        original = np.where(total > 0, hypo / total, np.nan)
+    valid_gc = ~np.isnan(gc)
+    edges = np.unique(np.quantile(gc[valid_gc], np.linspace(0, 1, n_bins + 1)))
+    bins = np.clip(np.searchsorted(edges, gc, side='right') - 1, 0, len(edges) - 2)
+
+    def binned_mean(values):
+        valid = np.isfinite(values) & valid_gc[None, :]
+        index = (np.arange(len(values))[:, None] * (len(edges) - 1) + bins[None, :])[valid]
+        shape = (len(values), len(edges) - 1)
+        n = np.bincount(index, minlength=np.prod(shape)).reshape(shape)
+        sums = np.bincount(index, weights=values[valid], minlength=np.prod(shape)).reshape(shape)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(n > 0, sums / n, np.nan), n
+
+    original_curve, n_windows = binned_mean(original)
+    corrected_curve, _ = binned_mean(corrected)
+    valid = ~(np.isnan(gc)[None, :] | np.isnan(hypo) | np.isnan(total))
+    fits = {'hypo': ols_fit(gc, hypo, valid), 'total': ols_fit(gc, total, valid),
+            'original': ols_fit(gc, original, valid & np.isfinite(original)),
+            'corrected': ols_fit(gc, corrected, valid & np.isfinite(corrected))}
+    rounded = lambda values: [None if not np.isfinite(v) else round(float(v), 6) for v in values]
+    diagnostics = []
+    for i in range(len(hypo)):
+        entry = {'gc_bins': rounded((edges[:-1] + edges[1:]) / 2), 'windows': n_windows[i].tolist(),
+                 'original': rounded(original_curve[i]), 'corrected': rounded(corrected_curve[i])}
+        for name, (slope, r2, _) in fits.items():
+            entry[f"{name}_slope"], entry[f"{name}_r2"] = rounded([slope[i], r2[i]])
+        diagnostics.append(entry)
+    return diagnostics
+
+
+def save_diagnostics(path, sample, diagnostics):
+    with open(path + ".tmp", 'w') as fh:
+        json.dump(dict(diagnostics, sample=sample), fh)
+    os.replace(path + ".tmp", path)
+
+
+def load_diagnostics(paths):
+    """Diagnostics files as a list of dicts"""
+    entries = []
+    for path in paths:
+        with open(path) as fh:
+            entries.append(json.load(fh))
+    return entries
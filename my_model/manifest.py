@@ -0,0 +1,63 @@
+import os
+import json
+import hashlib
+from datetime import datetime, timezone
+
+# === MANIFEST ===
+# <output_dir>/manifest.jsonl holds one JSON line per finished sample, appended (and synced) as soon as
+# the sample is written. The last line of a sample wins, so a rerun only adds lines for what it rebuilt.
+MANIFEST_NAME = "manifest.jsonl"
+HASH_CHUNK = 16 * 1024 * 1024
+
+
+def spec_hash(spec):
+    """Short sha1 of a JSON-serialisable spec (key order does not matter)"""
+    return hashlib.sha1(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def file_sha256(path):
+    """sha256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(HASH_CHUNK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(path):
+    """Latest entry per sample; a line cut off by a crash is ignored"""
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path) as fh:
+        for line in fh:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            entries[entry['sample']] = entry
+    return entries
+
+
+def append_entry(path, entry):
+    """Append one finished sample to the manifest and make sure it is on disk"""
+    entry = dict(entry, finished=datetime.now(timezone.utc).isoformat(timespec='seconds'))
+    with open(path, 'a') as fh:
+        fh.write(json.dumps(entry, sort_keys=True) + "\n")
+        fh.flush()
+        os.fsync(fh.fileno())
+
+
+def is_current(entry, spec, seed, output_path=None):
+    """True when an entry was built from the same spec and seed and its output is still there unchanged: same size,
+    and the recorded sha256 when the file was modified after the entry was written"""
+    if entry is None or entry.get('spec_hash') != spec or entry.get('seed') != seed:
+        return False
+    if output_path is None:
+        return True
+    if not os.path.exists(output_path) or os.path.getsize(output_path) != entry.get('size'):
+        return False
+    finished = datetime.fromisoformat(entry['finished']).timestamp() if 'finished' in entry else 0
+    if os.path.getmtime(output_path) < finished + 1:  # finished is in whole seconds
+        return True
+    return file_sha256(output_path) == entry.get('sha256')
@@ -0,0 +1,130 @@
+import os
+import tomllib
+from glob import glob
+import numpy as np
+
+# Metadata columns every design reports; components name the column their fraction goes into
+FRACTION_COLUMNS = ['healthy', 'cirrhosis', 'tumour']
+DESIGN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "designs")
+
+
+# === LOADING ===
+def load_design(path):
+    """Read and check a TOML mixture design (see designs/standard.toml for the layout)"""
+    with open(path, 'rb') as fh:
+        design = tomllib.load(fh)
+    design.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+
+    for key in ('reads_per_sample', 'pools', 'cohorts'):
+        if key not in design:
+            raise ValueError(f"Design {path} has no '{key}'")
+    for cohort in design['cohorts']:
+        for key in ('prefix', 'type', 'n', 'background'):
+            if key not in cohort:
+                raise ValueError(f"Cohort in design {path} has no '{key}'")
+        for comp in [{'pool': cohort['background']}] + cohort.get('components', []):
+            if comp['pool'] not in design['pools']:
+                raise ValueError(f"Cohort {cohort['prefix']} uses undefined pool '{comp['pool']}'")
+            if comp.get('column') not in (None, 'cirrhosis', 'tumour'):
+                raise ValueError(f"Unknown metadata column '{comp['column']}' in cohort {cohort['prefix']}")
+    return design
+
+
+def select_files(pool_spec, input_dirs):
+    """Per-read BED files of a pool: *.bed.gz in its input dir, filtered on file name substrings"""
+    files = glob(os.path.join(input_dirs[pool_spec['dir']], "*.bed.gz"))
+    include = pool_spec.get('include', [])
+    exclude = pool_spec.get('exclude', [])
+    files = [f for f in files
+             if all(s in os.path.basename(f) for s in include) and not any(s in os.path.basename(f) for s in exclude)]
+    return sorted(files)
+
+
+def cohort_spec(design, cohort, pool_files):
+    """Everything a cohort's samples depend on apart from the seed (its size n excluded, so a cohort can grow)"""
+    used = {cohort['background']} | {comp['pool'] for comp in cohort.get('components', [])}
+    return {
+        'reads_per_sample': design['reads_per_sample'],
+        'cohort': {k: v for k, v in cohort.items() if k != 'n'},
+        'pools': {name: {'spec': design['pools'][name], 'files': [os.path.basename(f) for f in pool_files[name]]}
+                  for name in sorted(used)},
+    }
+
+
+def per_file_pools(design):
+    """Names of the pools that components split per file (because a purity correction is given)"""
+    return {comp['pool'] for cohort in design['cohorts'] for comp in cohort.get('components', []) if 'purity' in comp}
+
+
+# === DRAWING ===
+def draw_fraction(spec, rng):
+    """Draw a mixture fraction: uniform(low, high), low + beta(a, b) * (high - low), or a fixed value"""
+    dist = spec['dist']
+    if dist == 'uniform':
+        return rng.uniform(spec['low'], spec['high'])
+    if dist == 'beta':
+        low, high = spec.get('low', 0.0), spec.get('high', 1.0)
+        return low + rng.beta(spec['a'], spec['b']) * (high - low)
+    if dist == 'fixed':
+        return spec['value']
+    raise ValueError(f"Unknown fraction distribution '{dist}'")
+
+
+def purity_allocation(comp, files, sizes, n_needed, rng):
+    """Split n_needed tumour reads over the tumour files, weighting by random weights / purity.
+
+    Returns the number of reads per file (capped at the file size).
+    """
+    purities = [comp['purity'][os.path.basename(f)] for f in files]
+    weights = rng.dirichlet(np.ones(len(files)))
+    adjusted_weights = [w / purity for purity, w in zip(purities, weights)]
+    total_adjusted = sum(adjusted_weights)
+    return [min(int((w / total_adjusted) * n_needed), size) for w, size in zip(adjusted_weights, sizes)]
+
+
+def plan_sample(design, cohort, pool_numbers, pools, rng):
+    """Draw one sample of a cohort from its own rng.
+
+    pool_numbers maps a pool name to its pool number (or, for per-file pools, to {file: number}).
+    Components are drawn in order; each takes a fraction of all reads, or of the reads still left
+    to the background with of_remainder, and can be included with a probability only.
+    Returns (parts, metadata fractions, components) where parts is [(pool number, sampled reads), ...]
+    and components records the requested and realised fraction of every component that was drawn.
+    """
+    reads_per_sample = design['reads_per_sample']
+    remaining = reads_per_sample
+    recorded = dict.fromkeys(FRACTION_COLUMNS[1:], 0.0)
+    recorded_total = 0.0
+    draws = []
+    components = []
+
+    for comp in cohort.get('components', []):
+        if 'probability' in comp and rng.random() >= comp['probability']:
+            continue
+        frac = requested = draw_fraction(comp['fraction'], rng)
+        n_needed = int((remaining if comp.get('of_remainder') else reads_per_sample) * frac)
+
+        if 'purity' in comp:
+            files = sorted(pool_numbers[comp['pool']])
+            numbers = [pool_numbers[comp['pool']][f] for f in files]
+            allocation = purity_allocation(comp, files, [len(pools[nr]) for nr in numbers], n_needed, rng)
+            draws += list(zip(numbers, allocation))
+            n_drawn = sum(allocation)
+            frac = n_drawn / reads_per_sample  # purity-corrected samples report the realised fraction
+        else:
+            draws.append((pool_numbers[comp['pool']], n_needed))
+            n_drawn = n_needed
+
+        remaining -= n_drawn
+        components.append({'pool': comp['pool'], 'column': comp.get('column'), 'requested': requested,
+                           'realised': n_drawn / reads_per_sample, 'n_reads': n_drawn})
+        recorded_total += frac
+        if comp.get('column'):
+            recorded[comp['column']] += frac
+
+    background = pool_numbers[cohort['background']]
+    parts = [(background, pools[background].sample(remaining, rng))]
+    parts += [(nr, pools[nr].sample(n, rng)) for nr, n in draws]
+    components.insert(0, {'pool': cohort['background'], 'column': 'healthy', 'requested': 1.0 - recorded_total,
+                          'realised': remaining / reads_per_sample, 'n_reads': remaining})
+    return parts, (cohort['type'], 1.0 - recorded_total) + tuple(recorded.values()), components
@@ -0,0 +1,150 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+import joblib
+from threadpoolctl import threadpool_limits
+from sklearn.base import clone
+from sklearn.model_selection import StratifiedKFold, ParameterGrid
+from sklearn.metrics import f1_score, roc_auc_score
+
+# === TASK GRAPH ===
+# The nested CV of Select_model.py for all selector x model x PCA combinations as one task graph:
+#   fit tasks    (combination, outer fold, grid point, inner fold) -> F1 on the inner validation fold, all independent
+#   refit tasks  (combination, outer fold) -> F1 / AUC on the outer test fold with the grid point of the best mean
+#                inner F1 (as GridSearchCV refits), ready as soon as the fit tasks of that outer fold are done
+#   warm tasks   with pipelines that have a memory (Pipeline(memory=joblib.Memory)): the imputer / scaler / selector /
+#                PCA steps fitted once per (distinct steps, outer fold, inner fold); the fit tasks of all grid points
+#                wait for it and load the fitted steps from the cache, so RFE, mutual information, LassoCV and
+#                permutation importance run once per fold instead of once per grid point and fold
+# They run on one fork-based process pool of core_budget // threads workers. Each task is pinned to `threads`
+# threads (n_jobs of the estimators, also inside RFE / XGBoost / RandomForest, and the BLAS / OpenMP pools through
+# threadpoolctl), so the pool fills the cores without the nested oversubscription of GridSearchCV(n_jobs=-1).
+OUTER_CV = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)  # to preserve class distribution
+INNER_CV = StratifiedKFold(n_splits=3, shuffle=True, random_state=42)
+_GRID = {}  # data, folds and combinations of the running grid; forked workers inherit it, tasks only carry indices
+
+
+def core_budget():
+    """Cores of the job: SLURM_CPUS_PER_TASK, else the CPUs this process may run on"""
+    if 'SLURM_CPUS_PER_TASK' in os.environ:
+        return int(os.environ['SLURM_CPUS_PER_TASK'])
+    return len(os.sched_getaffinity(0))
+
+
+def pinned(estimator, threads):
+    """The estimator with every n_jobs parameter (nested ones included) set to threads"""
+    return estimator.set_params(**{name: threads for name in estimator.get_params(deep=True) if name.endswith('n_jobs')})
+
+
+def _fitted(combination, params, rows):
+    pipe = pinned(clone(_GRID['combinations'][combination]['pipeline']).set_params(**params), _GRID['threads'])
+    return pipe.fit(_GRID['X'][rows], _GRID['y'][rows])
+
+
+def _warm_task(combination, fold, inner):
+    """Fit (and so cache) the transformer steps of a combination on one inner training fold"""
+    fit_rows = _GRID['inner'][fold][inner][0]
+    try:
+        _fitted(combination, {'model': 'passthrough'}, fit_rows)
+    except Exception:
+        pass  # the fit tasks report it
+
+
+def _fit_task(combination, fold, point, inner):
+    """F1 of one grid point on one inner fold (NaN when the fit fails, as GridSearchCV's error_score)"""
+    fit_rows, val_rows = _GRID['inner'][fold][inner]
+    try:
+        pipe = _fitted(combination, _GRID['combinations'][combination]['grid'][point], fit_rows)
+    except Exception as err:
+        print(f"Fit failed ({_GRID['combinations'][combination]['name']}, fold {fold}: {err}), score NaN", flush=True)
+        return np.nan
+    return f1_score(_GRID['y'][val_rows], pipe.predict(_GRID['X'][val_rows]), average='binary')
+
+
+def _refit_task(combination, fold, point):
+    """(F1, AUC) on one outer test fold after refitting the best grid point on the outer training fold"""
+    train_rows, test_rows = _GRID['outer'][fold]
+    pipe = _fitted(combination, _GRID['combinations'][combination]['grid'][point], train_rows)
+    X_test, y_test = _GRID['X'][test_rows], _GRID['y'][test_rows]
+    return f1_score(y_test, pipe.predict(X_test), average='binary'), roc_auc_score(y_test, pipe.predict_proba(X_test)[:, 1])
+
+
+def _run(task):
+    with threadpool_limits(limits=_GRID['threads']):
+        return {'warm': _warm_task, 'fit': _fit_task, 'refit': _refit_task}[task[0]](*task[1:])
+
+
+def transformer_key(pipeline):
+    """Hash of the transformer steps of a pipeline (with model 'passthrough'): equal for pipelines sharing them"""
+    return joblib.hash(clone(pipeline).set_params(model='passthrough'))
+
+
+def run_grid(combinations, X, y, n_cores=None, threads=1):
+    """Nested CV of every combination ({'name', 'pipeline', 'param_grid'}) on one process pool with n_cores cores.
+
+    Returns (mean F1, std F1, mean AUC, std AUC) per combination, in order, as run_nested_cv gives them.
+    """
+    n_workers = max(1, (n_cores or core_budget()) // threads)
+    outer = [(np.asarray(train), np.asarray(test)) for train, test in OUTER_CV.split(X, y)]
+    inner = [[(train[fit], train[val]) for fit, val in INNER_CV.split(X[train], y[train])] for train, _ in outer]
+    combinations = [dict(c, grid=list(ParameterGrid(c['param_grid']))) for c in combinations]
+    _GRID.update(X=X, y=y, outer=outer, inner=inner, combinations=combinations, threads=threads)
+
+    scores = {(c, fold): np.full((len(comb['grid']), len(inner[fold])), np.nan)
+              for c, comb in enumerate(combinations) for fold in range(len(outer))}  # grid points x inner folds F1
+    pending = {key: grid.size for key, grid in scores.items()}  # fit tasks not yet done per (combination, fold)
+    results = {}  # (combination, fold) -> (F1, AUC)
+    fits = [('fit', c, fold, point, i) for (c, fold), grid in scores.items()
+            for point in range(grid.shape[0]) for i in range(grid.shape[1])]
+    # fit tasks of cached pipelines wait for the warm task of their transformer steps and inner fold
+    waiting = {}
+    for task in fits:
+        if combinations[task[1]]['pipeline'].memory is not None:
+            key = (transformer_key(combinations[task[1]]['pipeline']), task[2], task[4])
+            waiting.setdefault(key, [('warm', task[1], task[2], task[4])]).append(task)
+    ready = [tasks[0] for tasks in waiting.values()] + [task for task in fits if combinations[task[1]]['pipeline'].memory is None]
+    warmed = {tasks[0]: tasks[1:] for tasks in waiting.values()}
+    print(f"{len(fits)} fits, {len(warmed)} cached transformer fits and {len(scores)} refits of {len(combinations)} "
+          f"combinations on {n_workers} worker(s) x {threads} thread(s)", flush=True)
+
+    def done(task, result):
+        """Record a finished task; returns the tasks it makes ready"""
+        if task[0] == 'warm':
+            return warmed.pop(task)
+        if task[0] == 'refit':
+            c, fold = task[1:3]
+            results[(c, fold)] = result
+            if all((c, f) in results for f in range(len(outer))):
+                print(f"Completed: {combinations[c]['name']}", flush=True)
+            return []
+        _, c, fold, point, i = task
+        scores[(c, fold)][point, i] = result
+        pending[(c, fold)] -= 1
+        if pending[(c, fold)]:
+            return []
+        mean = scores[(c, fold)].mean(axis=1)
+        best = int(np.nanargmax(mean)) if not np.isnan(mean).all() else 0  # first best grid point, as GridSearchCV
+        return [('refit', c, fold, best)]
+
+    try:
+        if n_workers == 1:
+            while ready:
+                task = ready.pop(0)
+                ready += done(task, _run(task))
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("fork")) as executor:
+                running = {executor.submit(_run, task): task for task in ready}
+                while running:
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        for follow in done(running.pop(future), future.result()):
+                            running[executor.submit(_run, follow)] = follow
+    finally:
+        _GRID.clear()
+
+    summary = []
+    for c in range(len(combinations)):
+        f1, auc = np.array([results[(c, fold)] for fold in range(len(outer))]).T
+        summary.append((np.mean(f1), np.std(f1), np.mean(auc), np.std(auc)))
+    return summary
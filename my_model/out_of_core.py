@@ -0,0 +1,160 @@
+import numpy as np
+from sklearn.decomposition import IncrementalPCA
+from sklearn.linear_model import SGDClassifier
+from sklearn.model_selection import StratifiedKFold
+from sklearn.metrics import f1_score, roc_auc_score
+
+# === CHUNKED TRAINING ===
+# Model selection straight off a memory-mapped FeatureStore (feature_store.py) for matrices that do not fit in
+# memory (e.g. 100 kb windows x thousands of samples): only chunk_rows samples are read at a time.
+#   imputation + scaling  mean / variance per feature streamed over the chunks (SimpleImputer(mean) + StandardScaler)
+#   filter                ANOVA F per feature from per-class sums of the same pass (SelectKBest(f_classif))
+#   PCA                   IncrementalPCA.partial_fit over the chunks
+#   model                 SGDClassifier.partial_fit over the chunks for a few epochs
+# After the filter or PCA the data is narrow (samples x k or components) and kept in memory for the SGD epochs.
+CHUNK_ROWS = 256
+
+
+def row_chunks(rows, chunk_rows, min_rows=1):
+    """Row numbers in chunks of about chunk_rows (at least min_rows each, as far as there are rows), each sorted so
+    the memory map is read front to back"""
+    n_chunks = min(int(np.ceil(len(rows) / chunk_rows)), len(rows) // min_rows)
+    return [np.sort(chunk) for chunk in np.array_split(rows, max(1, n_chunks))]
+
+
+class FeatureStats:
+    """Per-feature mean / variance of the non-missing values and per-class sums, merged chunk by chunk"""
+
+    def __init__(self, n_features, classes):
+        self.classes = classes
+        self.n = np.zeros(n_features)
+        self.mean = np.zeros(n_features)
+        self.m2 = np.zeros(n_features)
+        self.n_rows = 0
+        self.class_rows = np.zeros(len(classes))
+        self.class_sum = np.zeros((len(classes), n_features))
+        self.class_missing = np.zeros((len(classes), n_features))
+
+    def update(self, X, y):
+        present = ~np.isnan(X)
+        n_b = present.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_b = np.where(n_b > 0, np.nansum(X, axis=0) / n_b, 0.0)
+        m2_b = np.nansum((X - mean_b) ** 2, axis=0)
+        n = self.n + n_b
+        delta = mean_b - self.mean
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.mean = np.where(n > 0, self.mean + delta * n_b / n, 0.0)
+            self.m2 = self.m2 + m2_b + np.where(n > 0, delta ** 2 * self.n * n_b / n, 0.0)
+        self.n = n
+        self.n_rows += len(X)
+        for c, label in enumerate(self.classes):
+            rows = y == label
+            self.class_rows[c] += rows.sum()
+            self.class_sum[c] += np.nansum(X[rows], axis=0)
+            self.class_missing[c] += (~present[rows]).sum(axis=0)
+
+    def scale(self):
+        """Standard deviation after mean imputation (imputed values add no variance), 1 for constant features"""
+        std = np.sqrt(self.m2 / max(self.n_rows, 1))
+        return np.where(std > 0, std, 1.0)
+
+    def f_scores(self):
+        """ANOVA F of every feature after mean imputation, as f_classif gives on the imputed (and scaled) data"""
+        class_mean = (self.class_sum + self.class_missing * self.mean) / self.class_rows[:, None]
+        between = (self.class_rows[:, None] * (class_mean - self.mean) ** 2).sum(axis=0)
+        within = self.m2 - between
+        df_between, df_within = len(self.classes) - 1, self.n_rows - len(self.classes)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f = (between / df_between) / (within / df_within)
+        return np.where(np.isfinite(f), f, 0.0)
+
+
+class ChunkedPipeline:
+    """Imputer + scaler (+ top-k ANOVA F filter) (+ IncrementalPCA) + SGD linear model, fitted on rows of a store"""
+
+    def __init__(self, k=30, n_components=None, loss='log_loss', alpha=1e-4, epochs=5, chunk_rows=CHUNK_ROWS, random_state=42):
+        self.k = k
+        self.n_components = n_components
+        self.loss = loss
+        self.alpha = alpha
+        self.epochs = epochs
+        self.chunk_rows = chunk_rows
+        self.random_state = random_state
+
+    def _read(self, store, rows):
+        return np.asarray(store.values()[np.ix_(rows, self.columns_)], dtype=np.float64)
+
+    def _transform(self, X):
+        X = np.where(np.isnan(X), self.mean_, X)
+        X = (X - self.mean_) / self.scale_
+        if self.selected_ is not None:
+            X = X[:, self.selected_]
+        if self.pca_ is not None:
+            X = self.pca_.transform(X)
+        return X
+
+    def fit(self, store, rows, y, columns=None):
+        """Fit on the given store rows (labels y in the same order); columns limits the features (default autosomal)"""
+        order = np.argsort(rows)
+        rows, y = np.asarray(rows)[order], np.asarray(y)[order]
+        chunks = row_chunks(rows, self.chunk_rows)
+        labels = lambda chunk: y[np.searchsorted(rows, chunk)]
+        self.columns_ = np.flatnonzero(store.feature_mask()) if columns is None else np.asarray(columns)
+        self.classes_ = np.unique(y)
+
+        stats = FeatureStats(len(self.columns_), self.classes_)
+        for chunk in chunks:
+            stats.update(self._read(store, chunk), labels(chunk))
+        observed = stats.n > 0  # features without any value are left out, as dropna(axis=1, how='all')
+        self.columns_, self.mean_, self.scale_ = self.columns_[observed], stats.mean[observed], stats.scale()[observed]
+        self.f_scores_ = stats.f_scores()[observed]
+        self.selected_ = np.sort(np.argsort(-self.f_scores_, kind='stable')[:self.k]) if self.k else None
+        self.pca_ = None
+        if self.n_components:
+            pca = IncrementalPCA(n_components=self.n_components)
+            for chunk in row_chunks(rows, self.chunk_rows, min_rows=self.n_components):  # every batch >= n_components
+                pca.partial_fit(self._transform(self._read(store, chunk)))
+            self.pca_ = pca
+
+        rng = np.random.default_rng(self.random_state)
+        if self.selected_ is not None or self.pca_ is not None:
+            narrow = [(np.vstack([self._transform(self._read(store, chunk)) for chunk in chunks]), y)]
+            batches = lambda: narrow
+        else:
+            batches = lambda: ((self._transform(self._read(store, chunks[i])), labels(chunks[i])) for i in rng.permutation(len(chunks)))
+        self.model_ = SGDClassifier(loss=self.loss, alpha=self.alpha, random_state=self.random_state)
+        for _ in range(self.epochs):
+            for X, batch_y in batches():
+                shuffle = rng.permutation(len(X))
+                self.model_.partial_fit(X[shuffle], batch_y[shuffle], classes=self.classes_)
+        return self
+
+    def decision_function(self, store, rows):
+        """Decision values for the given store rows, in their order"""
+        chunks = np.array_split(np.asarray(rows), max(1, int(np.ceil(len(rows) / self.chunk_rows))))
+        return np.concatenate([self.model_.decision_function(self._transform(self._read(store, chunk))) for chunk in chunks])
+
+    def predict(self, store, rows):
+        return self.classes_[(self.decision_function(store, rows) > 0).astype(int)]
+
+
+def run_nested_cv_chunked(store, y, k, n_components, loss, alphas, epochs=5, chunk_rows=CHUNK_ROWS):
+    """run_nested_cv for a ChunkedPipeline on all store rows: the SGD alpha chosen by inner 3-fold F1,
+    (mean F1, std F1, mean AUC, std AUC) over the outer 5 folds"""
+    outer_cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
+    inner_cv = StratifiedKFold(n_splits=3, shuffle=True, random_state=42)
+    rows = np.arange(len(store))
+    make = lambda alpha: ChunkedPipeline(k, n_components, loss, alpha, epochs, chunk_rows)
+
+    scores_f1, scores_auc = [], []
+    for train_idx, test_idx in outer_cv.split(rows, y):
+        inner_f1 = []
+        for alpha in alphas:
+            folds = [f1_score(y[train_idx][val], make(alpha).fit(store, train_idx[fit], y[train_idx][fit]).predict(store, train_idx[val]), average='binary')
+                     for fit, val in inner_cv.split(train_idx, y[train_idx])]
+            inner_f1.append(np.mean(folds))
+        best = make(alphas[int(np.argmax(inner_f1))]).fit(store, train_idx, y[train_idx])
+        scores_f1.append(f1_score(y[test_idx], best.predict(store, test_idx), average='binary'))
+        scores_auc.append(roc_auc_score(y[test_idx], best.decision_function(store, test_idx)))
+    return np.mean(scores_f1), np.std(scores_f1), np.mean(scores_auc), np.std(scores_auc)
@@ -0,0 +1,192 @@
+import os
+import gzip
+import argparse
+import numpy as np
+import pandas as pd
+
+# === KNOWN PER-READ CALL LAYOUTS ===
+# training (tissue / healthy cfDNA) calls carry a read_length column, the validation calls do not
+SCHEMAS = {
+    'with_read_length': ['chr', 'start', 'end', 'read_id', 'mapq', 'orientation', 'insert_size', 'read_length',
+                         'flag', 'num_cpg', 'num_mod', 'mod_cpgs', 'unmod_cpgs', 'snp_cpgs'],
+    'no_read_length': ['chr', 'start', 'end', 'read_id', 'mapq', 'orientation', 'insert_size',
+                       'flag', 'num_cpg', 'num_mod', 'mod_cpgs', 'unmod_cpgs', 'snp_cpgs'],
+}
+
+CHUNK_READS = 5_000_000  # reads parsed at once
+
+# === READERS ===
+# Per-read calls come as text BED(.gz) or, converted once (see below), as Parquet or Arrow IPC files. The columnar
+# formats are read with column projection: only the columns a step needs are decoded (or, for Arrow, mapped).
+# pyarrow is only imported for them. A new format is a reader in READERS plus its suffixes in FORMATS.
+FORMATS = {'.parquet': 'parquet', '.pq': 'parquet', '.arrow': 'arrow', '.feather': 'arrow'}
+INPUT_SUFFIXES = (".gz", ".bed") + tuple(FORMATS)
+
+
+def input_format(path):
+    """'text', 'parquet' or 'arrow', by file suffix"""
+    return FORMATS.get(os.path.splitext(path)[1].lower(), 'text')
+
+
+def open_text(path):
+    """Open a (gzipped) per-read BED for reading text"""
+    return gzip.open(path, 'rt') if path.endswith(".gz") else open(path)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Reading Parquet/Arrow per-read calls needs pyarrow (conda install pyarrow)") from None
+    return pyarrow
+
+
+def _open_arrow(pa, path):
+    """Record batch reader of an Arrow IPC file (memory-mapped) or stream"""
+    source = pa.memory_map(path)
+    try:
+        return pa.ipc.open_file(source)
+    except pa.ArrowInvalid:
+        source.seek(0)
+        return pa.ipc.open_stream(source)
+
+
+def detect_columns(path):
+    """Return (column names, has_header) for a per-read calls file.
+
+    A '#' header line is used as is; header-less files are matched to a known layout by column count.
+    Parquet / Arrow files carry their column names in the schema (a leading '#' is dropped).
+    """
+    if input_format(path) == 'parquet':
+        return [name.lstrip("#") for name in _import_pyarrow().parquet.read_schema(path).names], True
+    if input_format(path) == 'arrow':
+        return [name.lstrip("#") for name in _open_arrow(_import_pyarrow(), path).schema.names], True
+    with open_text(path) as fh:
+        first = fh.readline().rstrip("\n")
+    if first.startswith("#"):
+        return first.lstrip("#").split("\t"), True
+    n_fields = len(first.split("\t"))
+    for columns in SCHEMAS.values():
+        if len(columns) == n_fields:
+            return columns, False
+    raise ValueError(f"Unknown per-read layout with {n_fields} columns in {path}")
+
+
+def _text_chunks(path, columns, chunksize, names):
+    names, has_header = (names, False) if names else detect_columns(path)
+    yield from pd.read_csv(path, sep="\t", header=None, names=names, usecols=columns,
+                           skiprows=1 if has_header else 0, chunksize=chunksize,
+                           dtype={'chr': str}, low_memory=False)
+
+
+def _batches_to_frames(batches, rename):
+    for batch in batches:
+        chunk = batch.to_pandas(ignore_metadata=True).rename(columns=rename)
+        if 'chr' in chunk and not pd.api.types.is_object_dtype(chunk['chr']):
+            chunk['chr'] = chunk['chr'].astype(str)  # dictionary-encoded chromosomes arrive as categoricals
+        yield chunk
+
+
+def _projection(schema_names, columns):
+    """Source names of the requested columns and the renaming back to per-read names"""
+    source = {name.lstrip("#"): name for name in schema_names}
+    if columns is None:
+        columns = list(source)
+    missing = [col for col in columns if col not in source]
+    if missing:
+        raise ValueError(f"Per-read file has no column(s) {missing}")
+    return [source[col] for col in columns], {source[col]: col for col in columns}
+
+
+def _parquet_chunks(path, columns, chunksize, names):
+    parquet_file = _import_pyarrow().parquet.ParquetFile(path)
+    selected, rename = _projection(parquet_file.schema_arrow.names, columns)
+    yield from _batches_to_frames(parquet_file.iter_batches(batch_size=chunksize, columns=selected), rename)
+
+
+def _arrow_chunks(path, columns, chunksize, names):
+    reader = _open_arrow(_import_pyarrow(), path)
+    selected, rename = _projection(reader.schema.names, columns)
+    if hasattr(reader, 'num_record_batches'):
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    else:
+        batches = iter(reader)
+    yield from _batches_to_frames((batch.select(selected) for batch in batches), rename)
+
+
+READERS = {'text': _text_chunks, 'parquet': _parquet_chunks, 'arrow': _arrow_chunks}
+
+
+def read_chunks(path, columns=None, chunksize=CHUNK_READS, names=None):
+    """Yield DataFrames of the requested columns of a per-read calls file, about chunksize reads at a time.
+
+    names gives the layout of a header-less text file whose layout is known (e.g. a filtered spool).
+    """
+    for chunk in READERS[input_format(path)](path, columns, chunksize, names):
+        for col in ('num_cpg', 'num_mod'):
+            if col in chunk and not pd.api.types.is_numeric_dtype(chunk[col]):
+                chunk[col] = pd.to_numeric(chunk[col], errors='coerce')
+        yield chunk
+
+
+def methylation_level(num_cpg, num_mod):
+    """num_mod / num_cpg, NaN where a read has no CpGs"""
+    num_cpg = np.asarray(num_cpg, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(num_cpg > 0, np.asarray(num_mod, dtype=np.float64) / num_cpg, np.nan)
+
+
+# === HYPOMETHYLATION RULES (as in the extraction scripts) ===
+MIN_MAPQ = 10          # reads need mapq > 10
+MIN_CPG_TOTAL = 2      # reads counted in the total need >= 2 CpGs
+MIN_CPG_HYPO = 3       # hypomethylated reads need >= 3 CpGs ...
+MAX_HYPO_LEVEL = 0.35  # ... and a methylation level <= 0.35
+
+
+def hypo_total_masks(mapq, num_cpg, num_mod):
+    """Boolean masks of the reads counted as hypomethylated and in the total"""
+    num_cpg = np.asarray(num_cpg, dtype=np.float64)
+    level = methylation_level(num_cpg, num_mod)
+    usable = (np.asarray(mapq) > MIN_MAPQ) & (num_cpg > 0)
+    total = usable & (num_cpg >= MIN_CPG_TOTAL)
+    hypo = usable & (num_cpg >= MIN_CPG_HYPO) & (level <= MAX_HYPO_LEVEL)
+    return hypo, total
+
+
+# === CONVERT FROM THE COMMAND LINE ===
+def convert(path, out_dir, fmt='parquet', chunksize=CHUNK_READS):
+    """Write a per-read BED(.gz) as a Parquet / Arrow IPC file with the same columns, streaming chunk by chunk"""
+    pa = _import_pyarrow()
+    base = os.path.basename(path)
+    for ext in (".gz", ".bed"):
+        if base.endswith(ext):
+            base = base[:-len(ext)]
+    out_path = os.path.join(out_dir, base + (".parquet" if fmt == 'parquet' else ".arrow"))
+    writer = None
+    for chunk in read_chunks(path, chunksize=chunksize):
+        chunk[['num_cpg', 'num_mod']] = chunk[['num_cpg', 'num_mod']].astype('Int32')  # '.' becomes null
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        table = table.set_column(table.schema.get_field_index('chr'), 'chr', table['chr'].dictionary_encode())
+        if writer is None:
+            schema = table.schema
+            writer = (pa.parquet.ParquetWriter(out_path + ".tmp", schema, compression='zstd') if fmt == 'parquet'
+                      else pa.ipc.new_file(out_path + ".tmp", schema))
+        writer.write_table(table.cast(schema))
+    writer.close()
+    os.replace(out_path + ".tmp", out_path)
+    return out_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert per-read BED files into Parquet / Arrow files read with column projection")
+    parser.add_argument('--input', nargs='+', required=True, help='Per-read .bed.gz files')
+    parser.add_argument('--out_dir', required=True, help='Directory for the <sample>.parquet / .arrow files')
+    parser.add_argument('--format', choices=['parquet', 'arrow'], default='parquet')
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for bed_file in args.input:
+        print(f"Converting {bed_file}", flush=True)
+        print(f"Written {convert(bed_file, args.out_dir, args.format)}", flush=True)
@@ -0,0 +1,381 @@
+import os
+import io
+import gzip
+import mmap
+import zlib
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from per_read import detect_columns, read_chunks, hypo_total_masks
+from bgzf import BgzfWriter, write_tabix_index
+
+# === CONFIG ===
+CHUNK_BYTES = 64 * 1024 * 1024   # decompressed bytes handled at once while indexing
+WRITE_BATCH = 1_000_000          # reads gathered per write call
+POOL_SHIFT = 40                  # bits reserved for the read index when several pools are mixed
+
+# Reads kept in the pools: all required SAM flag bits set, no excluded bit set, mapq >= min_mapq.
+# The default keeps R1 only (flag 64), as the old in-place awk filter of 01-create_samples.sh did.
+DEFAULT_READ_FILTER = {'require_flags': 64, 'exclude_flags': 0, 'min_mapq': 0}
+
+
+# === INDEXING ===
+def filter_tag(read_filter):
+    """Short name of a read filter, part of the spool name so differently filtered pools never mix"""
+    return f"f{read_filter['require_flags']}F{read_filter['exclude_flags']}q{read_filter['min_mapq']}"
+
+
+def spool_path(bed_file, cache_dir, read_filter=None):
+    """Path of the uncompressed, filtered copy of a per-read BED file inside the pool cache"""
+    base = os.path.basename(bed_file)
+    if base.endswith(".gz"):
+        base = base[:-3]
+    if base.endswith(".bed"):
+        base = base[:-4]
+    return os.path.join(cache_dir, f"{base}.{filter_tag(read_filter or DEFAULT_READ_FILTER)}.bed")
+
+
+def keep_lines(block, columns, read_filter):
+    """Mask of the lines of a block of complete records that pass the read filter"""
+    flag_col, mapq_col = columns.index('flag'), columns.index('mapq')
+    fields = pd.read_csv(io.BytesIO(block), sep="\t", header=None, usecols=[mapq_col, flag_col],
+                         skip_blank_lines=False, dtype=np.float64)
+    flag = fields[flag_col].fillna(0).values.astype(np.int64)
+    mapq = fields[mapq_col].fillna(-1).values
+    keep = ((flag & read_filter['require_flags']) == read_filter['require_flags'])
+    keep &= (flag & read_filter['exclude_flags']) == 0
+    keep &= mapq >= read_filter['min_mapq']
+    return keep
+
+
+def build_index(bed_file, cache_dir, read_filter=None):
+    """Decompress and filter a per-read BED once into the cache and record the byte offset of every read.
+
+    One streaming pass: the reads passing read_filter (default R1 only) are written to an uncompressed
+    spool and their offsets are stored as an int64 array with one entry more than there are reads,
+    so read i spans offsets[i]:offsets[i+1] in the spool. Header lines ('#') are dropped.
+    The input is never modified; an existing spool/index newer than the input is reused.
+    """
+    read_filter = read_filter or DEFAULT_READ_FILTER
+    spool = spool_path(bed_file, cache_dir, read_filter)
+    index = spool + ".offsets.npy"
+    if os.path.exists(index) and os.path.getmtime(index) >= os.path.getmtime(bed_file):
+        return spool, index
+
+    os.makedirs(cache_dir, exist_ok=True)
+    columns, _ = detect_columns(bed_file)
+    tmp = f".{os.getpid()}.tmp"
+    offsets = [np.zeros(1, dtype=np.int64)]
+    written = 0
+    with gzip.open(bed_file, 'rb') as infile, open(spool + tmp, 'wb') as out:
+        first = infile.readline()
+        buf = b"" if first.startswith(b"#") else first
+        while True:
+            chunk = infile.read(CHUNK_BYTES)
+            buf += chunk
+            if not chunk:
+                if buf and not buf.endswith(b"\n"):
+                    buf += b"\n"
+                cut = len(buf)
+            else:
+                cut = buf.rfind(b"\n") + 1
+            if cut:
+                block = np.frombuffer(buf, dtype=np.uint8, count=cut)
+                line_ends = np.flatnonzero(block == 10) + 1
+                line_starts = np.r_[0, line_ends[:-1]]
+                keep = keep_lines(buf[:cut], columns, read_filter)
+                lengths = (line_ends - line_starts)[keep]
+                offsets.append(np.cumsum(lengths) + written)
+                out.write(block[np.repeat(keep, line_ends - line_starts)].tobytes())
+                written += int(lengths.sum())
+                buf = buf[cut:]
+            if not chunk:
+                break
+
+    np.save(index + tmp + ".npy", np.concatenate(offsets))
+    os.replace(spool + tmp, spool)
+    os.replace(index + tmp + ".npy", index)
+    return spool, index
+
+
+def build_coordinates(spool):
+    """Chromosome code, start and end of every read of a spool (cached as .npy next to it).
+
+    Only needed for coordinate-sorted output, so ReadPool builds it only when asked to.
+    """
+    paths = [spool + ext for ext in (".chrom.npy", ".start.npy", ".end.npy")]
+    names_file = spool + ".chroms.txt"
+    if not all(os.path.exists(p) and os.path.getmtime(p) >= os.path.getmtime(spool) for p in paths + [names_file]):
+        names, codes, starts, ends = {}, [], [], []
+        if os.path.getsize(spool):
+            for chunk in pd.read_csv(spool, sep="\t", header=None, usecols=[0, 1, 2], dtype={0: str}, chunksize=5_000_000):
+                codes.append(np.array([names.setdefault(c, len(names)) for c in chunk[0].values], dtype=np.uint16))
+                starts.append(chunk[1].values.astype(np.int64))
+                ends.append(chunk[2].values.astype(np.int64))
+        tmp = f".{os.getpid()}.tmp"
+        for p, arrays, dtype in zip(paths, (codes, starts, ends), (np.uint16, np.int64, np.int64)):
+            np.save(p + tmp + ".npy", np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype))
+            os.replace(p + tmp + ".npy", p)
+        with open(names_file + tmp, 'w') as fh:
+            fh.write("\n".join(names) + "\n")
+        os.replace(names_file + tmp, names_file)
+    with open(names_file) as fh:
+        names = [line.rstrip("\n") for line in fh if line.strip()]
+    return names, [np.load(p, mmap_mode='r') for p in paths]
+
+
+# === POOLS ===
+class ReadPool:
+    """Reads from one or more per-read BED files, addressed by record number.
+
+    Only the offset index is held in memory (memory-mapped, 8 bytes per read); the read text
+    stays in the uncompressed spool on disk and is memory-mapped when records are gathered.
+    """
+
+    def __init__(self, files, cache_dir, coordinates=False, read_filter=None):
+        self.files = sorted(files)
+        self.spools = []
+        self.offsets = []
+        for f in self.files:
+            spool, index = build_index(f, cache_dir, read_filter)
+            self.spools.append(spool)
+            self.offsets.append(np.load(index, mmap_mode='r'))
+            if coordinates:
+                build_coordinates(spool)
+        self.bounds = np.cumsum([0] + [len(o) - 1 for o in self.offsets])
+        self._maps = None
+
+    def __len__(self):
+        return int(self.bounds[-1])
+
+    def maps(self):
+        """Memory-map the spools (lazily, so forked workers map them themselves)"""
+        if self._maps is None:
+            self._maps = []
+            for spool in self.spools:
+                with open(spool, 'rb') as fh:
+                    self._maps.append(mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(spool) else b"")
+        return self._maps
+
+    def sample(self, n, rng):
+        """Draw n distinct read indices from the pool"""
+        return rng.choice(len(self), size=n, replace=False, shuffle=False)
+
+    def locate(self, indices):
+        """Return (segment, start, end) arrays for the given pool indices"""
+        indices = np.asarray(indices, dtype=np.int64)
+        segments = np.searchsorted(self.bounds, indices, side='right') - 1
+        starts = np.empty(len(indices), dtype=np.int64)
+        ends = np.empty(len(indices), dtype=np.int64)
+        for k, offsets in enumerate(self.offsets):
+            sel = segments == k
+            if sel.any():
+                local = indices[sel] - self.bounds[k]
+                starts[sel] = offsets[local]
+                ends[sel] = offsets[local + 1]
+        return segments, starts, ends
+
+    def coordinates(self, indices, chrom_rank):
+        """Return (chromosome rank, start, end) arrays for the given pool indices"""
+        indices = np.asarray(indices, dtype=np.int64)
+        segments = np.searchsorted(self.bounds, indices, side='right') - 1
+        chroms = np.empty(len(indices), dtype=np.int64)
+        starts = np.empty(len(indices), dtype=np.int64)
+        ends = np.empty(len(indices), dtype=np.int64)
+        for k, spool in enumerate(self.spools):
+            sel = segments == k
+            if sel.any():
+                names, (codes, seg_starts, seg_ends) = build_coordinates(spool)
+                local = indices[sel] - self.bounds[k]
+                lookup = np.array([chrom_rank[n] for n in names] or [0], dtype=np.int64)
+                chroms[sel] = lookup[codes[local]]
+                starts[sel] = seg_starts[local]
+                ends[sel] = seg_ends[local]
+        return chroms, starts, ends
+
+    def chrom_names(self):
+        """All chromosome names occurring in the pool"""
+        return set().union(*(build_coordinates(spool)[0] for spool in self.spools))
+
+
+# === WINDOW COUNT POOLS (feature-space mixing) ===
+def build_window_summary(bed_file, windows, cache_dir, read_filter=None):
+    """Count the filtered reads of a per-read BED per category, once, and cache the result.
+
+    Categories are [hypomethylated per window, other counted reads per window, all remaining reads],
+    so the vector sums to the number of reads in the spool and a sample drawn from it is hypergeometric.
+    """
+    spool, _ = build_index(bed_file, cache_dir, read_filter)
+    summary = f"{spool}.{windows.checksum[:12]}.window_counts.npy"
+    if os.path.exists(summary) and os.path.getmtime(summary) >= os.path.getmtime(spool):
+        return np.load(summary)
+
+    n = len(windows)
+    counts = np.zeros(2 * n + 1, dtype=np.int64)
+    names, _ = detect_columns(bed_file)
+    chunks = read_chunks(spool, columns=['chr', 'start', 'mapq', 'num_cpg', 'num_mod'], names=names) if os.path.getsize(spool) else []
+    for chunk in chunks:
+        hypo, total = hypo_total_masks(chunk['mapq'].values, chunk['num_cpg'].values, chunk['num_mod'].values)
+        window = windows.index(chunk['chr'].values, chunk['start'].values)
+        hypo &= window >= 0
+        other = total & ~hypo & (window >= 0)
+        counts[:n] += np.bincount(window[hypo], minlength=n)
+        counts[n:2 * n] += np.bincount(window[other], minlength=n)
+        counts[-1] += len(chunk) - int(hypo.sum()) - int(other.sum())
+    tmp = f".{os.getpid()}.tmp.npy"
+    np.save(summary + tmp, counts)
+    os.replace(summary + tmp, summary)
+    return counts
+
+
+class CountPool:
+    """Stand-in for ReadPool that only knows how many reads of each window category the files hold.
+
+    sample() returns drawn category counts instead of read indices: drawing n reads without
+    replacement from the pool is a multivariate hypergeometric draw over the categories.
+    """
+
+    def __init__(self, files, cache_dir, windows, read_filter=None):
+        self.files = sorted(files)
+        self.n_windows = len(windows)
+        self.counts = sum(build_window_summary(f, windows, cache_dir, read_filter) for f in self.files)
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def sample(self, n, rng):
+        """Category counts of n reads drawn without replacement"""
+        return rng.multivariate_hypergeometric(self.counts, n, method='marginals')
+
+
+def mix_counts(parts, n_windows):
+    """Sum the drawn category counts of all parts into (hypo, total) per window"""
+    drawn = sum(counts for _, counts in parts)
+    hypo = drawn[:n_windows]
+    return hypo, hypo + drawn[n_windows:2 * n_windows]
+
+
+def combine_parts(parts):
+    """Pack [(pool_number, indices), ...] into one int64 array (pool number in the high bits)"""
+    arrays = [np.asarray(idx, dtype=np.int64) | (np.int64(p) << POOL_SHIFT) for p, idx in parts]
+    return np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+
+
+def iter_records(pools, keys):
+    """Yield (raw text, record lengths) of the reads referenced by packed keys, in key order, in batches"""
+    mask = (np.int64(1) << POOL_SHIFT) - 1
+    for lo in range(0, len(keys), WRITE_BATCH):
+        batch = keys[lo:lo + WRITE_BATCH]
+        pool_ids = batch >> POOL_SHIFT
+        local = batch & mask
+        maps = []
+        map_ids = np.empty(len(batch), dtype=np.int64)
+        starts = np.empty(len(batch), dtype=np.int64)
+        ends = np.empty(len(batch), dtype=np.int64)
+        for p in np.unique(pool_ids):
+            sel = pool_ids == p
+            pool = pools[p]
+            segments, starts[sel], ends[sel] = pool.locate(local[sel])
+            map_ids[sel] = segments + len(maps)
+            maps.extend(pool.maps())
+        yield b"".join([maps[m][a:b] for m, a, b in zip(map_ids.tolist(), starts.tolist(), ends.tolist())]), ends - starts
+
+
+def sort_by_coordinate(pools, keys):
+    """Order packed keys like sort-bed (chromosome name, start, end); returns keys and their coordinates"""
+    mask = (np.int64(1) << POOL_SHIFT) - 1
+    pool_ids = keys >> POOL_SHIFT
+    used = np.unique(pool_ids)
+    names = sorted(set().union(*(pools[p].chrom_names() for p in used)))
+    rank = {name: i for i, name in enumerate(names)}
+    chroms = np.empty(len(keys), dtype=np.int64)
+    starts = np.empty(len(keys), dtype=np.int64)
+    ends = np.empty(len(keys), dtype=np.int64)
+    for p in used:
+        sel = pool_ids == p
+        chroms[sel], starts[sel], ends[sel] = pools[p].coordinates(keys[sel] & mask, rank)
+    order = np.lexsort((ends, starts, chroms))
+    return keys[order], names, chroms[order], starts[order], ends[order]
+
+
+def write_sample(pools, parts, out_path, rng, sort=False, threads=4):
+    """Stream the selected reads of all parts into a BGZF-compressed BED.
+
+    By default the reads of all parts are shuffled together. With sort=True they are written in
+    coordinate order instead and a tabix index (<out_path>.tbi) is written next to the file.
+    """
+    keys = combine_parts(parts)
+    if sort:
+        keys, names, chroms, begs, ends = sort_by_coordinate(pools, keys)
+    else:
+        rng.shuffle(keys)
+
+    # BGZF blocks carry no timestamps, so the file is identical between runs
+    lengths = []
+    with BgzfWriter(out_path, threads=threads) as out:
+        for block, block_lengths in iter_records(pools, keys):
+            out.write(block)
+            if sort:
+                lengths.append(block_lengths)
+
+    if sort and len(keys):
+        lengths = np.concatenate(lengths)
+        record_starts = np.cumsum(lengths) - lengths
+        # index only the chromosomes present, numbered in file order
+        present, chrom_ids = np.unique(chroms, return_inverse=True)
+        write_tabix_index(out_path + ".tbi", [names[c] for c in present], chrom_ids, begs, ends,
+                          out.virtual_offsets(record_starts), out.virtual_offsets(record_starts + lengths))
+    return len(keys)
+
+
+# === SEEDING AND PARALLEL GENERATION ===
+def sample_rng(seed, cohort, i):
+    """Independent random stream for sample i of a cohort.
+
+    The stream is the SeedSequence child with spawn key (crc32(cohort), i), so it depends only
+    on the base seed and the sample's identity, not on how many samples are built or in what order.
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(zlib.crc32(cohort.encode()), i)))
+
+
+def run_tasks(func, tasks, n_workers, on_result=None):
+    """Run func over tasks serially or on a fork-based process pool, keeping task order.
+
+    Forked workers inherit the memory-mapped pool indexes, so the pools are shared read-only.
+    on_result(task, result) is called in the parent as soon as each task finishes.
+    """
+    if n_workers <= 1:
+        results = []
+        for t in tasks:
+            results.append(func(t))
+            if on_result:
+                on_result(t, results[-1])
+        return results
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("fork")) as executor:
+        futures = {executor.submit(func, t): n for n, t in enumerate(tasks)}
+        results = [None] * len(tasks)
+        for future in as_completed(futures):
+            n = futures[future]
+            results[n] = future.result()
+            if on_result:
+                on_result(tasks[n], results[n])
+        return results
+
+
+def prepare_file(bed_file, cache_dir, read_filter=None, coordinates=False, windows=None):
+    """Build everything a pool needs from one input file (filtered spool + index, and coordinates or window counts)"""
+    spool, _ = build_index(bed_file, cache_dir, read_filter)
+    if coordinates:
+        build_coordinates(spool)
+    if windows is not None:
+        build_window_summary(bed_file, windows, cache_dir, read_filter)
+    return bed_file
+
+
+def prepare_files(files, cache_dir, n_workers, read_filter=None, coordinates=False, windows=None):
+    """Filter and index all input files in parallel, one streaming pass per file, before the pools are built"""
+    files = sorted(set(files))
+    run_tasks(functools.partial(prepare_file, cache_dir=cache_dir, read_filter=read_filter,
+                                coordinates=coordinates, windows=windows), files, n_workers)
@@ -0,0 +1,138 @@
+import os
+import json
+import argparse
+import numpy as np
+from per_read import CHUNK_READS, read_chunks, methylation_level
+
+# === STORE LAYOUT ===
+# <name>.reads/meta.json          columns, dtypes and reads per chromosome
+# <name>.reads/<chrom>.<col>.bin  raw little-endian array of one column for one chromosome
+# read_id and the per-CpG position lists are not kept; everything downstream works on the columns below.
+# Every read of the BED is kept: reads without CpGs ('.') get num_cpg = num_mod = 0 and meth NaN.
+# Only feature extraction reads the stores (window_counts.count_store; Extract_features.py --store_dir converts every
+# sample once and counts from its store). Sampling and R1 filtering for the synthetic samples stay on the
+# generator's spools and offset indexes (read_pools.py), which already avoid reparsing the calls.
+STORE_COLUMNS = {
+    'start': np.int32,
+    'end': np.int32,
+    'mapq': np.uint8,
+    'reverse': np.uint8,       # 1 for reads on the '-' strand
+    'insert_size': np.int32,
+    'flag': np.uint16,
+    'num_cpg': np.uint16,
+    'num_mod': np.uint16,
+    'meth': np.float16,        # num_mod / num_cpg, NaN without CpGs
+}
+SOURCE_COLUMNS = ['chr', 'start', 'end', 'mapq', 'orientation', 'insert_size', 'flag', 'num_cpg', 'num_mod']
+STORE_SUFFIX = ".reads"
+
+
+def store_path(bed_file, out_dir):
+    """Store directory for a per-read BED file"""
+    base = os.path.basename(bed_file)
+    for ext in (".gz", ".bed"):
+        if base.endswith(ext):
+            base = base[:-len(ext)]
+    return os.path.join(out_dir, base + STORE_SUFFIX)
+
+
+def is_current(bed_file, out_dir):
+    """The store of a BED exists, was converted from it and is newer than it"""
+    meta = os.path.join(store_path(bed_file, out_dir), "meta.json")
+    if not os.path.exists(meta) or os.path.getmtime(meta) < os.path.getmtime(bed_file):
+        return False
+    with open(meta) as fh:
+        return json.load(fh).get('source') == os.path.abspath(bed_file)
+
+
+def converted(bed_file, out_dir, chunksize=CHUNK_READS):
+    """Store of a BED in out_dir, converted only when it is missing or older than the BED"""
+    if is_current(bed_file, out_dir):
+        return store_path(bed_file, out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    return convert(bed_file, out_dir, chunksize)
+
+
+def convert(bed_file, out_dir, chunksize=CHUNK_READS):
+    """Convert one per-read BED(.gz) into a columnar store in a single streaming pass"""
+    path = store_path(bed_file, out_dir)
+    tmp = path + ".tmp"
+    os.makedirs(tmp, exist_ok=True)
+    for f in os.listdir(tmp):
+        os.remove(os.path.join(tmp, f))
+
+    counts = {}
+    for chunk in read_chunks(bed_file, columns=SOURCE_COLUMNS, chunksize=chunksize):
+        chunk = chunk.fillna({'num_cpg': 0, 'num_mod': 0})  # reads without CpGs still count as fragments
+        columns = {
+            'start': chunk['start'].values,
+            'end': chunk['end'].values,
+            'mapq': chunk['mapq'].values,
+            'reverse': (chunk['orientation'].values == '-'),
+            'insert_size': chunk['insert_size'].values,
+            'flag': chunk['flag'].values,
+            'num_cpg': chunk['num_cpg'].values,
+            'num_mod': chunk['num_mod'].values,
+            'meth': methylation_level(chunk['num_cpg'].values, chunk['num_mod'].values),
+        }
+        chroms = chunk['chr'].values
+        for chrom in dict.fromkeys(chroms):
+            sel = chroms == chrom
+            for col, dtype in STORE_COLUMNS.items():
+                with open(os.path.join(tmp, f"{chrom}.{col}.bin"), 'ab') as out:
+                    out.write(np.ascontiguousarray(columns[col][sel], dtype=dtype).tobytes())
+            counts[chrom] = counts.get(chrom, 0) + int(sel.sum())
+
+    meta = {
+        'source': os.path.abspath(bed_file),
+        'columns': {col: np.dtype(dtype).str for col, dtype in STORE_COLUMNS.items()},
+        'chroms': counts,
+    }
+    with open(os.path.join(tmp, "meta.json"), 'w') as fh:
+        json.dump(meta, fh, indent=1)
+    if os.path.isdir(path):
+        for f in os.listdir(path):
+            os.remove(os.path.join(path, f))
+        os.rmdir(path)
+    os.replace(tmp, path)
+    return path
+
+
+# === READING ===
+class ReadStore:
+    """Memory-mapped columnar per-read store; every column access is zero-copy"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as fh:
+            self.meta = json.load(fh)
+        self.chroms = list(self.meta['chroms'])
+
+    def __len__(self):
+        return sum(self.meta['chroms'].values())
+
+    def column(self, chrom, col):
+        """One column of one chromosome as a read-only memmap"""
+        n = self.meta['chroms'].get(chrom, 0)
+        dtype = np.dtype(self.meta['columns'][col])
+        if n == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(self.path, f"{chrom}.{col}.bin"), dtype=dtype, mode='r', shape=(n,))
+
+
+# === CONVERT FROM THE COMMAND LINE ===
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert per-read BED files into memory-mappable columnar stores")
+    parser.add_argument('--input', nargs='+', required=True, help='Per-read .bed.gz files')
+    parser.add_argument('--out_dir', required=True, help='Directory for the <sample>.reads stores')
+    parser.add_argument('--force', action='store_true', help='Convert again even when a store is newer than its BED')
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for bed_file in args.input:
+        if not args.force and is_current(bed_file, args.out_dir):
+            print(f"Up to date: {store_path(bed_file, args.out_dir)}", flush=True)
+            continue
+        print(f"Converting {bed_file}", flush=True)
+        path = convert(bed_file, args.out_dir)
+        print(f"Written {path} ({len(ReadStore(path)):,} reads)", flush=True)
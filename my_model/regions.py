@@ -0,0 +1,63 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+class Regions:
+    """Arbitrary BED region set (DMRs, CpG islands, promoters, ...) with a sorted-array interval index.
+
+    Regions may have any size, overlap or nest; they keep the order of the BED file. A read [s, e) overlaps a
+    region [S, E) when s < E and e > S. Since every read with e <= S also has s < E, the overlap count of a
+    region is #(reads with s < E) - #(reads with e <= S): two searchsorted lookups per read against the sorted
+    region ends / starts of its chromosome and a cumulative sum, whatever the number of regions.
+    """
+
+    def __init__(self, regions_bed):
+        bed = pd.read_csv(regions_bed, sep="\t", header=None, usecols=[0, 1, 2], names=['chr', 'start', 'end'],
+                          dtype={'chr': str}, comment="#")
+        bed = bed[~bed['chr'].isin(['track', 'browser'])].reset_index(drop=True)
+        bed[['start', 'end']] = bed[['start', 'end']].astype(np.int64)
+        self.bed = bed
+        self.name = os.path.basename(regions_bed).split(".")[0]
+        with open(regions_bed, 'rb') as fh:
+            self.checksum = hashlib.sha1(fh.read()).hexdigest()
+        # per chromosome: sorted ends / starts and the region number of each sorted position
+        self.index = {}
+        for chrom, rows in bed.groupby('chr', sort=False).indices.items():
+            by_end = rows[np.argsort(bed['end'].values[rows], kind='stable')]
+            by_start = rows[np.argsort(bed['start'].values[rows], kind='stable')]
+            self.index[chrom] = (bed['end'].values[by_end], by_end, bed['start'].values[by_start], by_start)
+
+    def __len__(self):
+        return len(self.bed)
+
+    def names(self):
+        """Feature names as used in the feature matrix (chr:start:end)"""
+        return (self.bed['chr'] + ":" + self.bed['start'].astype(str) + ":" + self.bed['end'].astype(str)).tolist()
+
+    def add_counts(self, counts, chroms, starts, ends, masks):
+        """Add the overlap counts of the reads selected by each mask to counts (one row per mask, regions last).
+
+        chroms is an array with the chromosome of each read, or a single name when all reads share it.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        if isinstance(chroms, str):
+            groups = [(chroms, slice(None))]
+        else:
+            codes, uniques = pd.factorize(np.asarray(chroms))
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+            groups = [(chrom, order[bounds[i]:bounds[i + 1]]) for i, chrom in enumerate(uniques)]
+        for chrom, sel in groups:
+            if chrom not in self.index:
+                continue
+            end_sorted, by_end, start_sorted, by_start = self.index[chrom]
+            n = len(by_end)
+            before_end = np.searchsorted(end_sorted, starts[sel], side='right')    # read start < end of sorted positions >= this
+            before_start = np.searchsorted(start_sorted, ends[sel], side='left')   # read end <= start of sorted positions >= this
+            for row, mask in enumerate(masks):
+                mask = mask[sel]
+                counts[row, by_end] += np.cumsum(np.bincount(before_end[mask], minlength=n + 1))[:n]
+                counts[row, by_start] -= np.cumsum(np.bincount(before_start[mask], minlength=n + 1))[:n]
@@ -0,0 +1,81 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+from manifest import spec_hash, file_sha256
+
+# === CACHE LAYOUT ===
+# <cache_dir>/inputs/<path id>.json   sha256 of an input, valid while its size and mtime are unchanged
+# <cache_dir>/<kk>/<key><suffix>      one result per key; the key is the spec_hash of everything the result
+#                                     depends on (input content, windows checksum, parameters), so a changed
+#                                     input or parameter simply misses and unchanged work is never redone
+# Results are written to a temporary file and renamed, so an existing entry is always complete.
+
+
+def input_hash(path, cache_dir):
+    """sha256 of a per-read BED (or of every file of a .reads store), memoized by path, size and mtime"""
+    path = os.path.realpath(path)
+    files = sorted(os.path.join(path, f) for f in os.listdir(path)) if os.path.isdir(path) else [path]
+    stamp = [[os.path.getsize(f), os.stat(f).st_mtime_ns] for f in files]
+    memo = os.path.join(cache_dir, "inputs", hashlib.sha1(path.encode()).hexdigest() + ".json")
+    if os.path.exists(memo):
+        with open(memo) as fh:
+            entry = json.load(fh)
+        if entry['path'] == path and entry['stamp'] == stamp:
+            return entry['sha256']
+    if len(files) == 1 and files[0] == path:
+        digest = file_sha256(path)
+    else:
+        digest = hashlib.sha256("".join(os.path.basename(f) + file_sha256(f) for f in files).encode()).hexdigest()
+    os.makedirs(os.path.dirname(memo), exist_ok=True)
+    with open(memo + f".{os.getpid()}.tmp", 'w') as fh:
+        json.dump({'path': path, 'stamp': stamp, 'sha256': digest}, fh)
+    os.replace(memo + f".{os.getpid()}.tmp", memo)
+    return digest
+
+
+class ResultCache:
+    """Content-addressed store of per-sample stage results"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, **spec):
+        return spec_hash(spec)
+
+    def path(self, key, suffix):
+        return os.path.join(self.cache_dir, key[:2], key + suffix)
+
+    def _tmp(self, key, suffix):
+        path = self.path(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path, f"{path}.{os.getpid()}.tmp{suffix}"
+
+    def load_arrays(self, key):
+        """Arrays of an .npz entry as a dict, None on a miss"""
+        path = self.path(key, ".npz")
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+
+    def save_arrays(self, key, arrays):
+        path, tmp = self._tmp(key, ".npz")
+        with open(tmp, 'wb') as fh:
+            np.savez_compressed(fh, **arrays)
+        os.replace(tmp, path)
+
+    def fetch_file(self, key, suffix, dest):
+        """Copy a file entry to dest; False on a miss"""
+        path = self.path(key, suffix)
+        if not os.path.exists(path):
+            return False
+        shutil.copyfile(path, dest)
+        return True
+
+    def store_file(self, key, suffix, src):
+        path, tmp = self._tmp(key, suffix)
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, path)
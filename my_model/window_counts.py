@@ -0,0 +1,127 @@
+import os
+import numpy as np
+from per_read import CHUNK_READS, INPUT_SUFFIXES, read_chunks, hypo_total_masks
+from read_store import STORE_SUFFIX, ReadStore
+from count_cache import N_BINS, read_bins, threshold_bins, accumulate
+from fragment_counts import FRAGMENT_COLUMNS, N_FRAGMENT_ROWS, accumulate_fragments
+
+# Columns the window counts need; everything else in the per-read calls is never parsed
+COUNT_COLUMNS = ['chr', 'start', 'end', 'mapq', 'num_cpg', 'num_mod']
+
+
+def sample_name(path):
+    """Sample name of a per-read BED(.gz), Parquet / Arrow file or a .reads store"""
+    base = os.path.basename(os.path.normpath(path))
+    for ext in INPUT_SUFFIXES + (STORE_SUFFIX,):
+        if base.endswith(ext):
+            base = base[:-len(ext)]
+    return base
+
+
+def resolution_label(window_size):
+    """Short name of a window size, e.g. 5Mb, 100kb"""
+    if window_size % 1_000_000 == 0:
+        return f"{window_size // 1_000_000}Mb"
+    if window_size % 1_000 == 0:
+        return f"{window_size // 1_000}kb"
+    return f"{window_size}bp"
+
+
+# === COUNTING ===
+# Reads are counted by the window of their start, and separately for the reads crossing into the next
+# window. Windows.coarsen() turns these into bedmap-style overlap counts at this or any coarser size.
+# With histogram=True the reads are binned by (num_cpg, methylation) instead (see count_cache.py) and the
+# hypo/total counts are derived from the histogram, so both come from the same single pass.
+# With fragments=True the fragment size classes and size histogram (fragment_counts.py) are counted alongside,
+# and hypo/total overlap counts of any region sets (regions.py) in the same pass.
+class _Counter:
+    def __init__(self, windows, histogram, fragments=False, regions=()):
+        self.windows = windows
+        self.histogram = histogram
+        self.fragments = fragments
+        self.regions = list(regions)
+        self.region_counts = [np.zeros((2, len(r)), dtype=np.int64) for r in self.regions]
+        rows = N_BINS if histogram else 2
+        self.start = np.zeros((rows, len(windows)), dtype=np.int64)
+        self.cross = np.zeros((rows, len(windows)), dtype=np.int64)
+        if fragments:
+            self.fragment_start = np.zeros((N_FRAGMENT_ROWS, len(windows)), dtype=np.int64)
+            self.fragment_cross = np.zeros((N_FRAGMENT_ROWS, len(windows)), dtype=np.int64)
+
+    def add(self, chroms, starts, ends, mapq, num_cpg, num_mod, insert_size=None, flag=None):
+        first, second = self.windows.overlap_index(chroms, starts, ends)
+        if self.fragments:
+            accumulate_fragments(self.fragment_start, self.fragment_cross, mapq, insert_size, flag,
+                                 num_cpg, num_mod, first, second)
+        if self.regions:
+            masks = hypo_total_masks(mapq, num_cpg, num_mod)
+            for regions, counts in zip(self.regions, self.region_counts):
+                regions.add_counts(counts, chroms, starts, ends, masks)
+        if self.histogram:
+            accumulate(self.start, self.cross, read_bins(mapq, num_cpg, num_mod), first, second, len(self.windows))
+            return
+        for row, mask in enumerate(hypo_total_masks(mapq, num_cpg, num_mod)):
+            self.start[row] += np.bincount(first[mask & (first >= 0)], minlength=len(self.windows))
+            self.cross[row] += np.bincount(first[mask & (second >= 0)], minlength=len(self.windows))
+
+    def hypo_total(self):
+        """(start, crossing) counts of hypomethylated (row 0) and total (row 1) reads"""
+        if not self.histogram:
+            return self.start, self.cross
+        selection = np.vstack(threshold_bins()).astype(np.int64)
+        return selection @ self.start, selection @ self.cross
+
+
+def count_bed(path, windows, chunksize=CHUNK_READS, histogram=False, fragments=False, regions=()):
+    """Count the reads of a per-read BED in one streaming pass"""
+    counter = _Counter(windows, histogram, fragments, regions)
+    columns = COUNT_COLUMNS + FRAGMENT_COLUMNS if fragments else COUNT_COLUMNS
+    for chunk in read_chunks(path, columns=columns, chunksize=chunksize):
+        counter.add(chunk['chr'].values, chunk['start'].values, chunk['end'].values,
+                    chunk['mapq'].values, chunk['num_cpg'].values, chunk['num_mod'].values,
+                    *([chunk['insert_size'].values, chunk['flag'].values] if fragments else []))
+    return counter
+
+
+def count_store(path, windows, chunksize=CHUNK_READS, histogram=False, fragments=False, regions=()):
+    """Same counts from a columnar .reads store, chromosome by chromosome in slices of chunksize reads"""
+    store = ReadStore(path)
+    counter = _Counter(windows, histogram, fragments, regions)
+    columns = COUNT_COLUMNS[1:] + FRAGMENT_COLUMNS if fragments else COUNT_COLUMNS[1:]
+    for chrom in store.chroms:
+        if chrom not in windows.offsets:
+            continue
+        memmaps = [store.column(chrom, col) for col in columns]
+        for first in range(0, store.meta['chroms'][chrom], chunksize):
+            counter.add(chrom, *(values[first:first + chunksize] for values in memmaps))
+    return counter
+
+
+def count_file(path, windows, chunksize=CHUNK_READS, histogram=False, fragments=False, regions=()):
+    """Start / crossing counts of a per-read BED(.gz) or a .reads store at windows (and region counts), as a counter"""
+    if os.path.isdir(path):
+        return count_store(path, windows, chunksize, histogram, fragments, regions)
+    return count_bed(path, windows, chunksize, histogram, fragments, regions)
+
+
+def count_reads(path, windows, chunksize=CHUNK_READS, resolutions=None, histogram=False, fragments=False):
+    """(hypo, total) overlap counts per window for a per-read BED(.gz) or a .reads store.
+
+    With resolutions (a list of Windows, each a multiple of the finest), the input is read once
+    at the finest size and a list with the (hypo, total) counts of every resolution is returned.
+    With histogram and/or fragments a tuple is returned instead: the counts, then (finest windows,
+    start histogram, crossing histogram) with histogram, then the (N_FRAGMENT_ROWS, windows) fragment
+    counts (a list per resolution, as the counts) with fragments.
+    """
+    targets = resolutions or [windows]
+    finest = min(targets, key=lambda w: w.window_size)
+    counter = count_file(path, finest, chunksize, histogram, fragments)
+    start_counts, cross_counts = counter.hypo_total()
+    counts = [tuple(finest.coarsen(target, start_counts, cross_counts)) for target in targets]
+    result = [counts if resolutions else counts[0]]
+    if histogram:
+        result.append((finest, counter.start, counter.cross))
+    if fragments:
+        fragment_counts = [finest.coarsen(target, counter.fragment_start, counter.fragment_cross) for target in targets]
+        result.append(fragment_counts if resolutions else fragment_counts[0])
+    return tuple(result) if len(result) > 1 else result[0]
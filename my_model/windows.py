@@ -0,0 +1,99 @@
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+class Windows:
+    """Fixed-size genome windows as produced by `bedops --chop` (last window of a chromosome may be shorter).
+
+    Reads are assigned to the window containing their start, so a window lookup is an integer division.
+    """
+
+    def __init__(self, windows_bed):
+        if isinstance(windows_bed, pd.DataFrame):
+            bed = windows_bed.reset_index(drop=True)
+        else:
+            bed = pd.read_csv(windows_bed, sep="\t", header=None, usecols=[0, 1, 2], names=['chr', 'start', 'end'],
+                              dtype={'chr': str})
+        self.bed = bed
+        self.window_size = int((bed['end'] - bed['start']).max())
+        self.chroms = list(dict.fromkeys(bed['chr']))
+        n_per_chrom = bed.groupby('chr', sort=False).size()
+        self.n_windows = {c: int(n_per_chrom[c]) for c in self.chroms}
+        self.chrom_ends = bed.groupby('chr', sort=False)['end'].max().to_dict()
+        self.offsets = dict(zip(self.chroms, np.cumsum([0] + [self.n_windows[c] for c in self.chroms[:-1]]).tolist()))
+        if isinstance(windows_bed, pd.DataFrame):
+            self.checksum = hashlib.sha1(bed.to_csv(sep="\t", header=False, index=False).encode()).hexdigest()
+        else:
+            with open(windows_bed, 'rb') as fh:
+                self.checksum = hashlib.sha1(fh.read()).hexdigest()
+
+    def __len__(self):
+        return len(self.bed)
+
+    def names(self):
+        """Feature names as used in the feature matrix (chr:start:end)"""
+        return (self.bed['chr'] + ":" + self.bed['start'].astype(str) + ":" + self.bed['end'].astype(str)).tolist()
+
+    def index(self, chroms, starts):
+        """Global window number for each read, -1 for reads outside the windows.
+
+        chroms is an array with the chromosome of each read, or a single name when all reads share it.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        if isinstance(chroms, str):
+            return self._index_chrom(chroms, starts)
+        chroms = np.asarray(chroms)
+        result = np.full(len(starts), -1, dtype=np.int64)
+        for chrom in np.unique(chroms):
+            sel = chroms == chrom
+            result[sel] = self._index_chrom(chrom, starts[sel])
+        return result
+
+    def _index_chrom(self, chrom, starts):
+        if chrom not in self.offsets:
+            return np.full(len(starts), -1, dtype=np.int64)
+        local = starts // self.window_size
+        return np.where((starts >= 0) & (starts < self.chrom_ends[chrom]), local + self.offsets[chrom], -1)
+
+    def overlap_index(self, chroms, starts, ends):
+        """Windows overlapping each read as (first, second), as bedmap --count assigns them.
+
+        first is the window of the read start; second is the next window for the few reads that
+        cross a window boundary and -1 otherwise (reads are far shorter than a window).
+        """
+        first = self.index(chroms, starts)
+        last = self.index(chroms, np.asarray(ends, dtype=np.int64) - 1)
+        second = np.where((first >= 0) & (last > first), last, -1)
+        return first, second
+
+    def chop(self, window_size):
+        """Windows of another size over the same chromosomes, as `bedops --chop window_size` would make them"""
+        rows = []
+        for chrom in self.chroms:
+            starts = np.arange(0, self.chrom_ends[chrom], window_size)
+            rows.append(pd.DataFrame({'chr': chrom, 'start': starts,
+                                      'end': np.minimum(starts + window_size, self.chrom_ends[chrom])}))
+        return Windows(pd.concat(rows, ignore_index=True))
+
+    def coarsen(self, coarse, start_counts, cross_counts):
+        """Overlap counts in coarse windows from start / boundary-crossing counts in these (finer) windows.
+
+        A read overlaps the coarse window of its start plus, when it crosses a fine boundary that is also
+        a coarse boundary, the next coarse window; so summing start counts and adding the crossings of the
+        last fine window before each coarse window gives exactly what counting at the coarse size gives.
+        Counts may have leading dimensions (e.g. hypo/total rows); windows are the last axis.
+        """
+        factor = coarse.window_size // self.window_size
+        if coarse.window_size % self.window_size or coarse.chroms != self.chroms:
+            raise ValueError(f"Cannot derive {coarse.window_size} bp windows from {self.window_size} bp windows")
+        start_counts = np.asarray(start_counts)
+        cross_counts = np.asarray(cross_counts)
+        result = np.zeros(start_counts.shape[:-1] + (len(coarse),), dtype=start_counts.dtype)
+        for chrom in self.chroms:
+            fine = slice(self.offsets[chrom], self.offsets[chrom] + self.n_windows[chrom])
+            n_coarse = coarse.n_windows[chrom]
+            out = result[..., coarse.offsets[chrom]:coarse.offsets[chrom] + n_coarse]
+            out += np.add.reduceat(start_counts[..., fine], np.arange(0, self.n_windows[chrom], factor), axis=-1)
+            out[..., 1:] += cross_counts[..., fine][..., factor - 1:(n_coarse - 1) * factor:factor]
+        return result